@@ -0,0 +1,255 @@
+# anticollision.py
+
+import logging
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from trace_query import resample_traces
+from config import PROXIMITY_THRESHOLD, PROXIMITY_STEP, PROXIMITY_BATCH_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+EPSILON = 1e-12
+
+
+def segment_distances(p1, q1, p2, q2):
+    """Closest approach between segments p1-q1 and p2-q2, row by row.
+
+    Returns the distance and the fractions s, t of the closest points along each segment.
+    """
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.einsum('ij,ij->i', d1, d1)
+    e = np.einsum('ij,ij->i', d2, d2)
+    f = np.einsum('ij,ij->i', d2, r)
+    c = np.einsum('ij,ij->i', d1, r)
+    b = np.einsum('ij,ij->i', d1, d2)
+    denom = a * e - b * b
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Closest point of the infinite lines, clamped to the first segment; parallel segments start at s = 0
+        s = np.where(denom > EPSILON, np.clip((b * f - c * e) / denom, 0.0, 1.0), 0.0)
+        t = np.where(e > EPSILON, (b * s + f) / e, 0.0)
+        # Clamping t to the second segment moves the closest point on the first
+        s = np.where(t < 0, np.where(a > EPSILON, np.clip(-c / a, 0.0, 1.0), 0.0), s)
+        s = np.where(t > 1, np.where(a > EPSILON, np.clip((b - c) / a, 0.0, 1.0), 0.0), s)
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    s = np.nan_to_num(s)
+
+    closest_1 = p1 + s[:, None] * d1
+    closest_2 = p2 + t[:, None] * d2
+    return np.linalg.norm(closest_1 - closest_2, axis=1), s, t
+
+
+class TraceSegments:
+    """Straight segments of resampled traces, labelled with a hole number across all datasets."""
+
+    def __init__(self, df_dh_traces, step=PROXIMITY_STEP):
+        df_stations = resample_traces(df_dh_traces, step) if step else df_dh_traces
+        if 'Dataset' not in df_stations.columns:
+            df_stations = df_stations.assign(Dataset=None)
+        keys = df_stations[['Dataset', 'HoleID']].astype(str)
+        hole_codes = keys.groupby(['Dataset', 'HoleID'], sort=False).ngroup().to_numpy()
+        order = np.lexsort((df_stations['Depth'].to_numpy(dtype=float), hole_codes))
+        hole_codes = hole_codes[order]
+        depth = df_stations['Depth'].to_numpy(dtype=float)[order]
+        xyz = df_stations[['DH_X', 'DH_Y', 'DH_Z']].to_numpy(dtype=float)[order]
+
+        first_rows = np.flatnonzero(np.r_[True, hole_codes[1:] != hole_codes[:-1]])
+        self.holes = keys.iloc[order[first_rows]].reset_index(drop=True)
+
+        # A segment joins consecutive stations of one hole where both are located
+        same_hole = hole_codes[1:] == hole_codes[:-1]
+        located = ~np.isnan(xyz).any(axis=1)
+        valid = same_hole & located[1:] & located[:-1]
+        self.hole = hole_codes[:-1][valid]
+        self.start = xyz[:-1][valid]
+        self.end = xyz[1:][valid]
+        self.depth_from = depth[:-1][valid]
+        self.depth_to = depth[1:][valid]
+        self.midpoint = (self.start + self.end) / 2
+        self.half_length = np.linalg.norm(self.end - self.start, axis=1) / 2
+        self.max_half_length = float(self.half_length.max()) if len(self.hole) else 0.0
+
+    def __len__(self):
+        return len(self.hole)
+
+
+def other_hole_bounds(segments, tree, subset):
+    """Upper bound on the nearest-neighbour distance of the holes of a subset of segments.
+
+    Uses the nearest segment midpoint of another hole; holes outside the subset stay inf.
+    """
+    bounds = np.full(len(segments.holes), np.inf)
+    pending = subset
+    k = 8
+    while len(pending):
+        k_query = min(k, len(segments))
+        dist, idx = tree.query(segments.midpoint[pending], k_query)
+        dist, idx = dist.reshape(len(pending), -1), idx.reshape(len(pending), -1)
+        other = segments.hole[idx] != segments.hole[pending][:, None]
+        has_other = other.any(axis=1)
+        first_other = np.argmax(other, axis=1)
+        # Midpoint distance plus both half lengths bounds the segment-segment distance from above
+        rows = np.flatnonzero(has_other)
+        found = pending[rows]
+        nearest_other = idx[rows, first_other[rows]]
+        bound = dist[rows, first_other[rows]] + segments.half_length[found] + segments.half_length[nearest_other]
+        np.minimum.at(bounds, segments.hole[found], bound)
+
+        # Segments that only saw their own hole retry with more neighbours, unless their hole already has a bound
+        if k_query >= len(segments):
+            break
+        pending = pending[~has_other & np.isinf(bounds[segments.hole[pending]])]
+        k *= 4
+    return bounds
+
+
+def ball_pairs(segments, tree, subset, radius, batch_size=PROXIMITY_BATCH_SEGMENTS):
+    """Yield (i, j) arrays of segment pairs from different holes whose bounding spheres come within radius.
+
+    subset holds the i segments and radius one search radius per subset segment; they
+    are searched in batches to bound memory.
+    """
+    for lo in range(0, len(subset), batch_size):
+        batch = subset[lo:lo + batch_size]
+        search = radius[lo:lo + batch_size] + segments.half_length[batch] + segments.max_half_length
+        candidates = tree.query_ball_point(segments.midpoint[batch], search, return_sorted=False)
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=len(candidates))
+        if not counts.sum():
+            continue
+        i = np.repeat(batch, counts)
+        j = np.concatenate([np.asarray(c, dtype=np.int64) for c in candidates])
+        other = segments.hole[i] != segments.hole[j]
+        yield i[other], j[other]
+
+
+def threshold_pairs(segments, tree, threshold, batch_size=PROXIMITY_BATCH_SEGMENTS):
+    """Yield (i, j) arrays, both ways round, of segment pairs from different holes that may lie within threshold."""
+    pairs = tree.query_pairs(threshold + 2 * segments.max_half_length, output_type='ndarray')
+    pairs = pairs[segments.hole[pairs[:, 0]] != segments.hole[pairs[:, 1]]]
+    for lo in range(0, len(pairs), batch_size):
+        batch = pairs[lo:lo + batch_size]
+        yield np.r_[batch[:, 0], batch[:, 1]], np.r_[batch[:, 1], batch[:, 0]]
+
+
+class ClosestNeighbours:
+    """Running closest neighbour of every hole, updated from batches of segment pairs."""
+
+    def __init__(self, segments):
+        n_holes = len(segments.holes)
+        self.segments = segments
+        self.dist = np.full(n_holes, np.inf)
+        self.neighbour = np.full(n_holes, -1)
+        self.depth = np.full(n_holes, np.nan)
+        self.neighbour_depth = np.full(n_holes, np.nan)
+
+    def measure(self, i, j):
+        """Exact distances of segment pairs, folded into the running best; returns distance and depths."""
+        segments = self.segments
+        dist, s, t = segment_distances(segments.start[i], segments.end[i], segments.start[j], segments.end[j])
+        depth_i = segments.depth_from[i] + s * (segments.depth_to[i] - segments.depth_from[i])
+        depth_j = segments.depth_from[j] + t * (segments.depth_to[j] - segments.depth_from[j])
+
+        hole_i = segments.hole[i]
+        order = np.lexsort((dist, hole_i))
+        first = order[np.r_[True, hole_i[order][1:] != hole_i[order][:-1]]] if len(order) else order
+        update = first[dist[first] < self.dist[hole_i[first]]]
+        self.dist[hole_i[update]] = dist[update]
+        self.neighbour[hole_i[update]] = segments.hole[j[update]]
+        self.depth[hole_i[update]] = depth_i[update]
+        self.neighbour_depth[hole_i[update]] = depth_j[update]
+        return dist, depth_i, depth_j
+
+
+def proximity_scan(df_dh_traces, threshold=PROXIMITY_THRESHOLD, step=PROXIMITY_STEP, batch_size=PROXIMITY_BATCH_SEGMENTS):
+    """Minimum separation between drill traces.
+
+    Returns two frames: the closest neighbour of every hole with the depths of closest
+    approach on both holes, and every depth range of every hole that comes within
+    threshold of another hole. Segment pairs are pruned with bounding spheres in a
+    KD-tree before exact segment-segment distances are computed.
+    """
+    segments = TraceSegments(df_dh_traces, step)
+    closest = ClosestNeighbours(segments)
+    close = []
+
+    if len(segments):
+        tree = cKDTree(segments.midpoint)
+        # Every pair closer than the threshold, which also settles every hole with a neighbour that close
+        for i, j in threshold_pairs(segments, tree, threshold, batch_size):
+            dist, depth_i, depth_j = closest.measure(i, j)
+            below = dist < threshold
+            close.append((i[below], j[below], dist[below], depth_i[below], depth_j[below]))
+
+        # Holes further apart search out to an upper bound on their nearest neighbour
+        unsettled = np.flatnonzero(~(closest.dist <= threshold)[segments.hole])
+        if len(unsettled):
+            radius = other_hole_bounds(segments, tree, unsettled)[segments.hole[unsettled]]
+            searchable = np.isfinite(radius)
+            for i, j in ball_pairs(segments, tree, unsettled[searchable], radius[searchable], batch_size):
+                closest.measure(i, j)
+
+    logger.info(f"Proximity scan of {len(segments.holes)} holes ({len(segments)} segments) at threshold {threshold} m")
+    close_parts = [np.concatenate(parts) for parts in zip(*close)] if close else [np.empty(0, dtype=np.int64)] * 2 + [np.empty(0)] * 3
+    return (
+        closest_neighbour_frame(segments, closest.neighbour, closest.dist, closest.depth, closest.neighbour_depth),
+        close_approach_frame(segments, *close_parts),
+    )
+
+
+def closest_neighbour_frame(segments, neighbour, dist, depth, neighbour_depth):
+    """One row per hole with its closest neighbouring hole."""
+    has_neighbour = neighbour >= 0
+    datasets = segments.holes['Dataset'].to_numpy()
+    hole_ids = segments.holes['HoleID'].to_numpy()
+    neighbour = np.maximum(neighbour, 0)
+    return pd.DataFrame({
+        'Dataset': datasets,
+        'HoleID': hole_ids,
+        'Neighbour Dataset': np.where(has_neighbour, datasets[neighbour] if len(datasets) else None, None),
+        'Neighbour HoleID': np.where(has_neighbour, hole_ids[neighbour] if len(hole_ids) else None, None),
+        'Distance': np.where(has_neighbour, dist, np.nan),
+        'Depth': depth,
+        'Neighbour Depth': neighbour_depth,
+    })
+
+
+def close_approach_frame(segments, i, j, dist, depth_i, depth_j):
+    """Depth ranges of each hole lying within the threshold of another hole, one row per range and neighbour.
+
+    Consecutive close segments of a hole against the same neighbour merge into one range.
+    """
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    columns = ['Dataset', 'HoleID', 'Neighbour Dataset', 'Neighbour HoleID', 'From', 'To', 'Min Distance', 'Depth', 'Neighbour Depth']
+    if len(i) == 0:
+        return pd.DataFrame(columns=columns)
+
+    hole_i, hole_j = segments.hole[i], segments.hole[j]
+    # Closest pair per segment and neighbouring hole, then ordered down each hole
+    order = np.lexsort((dist, i, hole_j, hole_i))
+    i, hole_i, hole_j, dist, depth_i, depth_j = i[order], hole_i[order], hole_j[order], dist[order], depth_i[order], depth_j[order]
+    first = np.r_[True, (i[1:] != i[:-1]) | (hole_j[1:] != hole_j[:-1])]
+    i, hole_i, hole_j, dist, depth_i, depth_j = i[first], hole_i[first], hole_j[first], dist[first], depth_i[first], depth_j[first]
+
+    new_range = np.r_[True, (hole_i[1:] != hole_i[:-1]) | (hole_j[1:] != hole_j[:-1]) | (i[1:] != i[:-1] + 1)]
+    range_starts = np.flatnonzero(new_range)
+    range_ends = np.r_[range_starts[1:], len(i)] - 1
+    range_id = np.cumsum(new_range) - 1
+    # Row of the minimum distance of every range
+    min_order = np.lexsort((dist, range_id))
+    range_min = min_order[np.r_[True, range_id[min_order][1:] != range_id[min_order][:-1]]]
+
+    holes = segments.holes
+    return pd.DataFrame({
+        'Dataset': holes['Dataset'].to_numpy()[hole_i[range_starts]],
+        'HoleID': holes['HoleID'].to_numpy()[hole_i[range_starts]],
+        'Neighbour Dataset': holes['Dataset'].to_numpy()[hole_j[range_starts]],
+        'Neighbour HoleID': holes['HoleID'].to_numpy()[hole_j[range_starts]],
+        'From': segments.depth_from[i[range_starts]],
+        'To': segments.depth_to[i[range_ends]],
+        'Min Distance': dist[range_min],
+        'Depth': depth_i[range_min],
+        'Neighbour Depth': depth_j[range_min],
+    }, columns=columns)
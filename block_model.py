@@ -0,0 +1,180 @@
+# block_model.py
+
+import logging
+import numpy as np
+import pandas as pd
+from anticollision import TraceSegments
+from config import BLOCK_TRACE_STEP, BLOCK_BATCH_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+INTERCEPT_COLUMNS = ['Dataset', 'HoleID', 'From', 'To', 'Length', 'Block', 'I', 'J', 'K']
+
+
+class BlockGrid:
+    """Regular block model definition: origin corner, block size and block counts along each axis.
+
+    rotation turns the model's axes counter-clockwise about the vertical, in degrees
+    from world X. Blocks are numbered I + NX * (J + NY * K).
+    """
+
+    def __init__(self, origin, block_size, counts, rotation=0.0):
+        self.origin = np.asarray(origin, dtype=float)
+        self.block_size = np.asarray(block_size, dtype=float)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.rotation = float(rotation or 0.0)
+        if (self.block_size <= 0).any() or (self.counts <= 0).any():
+            raise ValueError("Block sizes and counts must be positive")
+
+    def __len__(self):
+        return int(np.prod(self.counts))
+
+    def to_grid(self, points):
+        """World coordinates to continuous grid coordinates, in blocks from the origin corner."""
+        offset = np.asarray(points, dtype=float) - self.origin
+        if self.rotation:
+            angle = np.radians(self.rotation)
+            cos_a, sin_a = np.cos(angle), np.sin(angle)
+            offset = np.column_stack([
+                offset[:, 0] * cos_a + offset[:, 1] * sin_a,
+                -offset[:, 0] * sin_a + offset[:, 1] * cos_a,
+                offset[:, 2],
+            ])
+        return offset / self.block_size
+
+    def block_index(self, i, j, k):
+        return i + self.counts[0] * (j + self.counts[1] * k)
+
+
+def clip_to_grid(start, end, counts):
+    """Parameter range [t0, t1] of each grid-coordinate segment inside the grid box (slab method)."""
+    direction = end - start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_a = (0 - start) / direction
+        t_b = (counts - start) / direction
+    parallel = direction == 0
+    inside = (start >= 0) & (start < counts)
+    t_near = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t_a, t_b))
+    t_far = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t_a, t_b))
+    return np.maximum(t_near.max(axis=1), 0.0), np.minimum(t_far.min(axis=1), 1.0)
+
+
+def traverse_segments(start, end, counts):
+    """Cells crossed by segments in grid coordinates, in one vectorized DDA pass.
+
+    Every crossing of an integer grid plane by every segment is generated at once, and
+    the pieces between consecutive crossings are the cells visited, in order. Returns
+    the segment, entry and exit parameters and cell indices of every piece.
+    """
+    t0, t1 = clip_to_grid(start, end, counts)
+    hit = np.flatnonzero(t1 > t0)
+    direction = end[hit] - start[hit]
+    clipped_start = start[hit] + t0[hit, None] * direction
+    clipped_end = start[hit] + t1[hit, None] * direction
+
+    # Plane crossings of each axis, as parameters along the clipped segment
+    crossing_seg = [np.arange(len(hit)), np.arange(len(hit))]
+    crossing_u = [np.zeros(len(hit)), np.ones(len(hit))]
+    for axis in range(3):
+        a, b = clipped_start[:, axis], clipped_end[:, axis]
+        lo = np.floor(np.minimum(a, b)).astype(np.int64)
+        n_planes = np.floor(np.maximum(a, b)).astype(np.int64) - lo
+        seg = np.repeat(np.arange(len(hit)), n_planes)
+        plane = lo[seg] + 1 + (np.arange(len(seg)) - np.repeat(np.cumsum(n_planes) - n_planes, n_planes))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_u.append((plane - a[seg]) / (b[seg] - a[seg]))
+        crossing_seg.append(seg)
+    seg = np.concatenate(crossing_seg)
+    u = np.clip(np.concatenate(crossing_u), 0.0, 1.0)
+    order = np.lexsort((u, seg))
+    seg, u = seg[order], u[order]
+
+    # Pieces between consecutive crossings of one segment
+    piece = (seg[1:] == seg[:-1]) & (u[1:] > u[:-1])
+    piece_seg = seg[:-1][piece]
+    u_in, u_out = u[:-1][piece], u[1:][piece]
+    mid = clipped_start[piece_seg] + ((u_in + u_out) / 2)[:, None] * (clipped_end[piece_seg] - clipped_start[piece_seg])
+    cell = np.floor(mid).astype(np.int64)
+    in_grid = ((cell >= 0) & (cell < counts)).all(axis=1)
+
+    piece_seg = piece_seg[in_grid]
+    span = (t1[hit] - t0[hit])[piece_seg]
+    t_in = t0[hit][piece_seg] + u_in[in_grid] * span
+    t_out = t0[hit][piece_seg] + u_out[in_grid] * span
+    return hit[piece_seg], t_in, t_out, cell[in_grid]
+
+
+def iter_block_intercepts(df_dh_traces, grid, step=BLOCK_TRACE_STEP, batch_segments=BLOCK_BATCH_SEGMENTS, on_batch=None):
+    """Yield frames of the blocks each hole passes through and the length inside each block.
+
+    Segments are processed in batches of whole holes, so memory depends on the batch
+    and not on the number of blocks. Pieces of consecutive segments in the same block
+    are merged, giving one row per hole visit to a block, in order down the hole.
+    Traces are resampled every step metres from the collar so the straight segments
+    follow the curved hole path; step None uses the survey stations as they are.
+    on_batch(segments_done, segments_total) is called after every batch.
+    """
+    segments = TraceSegments(df_dh_traces, step)
+    if len(segments) == 0:
+        return
+    hole_starts = np.flatnonzero(np.r_[True, segments.hole[1:] != segments.hole[:-1]])
+    datasets = segments.holes['Dataset'].to_numpy()
+    hole_ids = segments.holes['HoleID'].to_numpy()
+
+    lo = 0
+    while lo < len(segments):
+        # Extend the batch to the end of the hole it stops in
+        hi = min(lo + batch_segments, len(segments))
+        next_hole = np.searchsorted(hole_starts, hi)
+        hi = hole_starts[next_hole] if next_hole < len(hole_starts) else len(segments)
+
+        start = grid.to_grid(segments.start[lo:hi])
+        end = grid.to_grid(segments.end[lo:hi])
+        seg, t_in, t_out, cell = traverse_segments(start, end, grid.counts)
+        seg += lo
+        if len(seg):
+            yield merge_intercepts(segments, grid, seg, t_in, t_out, cell, datasets, hole_ids)
+        lo = hi
+        if on_batch is not None:
+            on_batch(lo, len(segments))
+
+
+def merge_intercepts(segments, grid, seg, t_in, t_out, cell, datasets, hole_ids):
+    """Join consecutive pieces of a hole that lie in the same block into one intercept."""
+    block = grid.block_index(cell[:, 0], cell[:, 1], cell[:, 2])
+    hole = segments.hole[seg]
+    depth_span = segments.depth_to[seg] - segments.depth_from[seg]
+    depth_in = segments.depth_from[seg] + t_in * depth_span
+    depth_out = segments.depth_from[seg] + t_out * depth_span
+    length = (t_out - t_in) * segments.half_length[seg] * 2
+
+    new = np.r_[True, (hole[1:] != hole[:-1]) | (block[1:] != block[:-1]) | (depth_in[1:] > depth_out[:-1] + 1e-9)]
+    starts = np.flatnonzero(new)
+    ends = np.r_[starts[1:], len(seg)] - 1
+    return pd.DataFrame({
+        'Dataset': datasets[hole[starts]],
+        'HoleID': hole_ids[hole[starts]],
+        'From': depth_in[starts],
+        'To': depth_out[ends],
+        'Length': np.add.reduceat(length, starts),
+        'Block': block[starts],
+        'I': cell[starts, 0],
+        'J': cell[starts, 1],
+        'K': cell[starts, 2],
+    }, columns=INTERCEPT_COLUMNS)
+
+
+def block_intercepts(df_dh_traces, grid, step=BLOCK_TRACE_STEP, batch_segments=BLOCK_BATCH_SEGMENTS, on_batch=None):
+    """All block intercepts of a trace frame as one frame; see iter_block_intercepts."""
+    frames = list(iter_block_intercepts(df_dh_traces, grid, step, batch_segments, on_batch))
+    if not frames:
+        return pd.DataFrame(columns=INTERCEPT_COLUMNS)
+    df_intercepts = pd.concat(frames, ignore_index=True)
+    logger.info(f"{len(df_intercepts)} block intercepts in a grid of {len(grid)} blocks")
+    return df_intercepts
+
+
+def block_intercepts_job(job, df_dh_traces, grid, step=BLOCK_TRACE_STEP, batch_segments=BLOCK_BATCH_SEGMENTS):
+    """Job function: block_intercepts reporting progress, and checking for a cancel, after every batch."""
+    return block_intercepts(df_dh_traces, grid, step, batch_segments,
+                            on_batch=lambda done, total: job.report("Segments", done / total, f"{done} of {total} segments"))
@@ -0,0 +1,136 @@
+# compositing.py
+
+import logging
+import numpy as np
+import pandas as pd
+from config import COMPOSITE_LENGTH, COMPOSITE_MIN_COVERAGE, COMPOSITE_MIN_RESIDUAL
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_INTERVAL_COLS = ['HoleID', 'From', 'To']
+
+# Columns that describe where an interval is rather than what was measured on it
+NON_GRADE_COLS = {'HoleID', 'From', 'To', 'Depth', 'Length', 'Dataset'}
+
+
+def grade_columns(df_intervals):
+    """Numeric columns of an Interval frame that can be composited."""
+    return [
+        col for col in df_intervals.columns
+        if col not in NON_GRADE_COLS and not str(col).startswith('DH_') and pd.api.types.is_numeric_dtype(df_intervals[col])
+    ]
+
+
+def composite_bins(run_start, run_end, length, min_residual=COMPOSITE_MIN_RESIDUAL):
+    """Composite boundaries for every run at once.
+
+    Each run is cut into length-long composites from its start. A final residual
+    shorter than min_residual * length is merged into the composite before it; longer
+    residuals stay as short composites. With length None every run is one composite.
+    Returns the run, from and to of every composite, in run order.
+    """
+    if length is None:
+        return np.arange(len(run_start)), run_start.copy(), run_end.copy()
+
+    run_length = run_end - run_start
+    n_bins = np.maximum(np.ceil(run_length / length - 1e-9).astype(np.int64), 1)
+    residual = run_length - (n_bins - 1) * length
+    merge = (n_bins > 1) & (residual < min_residual * length)
+    n_bins = n_bins - merge
+
+    run = np.repeat(np.arange(len(run_start)), n_bins)
+    first_bin = np.r_[0, np.cumsum(n_bins)[:-1]]
+    step = np.arange(len(run)) - first_bin[run]
+    bin_from = run_start[run] + step * length
+    bin_to = np.minimum(bin_from + length, run_end[run])
+    # The last composite of every run ends at the run's end, which absorbs a merged residual
+    last_bin = first_bin + n_bins - 1
+    bin_to[last_bin] = run_end
+    return run, bin_from, bin_to
+
+
+def composite_intervals(df_intervals, length=COMPOSITE_LENGTH, domain_column=None, columns=None,
+                        min_coverage=COMPOSITE_MIN_COVERAGE, min_residual=COMPOSITE_MIN_RESIDUAL):
+    """Length-weighted composites of every hole and grade column of an Interval frame.
+
+    Composites run every length metres down each hole, restarting at every change of
+    domain_column when one is given; length None gives one composite per domain run.
+    Gaps between samples are left out of the weights rather than counted as zero grade,
+    and composites with less than min_coverage of their length sampled are dropped.
+    """
+    for col in REQUIRED_INTERVAL_COLS:
+        if col not in df_intervals.columns:
+            raise ValueError(f"Required column '{col}' not found in interval data")
+    if columns is None:
+        columns = grade_columns(df_intervals)
+
+    depth_from = df_intervals['From'].to_numpy(dtype=float)
+    depth_to = df_intervals['To'].to_numpy(dtype=float)
+    valid = np.flatnonzero(np.isfinite(depth_from) & np.isfinite(depth_to) & (depth_to > depth_from))
+    if len(valid) < len(df_intervals):
+        logger.warning(f"Skipping {len(df_intervals) - len(valid)} intervals with missing or inverted From/To")
+
+    hole_codes, hole_ids = pd.factorize(df_intervals['HoleID'].to_numpy()[valid])
+    sort = np.lexsort((depth_from[valid], hole_codes))
+    order, hole_codes = valid[sort], hole_codes[sort]
+    depth_from, depth_to = depth_from[order], depth_to[order]
+    n = len(order)
+    if n == 0:
+        return pd.DataFrame(columns=['HoleID', 'From', 'To', 'Length', 'Sampled'] + ([domain_column] if domain_column else []) + list(columns))
+
+    # Runs are stretches of one hole, and of one domain when compositing by domain
+    new_run = np.r_[True, hole_codes[1:] != hole_codes[:-1]]
+    if domain_column is not None:
+        domain_codes, domains = pd.factorize(df_intervals[domain_column].to_numpy()[order], use_na_sentinel=False)
+        new_run |= np.r_[True, domain_codes[1:] != domain_codes[:-1]]
+    run_starts = np.flatnonzero(new_run)
+    run_of_interval = np.cumsum(new_run) - 1
+    run_start = np.minimum.reduceat(depth_from, run_starts)
+    run_end = np.maximum.reduceat(depth_to, run_starts)
+
+    run, bin_from, bin_to = composite_bins(run_start, run_end, length, min_residual)
+    run_first_bin = np.searchsorted(run, np.arange(len(run_starts)))
+    run_n_bins = np.diff(np.r_[run_first_bin, len(run)])
+
+    # Sparse interval x composite overlap matrix: each interval pairs with the composites it spans
+    if length is None:
+        first, last = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    else:
+        offset_from = depth_from - run_start[run_of_interval]
+        offset_to = depth_to - run_start[run_of_interval]
+        max_bin = run_n_bins[run_of_interval] - 1
+        first = np.clip(np.floor(offset_from / length).astype(np.int64), 0, max_bin)
+        last = np.clip(np.ceil(offset_to / length).astype(np.int64) - 1, first, max_bin)
+    span = last - first + 1
+    pair_interval = np.repeat(np.arange(n), span)
+    pair_bin = run_first_bin[run_of_interval][pair_interval] + first[pair_interval] + (
+        np.arange(len(pair_interval)) - np.repeat(np.cumsum(span) - span, span)
+    )
+    overlap = np.minimum(depth_to[pair_interval], bin_to[pair_bin]) - np.maximum(depth_from[pair_interval], bin_from[pair_bin])
+    positive = overlap > 0
+    pair_interval, pair_bin, overlap = pair_interval[positive], pair_bin[positive], overlap[positive]
+
+    n_bins = len(bin_from)
+    sampled = np.bincount(pair_bin, weights=overlap, minlength=n_bins)
+    composite = {
+        'HoleID': hole_ids[hole_codes[run_starts[run]]],
+        'From': bin_from,
+        'To': bin_to,
+        'Length': bin_to - bin_from,
+        'Sampled': sampled,
+    }
+    if domain_column is not None:
+        composite[domain_column] = domains[domain_codes[run_starts[run]]]
+
+    for col in columns:
+        values = df_intervals[col].to_numpy(dtype=float, na_value=np.nan)[order][pair_interval]
+        measured = ~np.isnan(values)
+        weight = np.bincount(pair_bin[measured], weights=overlap[measured], minlength=n_bins)
+        total = np.bincount(pair_bin[measured], weights=values[measured] * overlap[measured], minlength=n_bins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            composite[col] = np.where(weight > 0, total / weight, np.nan)
+
+    df_composites = pd.DataFrame(composite)
+    keep = (sampled > 0) & (sampled >= min_coverage * df_composites['Length'].to_numpy())
+    logger.info(f"Composited {n} intervals into {int(keep.sum())} composites ({n_bins - int(keep.sum())} under-sampled dropped)")
+    return df_composites[keep].reset_index(drop=True)
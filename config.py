@@ -55,10 +55,77 @@ MAIN_CONTENT_WIDTH = 800
 
 # Data processing settings
 CHUNK_SIZE = 10000  # Number of rows to process at a time for large files
+ENCODING_SAMPLE_BYTES = 1024 * 1024  # Prefix of a text file used to detect its encoding
+HASH_BLOCK_SIZE = 8 * 1024 * 1024  # Block size when hashing uploads
+INGEST_WORKERS = 4  # Threads used to read uploaded files concurrently
+READER_BACKEND = 'fast'  # 'fast' uses multi-threaded Arrow CSV and Calamine Excel readers when installed, 'pandas' the default readers
+ARROW_BLOCK_SIZE = 4 * 1024 * 1024  # Bytes of CSV each Arrow reader thread parses at a time
+
+# Parse cache settings
+PARSE_CACHE_ENABLED = True  # Reuse parsed uploads across datasets and sessions, keyed by file MD5 (needs pyarrow); the shared store replaces it when enabled
+PARSE_CACHE_DIR = '.parse_cache'
+PARSE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB; least recently used entries are evicted beyond this
+
+# Shared store settings
+SHARED_STORE_ENABLED = True  # Keep uploaded files and drill traces once per server as read-only memory-mapped columns, shared by all sessions
+SHARED_STORE_DIR = '.shared_store'
+SHARED_STORE_MAX_BYTES = 8 * 1024 * 1024 * 1024  # 8 GB; entries no session uses are evicted least recently used first beyond this
+
+# Stage cache settings
+STAGE_CACHE_ENABLED = True  # Memoize type conversion, desurvey, display stations and 3D figures on upstream content keys
+STAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB; least recently used stage outputs are dropped beyond this
+COLUMN_PREVIEW_ROWS = 500  # Rows shown while identifying columns; the full table is in the Data Viewer
+
+# Column type settings
+DTYPE_COMPACT = True  # Store HoleID/Category columns as categoricals and coordinates/angles as float32 where precise enough
+COORDINATE_TOLERANCE = 0.001  # Largest rounding error in metres accepted when storing coordinates as float32
+
+# Column type guessing settings
+PROFILE_SAMPLE_SIZE = 10000  # Rows sampled per column to fingerprint it for type guessing
+
+# Desurvey settings
+DESURVEY_WORKERS = None  # Worker processes for desurvey; None uses all cores, 1 disables the process pool
+DESURVEY_PARALLEL_MIN_ROWS = 50000  # Below this many survey stations in total, desurvey runs serially
+DESURVEY_SHARD_ROWS = 200000  # Datasets larger than this are split into hole ranges of about this many stations
+DESURVEY_START_METHOD = "forkserver"  # Never fork: the pool starts from a thread of the multithreaded server
+
+# Background job settings
+JOB_WORKERS = 4  # Threads running background jobs for all sessions of the server
+JOB_POLL_SECONDS = 1.0  # How often the job panel refreshes its progress bars
+
+# Compositing settings
+COMPOSITE_LENGTH = 2.0  # Composite length in metres; None composites each domain run whole
+COMPOSITE_MIN_COVERAGE = 0.5  # Composites with less than this fraction of their length sampled are dropped
+COMPOSITE_MIN_RESIDUAL = 0.5  # End-of-run residuals shorter than this fraction of COMPOSITE_LENGTH merge into the previous composite
+
+# Spatial index settings
+SPATIAL_INDEX_STEP = 2.0  # Spacing in metres of the trace stations held in the spatial index
+
+# Anti-collision settings
+PROXIMITY_THRESHOLD = 10.0  # Separation in metres below which traces are reported as too close
+PROXIMITY_STEP = 5.0  # Traces are resampled every this many metres before segment distances are measured
+PROXIMITY_BATCH_SEGMENTS = 50000  # Segments whose neighbour searches run together, which bounds memory
+
+# Block model settings
+BLOCK_TRACE_STEP = 2.0  # Traces are resampled every this many metres, from the collar down, before intersecting blocks
+BLOCK_BATCH_SEGMENTS = 200000  # Trace segments intersected with the block grid per batch
+
+# Surface settings
+SURFACE_EXTENSIONS = ['obj', 'stl']
+SURFACE_TRACE_STEP = 5.0  # Traces are resampled every this many metres, from the collar down, before piercing surfaces
+SURFACE_BATCH_SEGMENTS = 100000  # Trace segments tested against a surface per batch
+SURFACE_CELL_FACTOR = 2.0  # Surface grid cell size as a multiple of the median triangle size
 
 # 3D plot settings
 PLOT_3D_HEIGHT = 800
 PLOT_3D_WIDTH = 1000
+LOD_ENABLED = True  # Simplify traces before sending them to the 3D view
+LOD_POINT_BUDGET = 200000  # Maximum stations sent to the 3D view
+LOD_TOLERANCE_FRACTION = 1 / 5000  # Simplification tolerance as a fraction of the view's diagonal
+RESAMPLE_STEP = 5.0  # Default spacing in metres of resampled trace stations
+PLOT_3D_RESAMPLE = False  # Draw traces from stations every RESAMPLE_STEP metres instead of the survey stations
+PLOT_3D_MODE = 'combined'  # 'combined' draws one line per dataset with breaks between holes, 'per_hole' one line per hole
+POINT_CLOUD_BUDGET = 300000  # Maximum points of all point clouds sent to the 3D view
 
 # Error messages
 ERROR_MESSAGES = {
@@ -2,8 +2,12 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import logging
-from utils import required_cols
+from utils import required_cols, format_bytes
+from hole_dictionary import encode_hole_ids
+from stage_cache import cached_stage, advance_key, dictionary_key
+from config import DTYPE_COMPACT, COORDINATE_TOLERANCE
 import datatype_guesser
 
 logger = logging.getLogger(__name__)
@@ -49,7 +53,7 @@ def identify_columns_form(file):
 
                 # First, assign best guesses for mandatory fields
                 for column in file.columns:
-                    guessed_datatype = datatype_guesser.guess_type('datacolumn', f"{file.category}_{column}", file.df[column])
+                    guessed_datatype = datatype_guesser.guess_type('datacolumn', f"{file.category}_{column}", file.df[column], file.column_fingerprints.get(column))
                     if guessed_datatype in file.required_cols and guessed_datatype not in assigned_mandatory_fields:
                         column_assignments[column] = guessed_datatype
                         assigned_mandatory_fields.add(guessed_datatype)
@@ -57,7 +61,7 @@ def identify_columns_form(file):
                 # Second, assign data types for remaining columns
                 for column in file.columns:
                     if column not in column_assignments:
-                        guessed_datatype = datatype_guesser.guess_type('datacolumn', f"{file.category}_{column}", file.df[column])
+                        guessed_datatype = datatype_guesser.guess_type('datacolumn', f"{file.category}_{column}", file.df[column], file.column_fingerprints.get(column))
                         # Ensure remaining columns don't get assigned already assigned mandatory fields
                         while guessed_datatype in assigned_mandatory_fields:
                             guessed_datatype = 'Text'
@@ -84,33 +88,85 @@ def identify_columns_form(file):
                     file.user_defined_dtypes[column] = selected_datatype
                 submit_column_identification = st.form_submit_button("Submit")
                 if submit_column_identification:
-                    file.df_reassigned_dtypes = change_dtypes(file.df, file.user_defined_dtypes)
-                    st.success(f'The {file.category} file {file.name} has had its column datatypes processed')
+                    bytes_saved = apply_column_types(file, st.session_state.get("hole_dictionaries", {}).get(file.dataset))
+                    # Converted in place, so the reassigned frame is the file's own frame rather than a second copy
+                    file.df_reassigned_dtypes = file.df
+                    st.success(f'The {file.category} file {file.name} has had its column datatypes processed ({format_bytes(max(bytes_saved, 0))} saved)')
 
-def change_dtypes(df, column_types):
-    df_copy = df.copy()
+COORDINATE_FIELDS = ["DH_X", "DH_Y", "DH_Z", "Depth", "From", "To"]
+ANGLE_FIELDS = ["Dip", "Azimuth"]
+
+def is_text_column(values):
+    return pd.api.types.infer_dtype(values, skipna=False) == "string"
+
+def is_numeric_column(values):
+    return pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+
+def compact_float(values, tolerance=None):
+    # float32 keeps about 7 significant digits, which is too coarse for large grid coordinates
+    values_32 = values.astype("float32")
+    if tolerance is not None:
+        error = np.abs(values_32.to_numpy(dtype="float64") - values.to_numpy(dtype="float64"))
+        if np.nanmax(error, initial=0) > tolerance:
+            return values
+    return values_32
+
+def convert_column(values, col_type, compact=False):
+    # Returns None when the column already has the requested type
+    if col_type == "Text":
+        return None if is_text_column(values) else values.astype(str)
+    elif col_type == "Category":
+        return None if isinstance(values.dtype, pd.CategoricalDtype) else values.astype("category")
+    elif col_type == "Numeric":
+        return None if is_numeric_column(values) else pd.to_numeric(values, errors='coerce')
+    elif col_type == "Datetime":
+        return None if pd.api.types.is_datetime64_any_dtype(values) else pd.to_datetime(values, errors='coerce')
+    elif col_type == "Boolean":
+        return None if pd.api.types.is_bool_dtype(values) else values.astype(bool)
+    elif col_type == "HoleID":
+        if compact:
+            return None if isinstance(values.dtype, pd.CategoricalDtype) else values.astype(str).astype("category")
+        return None if is_text_column(values) else values.astype(str)
+    elif col_type in COORDINATE_FIELDS + ANGLE_FIELDS:
+        converted = values if is_numeric_column(values) else pd.to_numeric(values, errors='coerce')
+        if compact and converted.dtype != "float32":
+            tolerance = None if col_type in ANGLE_FIELDS else COORDINATE_TOLERANCE
+            converted = compact_float(converted, tolerance)
+        return None if converted is values else converted
+    return None
+
+def change_dtypes(df, column_types, inplace=False, compact=False):
+    # Without inplace, a shallow copy shares every unchanged column with the original
+    df_out = df if inplace else df.copy(deep=False)
     for column, col_type in column_types.items():
-        if column not in df_copy.columns:
+        if column not in df_out.columns:
             continue
         try:
-            if col_type == "Text":
-                df_copy[column] = df_copy[column].astype(str)
-            elif col_type == "Category":
-                df_copy[column] = df_copy[column].astype("category")
-            elif col_type == "Numeric":
-                df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce')
-            elif col_type == "Datetime":
-                df_copy[column] = pd.to_datetime(df_copy[column], errors='coerce')
-            elif col_type == "Boolean":
-                df_copy[column] = df_copy[column].astype(bool)
-            elif col_type in ["HoleID", "DH_X", "DH_Y", "DH_Z", "Depth", "Dip", "Azimuth", "From", "To"]:
-                if col_type == "HoleID":
-                    df_copy[column] = df_copy[column].astype(str)
-                else:
-                    df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce')
+            converted = convert_column(df_out[column], col_type, compact)
         except Exception as e:
-            df_copy[column] = df_copy[column].astype(str)
-    return df_copy
+            converted = df_out[column].astype(str)
+        if converted is not None:
+            df_out[column] = converted
+    return df_out
+
+def apply_column_types(file, hole_dictionary=None, compact=DTYPE_COMPACT):
+    """Convert a file's columns and return the bytes saved.
+
+    The conversion is memoized on the file's content key and the column types, so
+    applying the same types to the same upload again, in any session, is a cache hit.
+    """
+    bytes_before = file.df.memory_usage(deep=True).sum()
+    types_key = advance_key(file.content_key, 'types', sorted(file.user_defined_dtypes.items()), compact)
+    file.df = cached_stage('type_apply', types_key, change_dtypes, file.df, dict(file.user_defined_dtypes), compact=compact)
+    file.content_key = types_key
+    if hole_dictionary is not None:
+        # Keep HoleID columns on the dataset's shared codes rather than per-file categories
+        hole_columns = [column for column, col_type in file.user_defined_dtypes.items() if col_type == "HoleID"]
+        encode_hole_ids(file.df, hole_dictionary, hole_columns)
+        file.content_key = advance_key(file.content_key, 'hole_ids', dictionary_key(hole_dictionary))
+    bytes_saved = int(bytes_before - file.df.memory_usage(deep=True).sum())
+    logger.info(f"Applied column types for {file.name}: {bytes_saved} bytes saved")
+    return bytes_saved
 
 def map_columns(file):
     st.write(f"Map columns for {file.name}")
@@ -124,6 +180,7 @@ def map_columns(file):
     
     if st.button("Apply Column Mapping"):
         file.df = file.df.rename(columns={v: k for k, v in mapped_columns.items() if v})
+        file.content_key = advance_key(file.content_key, 'rename', sorted(mapped_columns.items()))
         st.success("Column mapping applied successfully")
         return file
     return None
@@ -166,5 +223,7 @@ def preprocess_data(file):
                 fill_value = st.text_input(f"Enter fill value for missing data in {col}", value="Unknown")
                 file.df[col].fillna(fill_value, inplace=True)
     
+    # Edited by hand, so there is no key to cache later stages on
+    file.content_key = None
     st.success("Data preprocessing completed")
     return file
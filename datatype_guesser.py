@@ -4,9 +4,13 @@ from fuzzywuzzy import process
 import pandas as pd
 import re
 import numpy as np
+from functools import lru_cache
+from config import PROFILE_SAMPLE_SIZE
 
 # Define the possible categories for files and data columns
 FILE_CATEGORIES = ['Collar', 'Survey', 'Point', 'Interval']
+# Categories uploaded into an existing dataset and located on its drill traces
+DOWNHOLE_CATEGORIES = ['Point', 'Interval']
 COLUMN_DATATYPES = ['Text', 'Category', 'Numeric', 'Datetime', 'Boolean']
 REQUIRED_COLUMNS = {
     'Collar': ['HoleID', 'DH_X', 'DH_Y', 'DH_Z', 'Depth'],
@@ -28,55 +32,184 @@ MANDATORY_FIELD_VARIATIONS = {
     'To': ['to', 'end_depth', 'depth_to', 'bottom']
 }
 
+# Rows of the profiling sample tried as dates
+DATETIME_SAMPLE_SIZE = 500
+
+# Values accepted in a Boolean column
+BOOLEAN_VALUES = [True, False, 1, 0, 'True', 'False', 'true', 'false', 'TRUE', 'FALSE', 'T', 'F', 'Y', 'N']
+
 def normalize_string(s):
     """Normalize string by removing non-alphanumeric characters and converting to lowercase."""
     return re.sub(r'\W+', '', s).lower()
 
+def tokenize_name(s):
+    """Lowercase a header and join its alphanumeric runs with underscores, e.g. 'Dip (deg)' -> 'dip_deg'."""
+    return re.sub(r'[^0-9a-z]+', '_', s.lower()).strip('_')
+
+def build_field_matcher(field_variations):
+    """Build a trie of every variation of every mandatory field, plus the fields of each variation."""
+    variation_fields = {}
+    trie = {}
+    for field, variations in field_variations.items():
+        for variation in variations:
+            variation_fields.setdefault(variation, []).append(field)
+            node = trie
+            for char in variation:
+                node = node.setdefault(char, {})
+            node[None] = variation
+    return trie, variation_fields
+
+def find_variations(name, trie):
+    """Yield (start, variation) for every variation found anywhere in name, including ones sharing a start."""
+    for start in range(len(name)):
+        node = trie
+        for char in name[start:]:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                yield start, node[None]
+
+FIELD_MATCHER, VARIATION_FIELDS = build_field_matcher(MANDATORY_FIELD_VARIATIONS)
+
+# Variations shorter than this only match whole tokens, so 'x' does not hit 'max_au'
+MIN_SUBSTRING_VARIATION = 4
+
+def score_variation_match(name, start, variation):
+    """3 for the whole header, 2 for whole tokens, 1 for a long enough substring, 0 otherwise."""
+    end = start + len(variation)
+    if start == 0 and end == len(name):
+        return 3
+    if (start == 0 or name[start - 1] == '_') and (end == len(name) or name[end] == '_'):
+        return 2
+    if len(variation) >= MIN_SUBSTRING_VARIATION:
+        return 1
+    return 0
+
+@lru_cache(maxsize=4096)
+def match_mandatory_field(file_type, column_name):
+    """Return the mandatory field a header names for this file type, or None.
+
+    Hits are ranked by match quality, then variation length, then the field's order in
+    REQUIRED_COLUMNS, then position, so ambiguous headers always resolve the same way.
+    """
+    mandatory_fields = REQUIRED_COLUMNS.get(file_type, [])
+    name = tokenize_name(column_name)
+    best, best_rank = None, None
+    for start, variation in find_variations(name, FIELD_MATCHER):
+        score = score_variation_match(name, start, variation)
+        if score == 0:
+            continue
+        for field in VARIATION_FIELDS[variation]:
+            if field not in mandatory_fields:
+                continue
+            rank = (-score, -len(variation), mandatory_fields.index(field), start)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = field, rank
+    return best
+
+@lru_cache(maxsize=1024)
 def guess_file_type(file_name):
     """Guess the file type based on the file name."""
     normalized_name = normalize_string(file_name)
     best_guess, score = process.extractOne(normalized_name, FILE_CATEGORIES, scorer=process.fuzz.partial_ratio)
     return best_guess if score > 60 else 'Collar'
 
-def is_numeric(column_data):
-    """Check if a column is numeric."""
-    try:
-        pd.to_numeric(column_data, errors='raise')
-        return True
-    except ValueError:
-        return False
+def stratified_sample(column_data, sample_size=PROFILE_SAMPLE_SIZE):
+    """Take one row from each of sample_size equal slices of the column, so the sample spans the whole file."""
+    n = len(column_data)
+    if n <= sample_size:
+        return column_data
+    rng = np.random.default_rng(0)
+    edges = np.arange(sample_size) * (n / sample_size)
+    positions = (edges + rng.uniform(0, n / sample_size, sample_size)).astype(np.int64)
+    return column_data.iloc[np.minimum(positions, n - 1)]
+
+def estimate_distinct(sample, n):
+    """Estimate the number of distinct values in n rows from a sample (GEE estimator)."""
+    counts = sample.value_counts(dropna=True)
+    if len(sample) >= n:
+        return len(counts)
+    singletons = int((counts == 1).sum())
+    estimate = np.sqrt(n / len(sample)) * singletons + (len(counts) - singletons)
+    return int(min(max(estimate, len(counts)), n))
+
+def profile_column(column_data, sample_size=PROFILE_SAMPLE_SIZE):
+    """Compute a reusable fingerprint of a column from a stratified sample."""
+    n = len(column_data)
+    sample = stratified_sample(column_data, sample_size)
+    non_null = sample.dropna()
+    is_text = column_data.dtype == 'object' or pd.api.types.is_string_dtype(column_data)
+
+    if len(non_null):
+        numeric_ratio = pd.to_numeric(non_null, errors='coerce').notna().mean()
+        boolean_ratio = non_null.isin(BOOLEAN_VALUES).mean()
+    else:
+        numeric_ratio = 1.0
+        boolean_ratio = 1.0
+
+    digit_ratio = 0.0
+    datetime_ratio = 0.0
+    if is_text and len(non_null):
+        text = non_null.astype(str)
+        digit_ratio = text.str.isnumeric().mean()
+        if numeric_ratio < 1.0:
+            # Mixed-format date parsing is per element, so spread a smaller subsample over the sample
+            date_text = text.iloc[::max(1, len(text) // DATETIME_SAMPLE_SIZE)]
+            # Only values with digits count as dates; the parser also accepts bare month or day names
+            date_like = date_text[date_text.str.contains(r'\d', regex=True)]
+            datetime_ratio = pd.to_datetime(date_like, errors='coerce', format='mixed').notna().sum() / len(date_text)
+
+    return {
+        'rows': n,
+        'sample_size': len(sample),
+        'is_text': is_text,
+        'is_datetime': pd.api.types.is_datetime64_any_dtype(column_data),
+        'null_ratio': 1 - len(non_null) / len(sample) if len(sample) else 0.0,
+        'numeric_ratio': float(numeric_ratio),
+        'digit_ratio': float(digit_ratio),
+        'boolean_ratio': float(boolean_ratio),
+        'datetime_ratio': float(datetime_ratio),
+        'distinct_estimate': estimate_distinct(sample, n),
+    }
+
+def profile_frame(df, sample_size=PROFILE_SAMPLE_SIZE):
+    """Fingerprint every column of a DataFrame."""
+    return {column: profile_column(df[column], sample_size) for column in df.columns}
 
-def guess_column_type(file_type, column_name, column_data):
-    """Guess the column type based on the file type, column name, and column data."""
+def guess_column_type(file_type, column_name, column_data, fingerprint=None):
+    """Guess the column type based on the file type, column name, and column data fingerprint."""
     normalized_name = normalize_string(column_name)
-    mandatory_fields = REQUIRED_COLUMNS.get(file_type, [])
     
     # Check for mandatory fields first
-    for field in mandatory_fields:
-        if any(variation in normalized_name for variation in MANDATORY_FIELD_VARIATIONS.get(field, [])):
-            return field
+    field = match_mandatory_field(file_type, column_name)
+    if field is not None:
+        return field
+
+    if fingerprint is None:
+        fingerprint = profile_column(column_data)
 
     # Check for numeric columns (including those with some non-numeric values)
-    if is_numeric(column_data) or (column_data.dtype == 'object' and column_data.str.isnumeric().mean() > 0.8):
+    if fingerprint['numeric_ratio'] == 1.0 or (fingerprint['is_text'] and fingerprint['digit_ratio'] > 0.8):
         return 'Numeric'
 
     # Check for datetime columns
-    if 'date' in normalized_name or pd.api.types.is_datetime64_any_dtype(column_data):
+    if 'date' in normalized_name or fingerprint['is_datetime'] or fingerprint['datetime_ratio'] > 0.9:
         return 'Datetime'
     
     # Check for boolean columns
-    if set(column_data.dropna().unique()) <= {True, False, 1, 0, 'True', 'False', 'true', 'false', 'TRUE', 'FALSE', 'T', 'F', 'Y', 'N'}:
+    if fingerprint['boolean_ratio'] == 1.0:
         return 'Boolean'
     
     # Check for categorical columns
-    unique_ratio = column_data.nunique() / len(column_data)
+    unique_ratio = fingerprint['distinct_estimate'] / fingerprint['rows'] if fingerprint['rows'] else 0
     if unique_ratio < 0.1:  # If less than 10% of values are unique
         return 'Category'
     
     # Default to Text for any other case
     return 'Text'
 
-def guess_type(type_name, name, column_data=None):
+def guess_type(type_name, name, column_data=None, fingerprint=None):
     """Guess the type based on the type name and name."""
     if type_name.lower() == 'file':
         return guess_file_type(name)
@@ -84,7 +217,7 @@ def guess_type(type_name, name, column_data=None):
         if column_data is None:
             raise ValueError("column_data must be provided for type 'datacolumn'")
         file_type, column_name = name.split('_', 1)
-        return guess_column_type(file_type, column_name, column_data)
+        return guess_column_type(file_type, column_name, column_data, fingerprint)
     else:
         raise ValueError("Invalid type name. Use 'file' or 'datacolumn'.")
 
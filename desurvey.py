@@ -0,0 +1,329 @@
+# desurvey.py
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import logging
+import numpy as np
+import pandas as pd
+from hole_dictionary import align_hole_ids
+from config import DESURVEY_WORKERS, DESURVEY_PARALLEL_MIN_ROWS, DESURVEY_SHARD_ROWS, DESURVEY_START_METHOD
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLLAR_COLS = ['HoleID', 'DH_X', 'DH_Y', 'DH_Z']
+REQUIRED_SURVEY_COLS = ['HoleID', 'Depth', 'Azimuth', 'Dip']
+
+TRACE_INPUT_COLUMNS = ['Depth', 'Dip', 'Azimuth', 'DH_X', 'DH_Y', 'DH_Z']
+TRACE_OUTPUT_COLUMNS = ['DH_X', 'DH_Y', 'DH_Z', 'DH_dX', 'DH_dY', 'DH_dZ']
+
+
+def calculate_xyz(depth_1, dip_1, azi_1, depth_2, dip_2, azi_2):
+    """Minimum curvature step between two survey stations, vectorized over arrays of stations."""
+    depth_1, dip_1, azi_1, depth_2, dip_2, azi_2 = (
+        np.asarray(v, dtype=float) for v in (depth_1, dip_1, azi_1, depth_2, dip_2, azi_2)
+    )
+    MD = depth_2 - depth_1
+    vertical = np.abs(dip_1) == 90
+
+    inc_1 = np.radians(90 + dip_1)
+    inc_2 = np.radians(90 + dip_2)
+    azi_1 = np.radians(azi_1)
+    azi_2 = np.radians(azi_2)
+
+    # Clip guards against round-off pushing near-straight segments just outside arccos' domain
+    cos_B = np.cos(inc_2 - inc_1) - (np.sin(inc_1) * np.sin(inc_2) * (1 - np.cos(azi_2 - azi_1)))
+    B_rad = np.arccos(np.clip(cos_B, -1.0, 1.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        RF = np.where(B_rad != 0, (2 / B_rad) * np.tan(B_rad / 2), 1.0)
+
+    dDepth = MD / 2
+    dN = dDepth * ((np.sin(inc_1) * np.cos(azi_1)) + (np.sin(inc_2) * np.cos(azi_2))) * RF
+    dE = dDepth * ((np.sin(inc_1) * np.sin(azi_1)) + (np.sin(inc_2) * np.sin(azi_2))) * RF
+    dV = dDepth * (np.cos(inc_1) + np.cos(inc_2)) * RF
+
+    RF = np.where(vertical, 1.0, RF)
+    dN = np.where(vertical, 0.0, dN)
+    dE = np.where(vertical, 0.0, dE)
+    dV = np.where(vertical, MD, dV)
+
+    return MD, RF, dN, dE, dV
+
+
+def hole_keys(hole_ids):
+    """Integer codes for a categorical HoleID column, the raw values otherwise."""
+    if isinstance(hole_ids.dtype, pd.CategoricalDtype):
+        return hole_ids.cat.codes.to_numpy()
+    return hole_ids.to_numpy()
+
+
+def hole_offsets(hole_keys):
+    """Return the start index of every hole in an array sorted by hole."""
+    hole_keys = np.asarray(hole_keys)
+    if len(hole_keys) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, hole_keys[1:] != hole_keys[:-1]])
+
+
+def grouped_cumsum(values, starts):
+    """Cumulative sum of values that restarts at every hole offset."""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values.copy()
+    total = np.cumsum(values)
+    base = np.zeros(len(starts), dtype=total.dtype)
+    base[1:] = total[starts[1:] - 1]
+    lengths = np.diff(np.r_[starts, len(values)])
+    return total - np.repeat(base, lengths)
+
+
+def desurvey(starts, depth, dip, azimuth, collar_x, collar_y, collar_z):
+    """Desurvey hole-sorted survey stations in one pass.
+
+    The collar arrays hold the collar position repeated for every station. Each hole
+    starts from depth 0 using its first station's orientation, and stations at or
+    above the collar keep the collar position, matching the per-row walk this replaces.
+    Returns x, y, z and the per-station dX, dY, dZ increments.
+    """
+    depth = np.asarray(depth, dtype=float)
+    dip = np.asarray(dip, dtype=float)
+    azimuth = np.asarray(azimuth, dtype=float)
+    collar_x = np.asarray(collar_x, dtype=float)
+    collar_y = np.asarray(collar_y, dtype=float)
+    collar_z = np.asarray(collar_z, dtype=float)
+
+    # Previous station of every station; the first station of a hole looks back to the collar
+    depth_prev = np.empty_like(depth)
+    dip_prev = np.empty_like(dip)
+    azi_prev = np.empty_like(azimuth)
+    depth_prev[1:], dip_prev[1:], azi_prev[1:] = depth[:-1], dip[:-1], azimuth[:-1]
+    depth_prev[starts] = 0
+    dip_prev[starts] = dip[starts]
+    azi_prev[starts] = azimuth[starts]
+
+    _, _, dN, dE, dV = calculate_xyz(depth_prev, dip_prev, azi_prev, depth, dip, azimuth)
+
+    active = depth > 0
+    dE = np.where(active, dE, 0.0)
+    dN = np.where(active, dN, 0.0)
+    dV = np.where(active, dV, 0.0)
+
+    # A NaN increment poisons the rest of its own hole only, so accumulate it separately
+    invalid = np.isnan(dE) | np.isnan(dN) | np.isnan(dV)
+    poisoned = grouped_cumsum(invalid.astype(np.int64), starts) > 0
+    x = collar_x + grouped_cumsum(np.where(invalid, 0.0, dE), starts)
+    y = collar_y + grouped_cumsum(np.where(invalid, 0.0, dN), starts)
+    z = collar_z - grouped_cumsum(np.where(invalid, 0.0, dV), starts)  # Subtract dV because depth increases downwards
+
+    x = np.where(active, np.where(poisoned, np.nan, x), collar_x)
+    y = np.where(active, np.where(poisoned, np.nan, y), collar_y)
+    z = np.where(active, np.where(poisoned, np.nan, z), collar_z)
+
+    return x, y, z, dE, dN, dV
+
+
+def shard_bounds(starts, n_rows, max_rows):
+    """Split hole-sorted rows into (start, stop) ranges of about max_rows without splitting a hole."""
+    if n_rows == 0:
+        return []
+    targets = np.arange(max_rows, n_rows, max_rows)
+    cuts = np.unique(starts[np.searchsorted(starts, targets, side='right') - 1])
+    cuts = cuts[cuts > 0]
+    edges = np.r_[0, cuts, n_rows]
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def _assign_trace_columns(df_traces, arrays):
+    for col, values in zip(TRACE_OUTPUT_COLUMNS, arrays):
+        df_traces[col] = values
+    return df_traces
+
+
+def desurvey_traces(df_traces):
+    """Fill trace coordinates and increments of a merged collar/survey frame sorted by HoleID and Depth."""
+    starts = hole_offsets(hole_keys(df_traces['HoleID']))
+    arrays = desurvey(starts, *(df_traces[col].to_numpy() for col in TRACE_INPUT_COLUMNS))
+    return _assign_trace_columns(df_traces, arrays)
+
+
+def desurvey_traces_parallel(frames, workers=DESURVEY_WORKERS, shard_rows=DESURVEY_SHARD_ROWS):
+    """Desurvey several merged, sorted frames on a process pool.
+
+    Frames larger than shard_rows are split into hole ranges so one big dataset still
+    spreads across cores. Only the station arrays are sent to the workers, and every
+    shard is written back to its own row range, so the output order does not depend
+    on which worker finishes first. Workers are started with DESURVEY_START_METHOD:
+    the pool is created from a job thread, and a forked child could inherit locks
+    another thread of the server was holding.
+    """
+    outputs = [np.empty((len(TRACE_OUTPUT_COLUMNS), len(df))) for df in frames]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(DESURVEY_START_METHOD)) as pool:
+        futures = {}
+        for frame_idx, df in enumerate(frames):
+            starts = hole_offsets(hole_keys(df['HoleID']))
+            columns = [df[col].to_numpy(dtype=float) for col in TRACE_INPUT_COLUMNS]
+            for lo, hi in shard_bounds(starts, len(df), shard_rows):
+                shard_starts = starts[(starts >= lo) & (starts < hi)] - lo
+                future = pool.submit(desurvey, shard_starts, *(col[lo:hi] for col in columns))
+                futures[future] = (frame_idx, lo, hi)
+
+        for future in as_completed(futures):
+            frame_idx, lo, hi = futures[future]
+            outputs[frame_idx][:, lo:hi] = np.vstack(future.result())
+
+    return [_assign_trace_columns(df, out) for df, out in zip(frames, outputs)]
+
+
+def merge_collar_survey(df_collar, df_survey):
+    """Validate, merge and sort collar and survey tables ready for desurvey."""
+    for col in REQUIRED_COLLAR_COLS:
+        if col not in df_collar.columns:
+            raise ValueError(f"Required column '{col}' not found in collar data")
+
+    for col in REQUIRED_SURVEY_COLS:
+        if col not in df_survey.columns:
+            raise ValueError(f"Required column '{col}' not found in survey data")
+
+    df_collar = df_collar[REQUIRED_COLLAR_COLS]
+    df_survey = df_survey[REQUIRED_SURVEY_COLS]
+    # Dictionary-encoded HoleIDs with shared categories merge and sort on their integer codes
+    collar_ids, survey_ids = align_hole_ids(df_collar['HoleID'], df_survey['HoleID'])
+    if collar_ids is not df_collar['HoleID'] or survey_ids is not df_survey['HoleID']:
+        df_collar = df_collar.assign(HoleID=collar_ids)
+        df_survey = df_survey.assign(HoleID=survey_ids)
+
+    df_traces = df_collar.merge(df_survey, on='HoleID', how='inner')
+    return df_traces.sort_values(['HoleID', 'Depth'])
+
+
+def hole_fingerprints(df_traces, starts):
+    """64-bit fingerprint of every hole's collar and survey stations in a merged, sorted frame.
+
+    Row hashes are weighted by the station's position in its hole, so reordered,
+    added or removed stations all change the fingerprint.
+    """
+    n = len(df_traces)
+    if n == 0:
+        return np.empty(0, dtype=np.uint64)
+    row_hash = pd.util.hash_pandas_object(df_traces[TRACE_INPUT_COLUMNS], index=False).to_numpy()
+    lengths = np.diff(np.r_[starts, n])
+    position = (np.arange(n) - np.repeat(starts, lengths)).astype(np.uint64)
+    # uint64 arithmetic wraps around, which is what a hash mix wants
+    mixed = row_hash * (2 * position + np.uint64(1))
+    return np.add.reduceat(mixed, starts) ^ lengths.astype(np.uint64)
+
+
+def trace_fingerprints(df_traces, starts=None):
+    """Fingerprints of a merged, sorted frame as a Series indexed by HoleID."""
+    if starts is None:
+        starts = hole_offsets(hole_keys(df_traces['HoleID']))
+    hole_ids = df_traces['HoleID'].to_numpy(dtype=object)[starts].astype(str)
+    return pd.Series(hole_fingerprints(df_traces, starts), index=hole_ids, dtype=np.uint64)
+
+
+def desurvey_traces_incremental(df_traces, previous_traces, previous_fingerprints):
+    """Desurvey a merged, sorted frame, copying holes whose fingerprint matches an earlier run.
+
+    previous_traces is the earlier trace frame of the same dataset and previous_fingerprints
+    its trace_fingerprints. Only new or changed holes go through the desurvey; returns
+    the trace frame and its fingerprints.
+    """
+    starts = hole_offsets(hole_keys(df_traces['HoleID']))
+    lengths = np.diff(np.r_[starts, len(df_traces)])
+    fingerprints = trace_fingerprints(df_traces, starts)
+
+    previous_starts = hole_offsets(hole_keys(previous_traces['HoleID']))
+    previous_ids = pd.Index(previous_traces['HoleID'].to_numpy(dtype=object)[previous_starts].astype(str))
+    fingerprint_idx = previous_fingerprints.index.get_indexer(fingerprints.index)
+    start_idx = previous_ids.get_indexer(fingerprints.index)
+    unchanged = (fingerprint_idx >= 0) & (start_idx >= 0)
+    unchanged[unchanged] = previous_fingerprints.to_numpy()[fingerprint_idx[unchanged]] == fingerprints.to_numpy()[unchanged]
+
+    changed_rows = np.repeat(~unchanged, lengths)
+    output = np.empty((len(TRACE_OUTPUT_COLUMNS), len(df_traces)))
+
+    # An unchanged hole has the same stations in the same order, so its rows copy across by offset
+    kept_rows = np.flatnonzero(~changed_rows)
+    source_rows = kept_rows + np.repeat(previous_starts[start_idx[unchanged]] - starts[unchanged], lengths[unchanged])
+    output[:, kept_rows] = previous_traces[TRACE_OUTPUT_COLUMNS].to_numpy(dtype=float)[source_rows].T
+
+    if changed_rows.any():
+        df_changed = df_traces[changed_rows]
+        changed_starts = hole_offsets(hole_keys(df_changed['HoleID']))
+        output[:, changed_rows] = np.vstack(desurvey(changed_starts, *(df_changed[col].to_numpy() for col in TRACE_INPUT_COLUMNS)))
+
+    logger.info(f"Re-desurveyed {np.count_nonzero(~unchanged)} of {len(starts)} holes")
+    return _assign_trace_columns(df_traces, output), fingerprints
+
+
+def desurvey_datasets(datasets, workers=DESURVEY_WORKERS):
+    """Desurvey (name, df_collar, df_survey) triples into one trace frame tagged with a Dataset column.
+
+    Returns None when there is nothing to desurvey.
+    """
+    names = [name for name, _, _ in datasets]
+    merged_traces = [merge_collar_survey(df_collar, df_survey) for _, df_collar, df_survey in datasets]
+    if not merged_traces:
+        return None
+
+    # Small jobs finish faster in-process than it takes to start a process pool
+    total_rows = sum(len(df) for df in merged_traces)
+    if workers != 1 and total_rows >= DESURVEY_PARALLEL_MIN_ROWS:
+        logger.info(f"Desurveying {total_rows} stations from {len(merged_traces)} datasets on a process pool")
+        all_drilltraces = desurvey_traces_parallel(merged_traces, workers=workers)
+    else:
+        all_drilltraces = [desurvey_traces(df) for df in merged_traces]
+
+    for name, drilltraces in zip(names, all_drilltraces):
+        drilltraces['Dataset'] = name
+
+    return pd.concat(all_drilltraces, ignore_index=True)
+
+
+def desurvey_holes(collar_hole_ids, collar_x, collar_y, collar_z, survey_hole_ids, depth, dip, azimuth):
+    """Desurvey plain collar and survey arrays and return the trace columns as a dict of arrays."""
+    df_collar = pd.DataFrame({'HoleID': collar_hole_ids, 'DH_X': collar_x, 'DH_Y': collar_y, 'DH_Z': collar_z})
+    df_survey = pd.DataFrame({'HoleID': survey_hole_ids, 'Depth': depth, 'Azimuth': azimuth, 'Dip': dip})
+    df_traces = desurvey_traces(merge_collar_survey(df_collar, df_survey))
+    return {col: df_traces[col].to_numpy() for col in df_traces.columns}
+
+
+def desurvey_datasets_incremental(datasets, previous_traces=None, previous_fingerprints=None, workers=DESURVEY_WORKERS):
+    """Desurvey (name, df_collar, df_survey) triples, recomputing only holes changed since the last run.
+
+    previous_traces is the earlier combined trace frame and previous_fingerprints the
+    {dataset: fingerprints} dict returned with it. Datasets without a previous run are
+    desurveyed in full. Returns the new combined frame (or None) and fingerprint dict.
+    """
+    previous_fingerprints = previous_fingerprints or {}
+    has_previous = previous_traces is not None and 'Dataset' in previous_traces.columns
+    names = [name for name, _, _ in datasets]
+    merged_traces = [merge_collar_survey(df_collar, df_survey) for _, df_collar, df_survey in datasets]
+    if not merged_traces:
+        return None, {}
+
+    all_drilltraces = [None] * len(merged_traces)
+    fingerprints = {}
+    fresh = []
+    for idx, (name, df_traces) in enumerate(zip(names, merged_traces)):
+        if has_previous and name in previous_fingerprints:
+            previous = previous_traces[previous_traces['Dataset'] == name]
+            all_drilltraces[idx], fingerprints[name] = desurvey_traces_incremental(df_traces, previous, previous_fingerprints[name])
+        else:
+            fresh.append(idx)
+
+    # Datasets seen for the first time take the same serial or parallel path as a full run;
+    # fingerprint them first, as the desurvey overwrites the collar columns
+    fresh_frames = [merged_traces[idx] for idx in fresh]
+    for idx, df_traces in zip(fresh, fresh_frames):
+        fingerprints[names[idx]] = trace_fingerprints(df_traces)
+    if workers != 1 and sum(len(df) for df in fresh_frames) >= DESURVEY_PARALLEL_MIN_ROWS:
+        fresh_traces = desurvey_traces_parallel(fresh_frames, workers=workers)
+    else:
+        fresh_traces = [desurvey_traces(df) for df in fresh_frames]
+    for idx, drilltraces in zip(fresh, fresh_traces):
+        all_drilltraces[idx] = drilltraces
+
+    for name, drilltraces in zip(names, all_drilltraces):
+        drilltraces['Dataset'] = name
+
+    return pd.concat(all_drilltraces, ignore_index=True), fingerprints
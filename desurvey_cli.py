@@ -0,0 +1,122 @@
+# desurvey_cli.py
+
+import argparse
+import logging
+import os
+import re
+import sys
+from ingest import load_file
+from desurvey import desurvey_datasets, REQUIRED_COLLAR_COLS, REQUIRED_SURVEY_COLS
+from datatype_guesser import guess_column_type
+from hole_dictionary import HoleDictionary, encode_hole_ids
+from config import ALLOWED_EXTENSIONS, DESURVEY_WORKERS, LOG_LEVEL
+from utils import get_file_extension
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_PATTERN = re.compile(r'collar|survey', re.IGNORECASE)
+
+
+def find_datasets(input_dir):
+    """Pair collar and survey files that share a name once the words 'collar'/'survey' are removed."""
+    pairs = {}
+    for file_name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, file_name)
+        if not os.path.isfile(path) or get_file_extension(file_name) not in ALLOWED_EXTENSIONS:
+            continue
+        stem = os.path.splitext(file_name)[0]
+        match = CATEGORY_PATTERN.search(stem)
+        if match is None:
+            continue
+        category = match.group(0).capitalize()
+        key = CATEGORY_PATTERN.sub('', stem).strip(' _-.') or 'dataset'
+        pairs.setdefault(key, {})[category] = path
+
+    datasets = []
+    for key, files in pairs.items():
+        if 'Collar' in files and 'Survey' in files:
+            datasets.append((key, files['Collar'], files['Survey']))
+        else:
+            logger.warning(f"Skipping '{key}': no matching {'survey' if 'Collar' in files else 'collar'} file")
+    return datasets
+
+
+def rename_guessed_columns(df, category):
+    """Rename columns to the mandatory field names the guesser assigns them, first match wins."""
+    renames = {}
+    for column in df.columns:
+        field = guess_column_type(category, str(column), df[column])
+        if field in df.columns or field in renames.values():
+            continue
+        if field in ('HoleID', 'DH_X', 'DH_Y', 'DH_Z', 'Depth', 'Dip', 'Azimuth'):
+            renames[column] = field
+    return df.rename(columns=renames)
+
+
+def read_dataset_file(path, category, dataset, guess_columns):
+    with open(path, 'rb') as f:
+        file_instance, _ = load_file(f, category, dataset, dataset, share=False)
+    if file_instance is None:
+        raise ValueError(f"Failed to read {path}")
+    df = file_instance.df
+    return rename_guessed_columns(df, category) if guess_columns else df
+
+
+def write_traces(df_traces, output_dir, name, output_format):
+    path = os.path.join(output_dir, f"{name}_traces.{output_format}")
+    if output_format == 'parquet':
+        df_traces.to_parquet(path, index=False)
+    else:
+        df_traces.to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Desurvey every collar/survey pair in a directory. Files are paired by name, "
+                    "e.g. 'north_collar.csv' with 'north_survey.xlsx'."
+    )
+    parser.add_argument('input_dir', help="Directory holding the collar and survey files")
+    parser.add_argument('output_dir', help="Directory the traces are written to, one file per dataset")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="Output file format")
+    parser.add_argument('--workers', type=int, default=DESURVEY_WORKERS, help="Desurvey worker processes (1 runs serially)")
+    parser.add_argument('--guess-columns', action='store_true', help="Map columns to HoleID, DH_X, Depth, ... with the column guesser")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=LOG_LEVEL)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    datasets = find_datasets(args.input_dir)
+    if not datasets:
+        logger.error(f"No collar/survey pairs found in {args.input_dir}")
+        return 1
+
+    failed = 0
+    loaded = []
+    for name, collar_path, survey_path in datasets:
+        try:
+            df_collar = read_dataset_file(collar_path, 'Collar', name, args.guess_columns)
+            df_survey = read_dataset_file(survey_path, 'Survey', name, args.guess_columns)
+            missing = [col for col in REQUIRED_COLLAR_COLS if col not in df_collar.columns]
+            missing += [col for col in REQUIRED_SURVEY_COLS if col not in df_survey.columns and col not in missing]
+            if missing:
+                raise ValueError(f"Missing required columns: {', '.join(missing)}")
+            dictionary = HoleDictionary()
+            encode_hole_ids(df_collar, dictionary)
+            encode_hole_ids(df_survey, dictionary)
+            loaded.append((name, df_collar, df_survey))
+        except Exception as e:
+            logger.error(f"Skipping '{name}': {str(e)}")
+            failed += 1
+
+    df_all_traces = desurvey_datasets(loaded, workers=args.workers)
+    if df_all_traces is not None:
+        for name, df_traces in df_all_traces.groupby('Dataset', sort=False):
+            path = write_traces(df_traces, args.output_dir, name, args.format)
+            logger.info(f"Wrote {len(df_traces)} stations for '{name}' to {path}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,78 +6,22 @@ import numpy as np
 import plotly.express as px
 import logging
 import plotly.graph_objects as go
+from desurvey import desurvey_traces, desurvey_datasets_incremental, merge_collar_survey, hole_offsets
+from trace_query import TraceIndex, locate_points, locate_intervals, resample_traces
+from datatype_guesser import REQUIRED_COLUMNS
+from shared_store import share_frame
+from stage_cache import cached_stage, stage_key
+from trace_lod import decimate_traces
+from config import DESURVEY_WORKERS, PLOT_3D_MODE, PLOT_3D_HEIGHT, PLOT_COLORS, POINT_CLOUD_BUDGET
 
 logger = logging.getLogger(__name__)
 
-def calculate_xyz(depth_1, dip_1, azi_1, depth_2, dip_2, azi_2):
-    MD = depth_2 - depth_1
-    if abs(dip_1) != 90:
-        dip_1 = np.radians(90 + dip_1)
-        dip_2 = np.radians(90 + dip_2)
-        azi_1 = np.radians(azi_1)
-        azi_2 = np.radians(azi_2)
-        
-        B_rad = np.arccos(np.cos(dip_2 - dip_1) - (np.sin(dip_1) * np.sin(dip_2) * (1 - np.cos(azi_2 - azi_1))))
-        RF = (2 / B_rad) * np.tan(B_rad / 2) if B_rad != 0 else 1
-
-        dDepth = MD / 2
-        dN = dDepth * ((np.sin(dip_1) * np.cos(azi_1)) + (np.sin(dip_2) * np.cos(azi_2))) * RF
-        dE = dDepth * ((np.sin(dip_1) * np.sin(azi_1)) + (np.sin(dip_2) * np.sin(azi_2))) * RF
-        dV = dDepth * (np.cos(dip_1) + np.cos(dip_2)) * RF
-
-        return MD, RF, dN, dE, dV
-    else:
-        return MD, 1, 0, 0, MD
-
 def generate_drilltraces(df_collar, df_survey):
     try:
-        # Ensure required columns are present
-        required_collar_cols = ['HoleID', 'DH_X', 'DH_Y', 'DH_Z']
-        required_survey_cols = ['HoleID', 'Depth', 'Azimuth', 'Dip']
-        
-        for col in required_collar_cols:
-            if col not in df_collar.columns:
-                raise ValueError(f"Required column '{col}' not found in collar data")
-        
-        for col in required_survey_cols:
-            if col not in df_survey.columns:
-                raise ValueError(f"Required column '{col}' not found in survey data")
-
-        # Merge collar and survey data
-        df_traces = df_collar[required_collar_cols].merge(df_survey[required_survey_cols], on='HoleID', how='inner')
-
-        # Sort by HoleID and Depth
-        df_traces = df_traces.sort_values(['HoleID', 'Depth'])
-
-        # Initialize columns for calculated values
-        df_traces['DH_dX'] = 0.0
-        df_traces['DH_dY'] = 0.0
-        df_traces['DH_dZ'] = 0.0
-
-        # Group by HoleID and calculate drill traces
-        for hole_id, group in df_traces.groupby('HoleID'):
-            x_prev, y_prev, z_prev = group.iloc[0][['DH_X', 'DH_Y', 'DH_Z']]
-            depth_prev, dip_prev, azi_prev = 0, group.iloc[0]['Dip'], group.iloc[0]['Azimuth']
-
-            for idx, row in group.iterrows():
-                depth, dip, azi = row['Depth'], row['Dip'], row['Azimuth']
-                
-                if depth > 0:
-                    MD, RF, dN, dE, dV = calculate_xyz(depth_prev, dip_prev, azi_prev, depth, dip, azi)
-                    
-                    df_traces.at[idx, 'DH_dX'] = dE
-                    df_traces.at[idx, 'DH_dY'] = dN
-                    df_traces.at[idx, 'DH_dZ'] = dV
-                    
-                    x_prev += dE
-                    y_prev += dN
-                    z_prev -= dV  # Subtract dV because depth increases downwards
-                    
-                    df_traces.at[idx, 'DH_X'] = x_prev
-                    df_traces.at[idx, 'DH_Y'] = y_prev
-                    df_traces.at[idx, 'DH_Z'] = z_prev
-
-                depth_prev, dip_prev, azi_prev = depth, dip, azi
+        df_traces = merge_collar_survey(df_collar, df_survey)
+
+        # Desurvey all holes in one vectorized pass
+        df_traces = desurvey_traces(df_traces)
 
         return df_traces
 
@@ -85,64 +29,229 @@ def generate_drilltraces(df_collar, df_survey):
         logger.error(f"Error in generate_drill_traces: {str(e)}")
         raise
 
-def generate_all_drilltraces():
-    all_drilltraces = []
-    for idx, dataset in enumerate(st.session_state.datasets):
-        collar_file = next((file for file in st.session_state.files_list if file.category == "Collar" and file.dataset == f"Dataset_{idx+1}"), None)
-        survey_file = next((file for file in st.session_state.files_list if file.category == "Survey" and file.dataset == f"Dataset_{idx+1}"), None)
+def session_dataset_files(datasets, files_list):
+    pairs = []
+    for idx, dataset in enumerate(datasets):
+        collar_file = next((file for file in files_list if file.category == "Collar" and file.dataset == f"Dataset_{idx+1}"), None)
+        survey_file = next((file for file in files_list if file.category == "Survey" and file.dataset == f"Dataset_{idx+1}"), None)
         if collar_file and survey_file:
-            drilltraces = generate_drilltraces(collar_file.df, survey_file.df)
-            if drilltraces is not None:
-                drilltraces['Dataset'] = f"Dataset_{idx+1}"
-                all_drilltraces.append(drilltraces)
-    
-    if all_drilltraces:
-        return pd.concat(all_drilltraces, ignore_index=True)
-    else:
-        return None
+            pairs.append((f"Dataset_{idx+1}", collar_file, survey_file))
+    return pairs
 
-def plot3d_dhtraces(df_dh_traces):
-    try:
-        fig = go.Figure()
-
-        # Create a trace for each hole in each dataset
-        for dataset in df_dh_traces['Dataset'].unique():
-            dataset_traces = df_dh_traces[df_dh_traces['Dataset'] == dataset]
-            for hole_id in dataset_traces['HoleID'].unique():
-                hole_data = dataset_traces[dataset_traces['HoleID'] == hole_id]
-                fig.add_trace(go.Scatter3d(
-                    x=hole_data['DH_X'],
-                    y=hole_data['DH_Y'],
-                    z=hole_data['DH_Z'],
-                    mode='lines',
-                    name=f"{dataset} - {hole_id}",
-                    line=dict(width=4),
-                    hoverinfo='text',
-                    text=[f'Dataset: {dataset}<br>HoleID: {hole_id}<br>Depth: {depth:.2f}<br>X: {x:.2f}<br>Y: {y:.2f}<br>Z: {z:.2f}'
-                          for depth, x, y, z in zip(hole_data['Depth'], hole_data['DH_X'], hole_data['DH_Y'], hole_data['DH_Z'])]
-                ))
-
-        # Create the layout
-        layout = go.Layout(
-            scene=dict(
-                xaxis_title='X',
-                yaxis_title='Y',
-                zaxis_title='Z',
-                aspectmode='data'
-            ),
-            title='3D Drill Traces for All Datasets',
-            hovermode='closest',
-            height=800,
-            legend=dict(
-                yanchor="top",
-                y=0.99,
-                xanchor="left",
-                x=0.01
-            )
+def dataset_keys(dataset_files):
+    """Desurvey stage key of each (name, collar_file, survey_file); None where a file has no content key."""
+    return [
+        stage_key('desurvey', name, collar_file.content_key, survey_file.content_key)
+        if collar_file.content_key and survey_file.content_key else None
+        for name, collar_file, survey_file in dataset_files
+    ]
+
+def desurvey_job(job, datasets, previous_traces=None, previous_fingerprints=None, workers=DESURVEY_WORKERS, keys=None):
+    """Job function: incremental desurvey one dataset at a time, reporting progress per dataset.
+
+    keys are the datasets' desurvey stage keys; a dataset already desurveyed under its
+    key, by any session, comes from the stage cache. Returns (df_all_drilltraces or None,
+    fingerprints, shared_frame, traces_key); the traces are a read-only view of the
+    shared store when it is enabled. A cancel takes effect between datasets.
+    """
+    previous_fingerprints = previous_fingerprints or {}
+    keys = keys or [None] * len(datasets)
+    frames = []
+    fingerprints = {}
+    for name, _, _ in datasets:
+        job.report(name, 0.0)
+    job.report("Share", 0.0)
+    for dataset, key in zip(datasets, keys):
+        name = dataset[0]
+        job.report(name, 0.0, f"Desurveying {name}")
+        df_traces, dataset_fingerprints = cached_stage(
+            'desurvey', key, desurvey_datasets_incremental,
+            [dataset],
+            previous_traces=previous_traces,
+            previous_fingerprints={name: previous_fingerprints[name]} if name in previous_fingerprints else None,
+            workers=workers,
+        )
+        frames.append(df_traces)
+        fingerprints.update(dataset_fingerprints)
+        job.report(name, 1.0, f"Desurveyed {name}")
+    if not frames:
+        return None, {}, None, None
+    job.report("Share", 0.0, "Sharing drill traces")
+    # The stage keys stand in for a content hash, which saves hashing every trace
+    traces_key = stage_key('traces', *keys) if all(keys) else None
+    df_all_drilltraces, shared_frame = share_frame(pd.concat(frames, ignore_index=True), key=traces_key)
+    job.report("Share", 1.0)
+    if traces_key is None and shared_frame is not None:
+        traces_key = shared_frame.key
+    return df_all_drilltraces, fingerprints, shared_frame, traces_key
+
+def start_drilltrace_job(jobs, workers=DESURVEY_WORKERS):
+    """Submit the desurvey of every complete dataset to the session's job registry.
+
+    The job gets its inputs up front, as session state must not be read off the script thread.
+    """
+    dataset_files = session_dataset_files(st.session_state.datasets, st.session_state.files_list)
+    datasets = [(name, collar_file.df, survey_file.df) for name, collar_file, survey_file in dataset_files]
+    return jobs.submit(
+        "desurvey", "Generate drill traces", desurvey_job, datasets,
+        previous_traces=st.session_state.get("df_drilltraces"),
+        previous_fingerprints=st.session_state.get("trace_fingerprints"),
+        workers=workers,
+        keys=dataset_keys(dataset_files),
+    )
+
+def locate_downhole_files(df_drilltraces, files_list, hole_dictionaries=None):
+    """Add XYZ columns to every Point and Interval file whose dataset has drill traces.
+
+    With the datasets' HoleID dictionaries, traces are re-encoded on them so files
+    encoded with the same dictionary are looked up by code. Returns the number of files located.
+    """
+    located = 0
+    trace_indexes = {}
+    for file in files_list:
+        if file.category not in ("Point", "Interval"):
+            continue
+        missing = [col for col in REQUIRED_COLUMNS[file.category] if col not in file.df.columns]
+        if missing:
+            logger.warning(f"Cannot locate {file.name}: missing columns {missing}")
+            continue
+        if file.dataset not in trace_indexes:
+            dataset_traces = df_drilltraces[df_drilltraces['Dataset'] == file.dataset]
+            dictionary = (hole_dictionaries or {}).get(file.dataset)
+            if dictionary is not None and not dataset_traces.empty:
+                # Combining datasets turned the trace HoleIDs back into strings
+                dataset_traces = dataset_traces.assign(HoleID=dictionary.encode(dataset_traces['HoleID']))
+            trace_indexes[file.dataset] = TraceIndex(dataset_traces) if not dataset_traces.empty else None
+        trace_index = trace_indexes[file.dataset]
+        if trace_index is None:
+            continue
+
+        locate = locate_points if file.category == "Point" else locate_intervals
+        file.df = locate(file.df, trace_index)
+        file.content_key = None
+        file.columns = file.df.columns.tolist()
+        located += 1
+    return located
+
+def combined_trace_arrays(df_dh_traces):
+    # Stable sort keeps each hole's stations contiguous and in their original order
+    hole_codes, _ = pd.factorize(df_dh_traces['HoleID'])
+    order = np.argsort(hole_codes, kind='stable')
+    starts = hole_offsets(hole_codes[order])
+
+    # A NaN row before every hole but the first breaks the line between holes
+    breaks = starts[1:]
+    x = np.insert(df_dh_traces['DH_X'].to_numpy(dtype=float)[order], breaks, np.nan)
+    y = np.insert(df_dh_traces['DH_Y'].to_numpy(dtype=float)[order], breaks, np.nan)
+    z = np.insert(df_dh_traces['DH_Z'].to_numpy(dtype=float)[order], breaks, np.nan)
+    depth = np.insert(df_dh_traces['Depth'].to_numpy(dtype=float)[order], breaks, np.nan)
+    hole_ids = np.insert(df_dh_traces['HoleID'].to_numpy(dtype=object)[order], breaks, None)
+    return x, y, z, np.column_stack([hole_ids, depth])
+
+def add_combined_traces(fig, df_dh_traces):
+    # One WebGL line per dataset instead of one per hole
+    for idx, (dataset, dataset_traces) in enumerate(df_dh_traces.groupby('Dataset', sort=False, observed=True)):
+        x, y, z, customdata = combined_trace_arrays(dataset_traces)
+        fig.add_trace(go.Scatter3d(
+            x=x,
+            y=y,
+            z=z,
+            mode='lines',
+            name=str(dataset),
+            line=dict(width=4, color=PLOT_COLORS[idx % len(PLOT_COLORS)]),
+            connectgaps=False,
+            customdata=customdata,
+            hovertemplate=(f'Dataset: {dataset}<br>HoleID: %{{customdata[0]}}<br>Depth: %{{customdata[1]:.2f}}'
+                           '<br>X: %{x:.2f}<br>Y: %{y:.2f}<br>Z: %{z:.2f}<extra></extra>')
+        ))
+
+def add_per_hole_traces(fig, df_dh_traces):
+    # Create a trace for each hole in each dataset
+    for (dataset, hole_id), hole_data in df_dh_traces.groupby(['Dataset', 'HoleID'], sort=False, observed=True):
+        fig.add_trace(go.Scatter3d(
+            x=hole_data['DH_X'],
+            y=hole_data['DH_Y'],
+            z=hole_data['DH_Z'],
+            mode='lines',
+            name=f"{dataset} - {hole_id}",
+            line=dict(width=4),
+            hoverinfo='text',
+            text=[f'Dataset: {dataset}<br>HoleID: {hole_id}<br>Depth: {depth:.2f}<br>X: {x:.2f}<br>Y: {y:.2f}<br>Z: {z:.2f}'
+                  for depth, x, y, z in zip(hole_data['Depth'], hole_data['DH_X'], hole_data['DH_Y'], hole_data['DH_Z'])]
+        ))
+
+def add_point_clouds(fig, point_clouds, extent=None, point_budget=POINT_CLOUD_BUDGET):
+    # The budget is shared between clouds in proportion to their size
+    total = sum(len(point_cloud) for point_cloud in point_clouds)
+    for point_cloud in point_clouds:
+        cloud_budget = max(int(point_budget * len(point_cloud) / total), 1) if total else point_budget
+        xyz = point_cloud.coordinates(point_cloud.display_rows(extent, cloud_budget))
+        fig.add_trace(go.Scatter3d(
+            x=xyz[:, 0],
+            y=xyz[:, 1],
+            z=xyz[:, 2],
+            mode='markers',
+            name=f"{point_cloud.name} ({len(xyz)} of {len(point_cloud)} points)",
+            marker=dict(size=2),
+            hovertemplate=f'{point_cloud.name}<br>X: %{{x:.2f}}<br>Y: %{{y:.2f}}<br>Z: %{{z:.2f}}<extra></extra>'
+        ))
+
+def build_dhtraces_figure(df_dh_traces, mode=PLOT_3D_MODE, point_clouds=None, extent=None):
+    fig = go.Figure()
+
+    if df_dh_traces is not None and not df_dh_traces.empty:
+        if mode == 'per_hole':
+            add_per_hole_traces(fig, df_dh_traces)
+        else:
+            add_combined_traces(fig, df_dh_traces)
+    if point_clouds:
+        add_point_clouds(fig, point_clouds, extent)
+
+    # Create the layout
+    layout = go.Layout(
+        scene=dict(
+            xaxis_title='X',
+            yaxis_title='Y',
+            zaxis_title='Z',
+            aspectmode='data'
+        ),
+        title='3D Drill Traces for All Datasets',
+        hovermode='closest',
+        height=PLOT_3D_HEIGHT,
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01
         )
+    )
+
+    fig.update_layout(layout)
+    return fig
 
-        # Create the figure and plot
-        fig.update_layout(layout)
+def display_traces(df_dh_traces, resample_step=None, lod=False):
+    # Stations actually drawn: optionally resampled at a fixed interval, then simplified
+    if df_dh_traces is None or df_dh_traces.empty:
+        return df_dh_traces
+    if resample_step:
+        df_dh_traces = resample_traces(df_dh_traces, resample_step)
+    if lod:
+        df_dh_traces = decimate_traces(df_dh_traces)
+    return df_dh_traces
+
+def dhtraces_figure(df_dh_traces, traces_key=None, resample_step=None, lod=False, mode=PLOT_3D_MODE, point_clouds=None, extent=None):
+    """Build the 3D figure, memoizing the display stations and the figure on traces_key and the view settings."""
+    display_key = stage_key('display_traces', traces_key, resample_step, lod) if traces_key else None
+    df_display = cached_stage('display_traces', display_key, display_traces, df_dh_traces, resample_step, lod)
+    # The name labels the cloud's trace, so two uploads of the same content still draw differently
+    cloud_keys = tuple((point_cloud.key, point_cloud.name, len(point_cloud)) for point_cloud in point_clouds or [])
+    extent_key = None if extent is None else tuple(tuple(float(v) for v in bound) for bound in extent)
+    figure_key = stage_key('figure', display_key, mode, cloud_keys, extent_key) if display_key and all(key for key, _, _ in cloud_keys) else None
+    return cached_stage('figure', figure_key, build_dhtraces_figure, df_display, mode, point_clouds, extent)
+
+def plot3d_dhtraces(df_dh_traces, mode=PLOT_3D_MODE, point_clouds=None, extent=None, traces_key=None, resample_step=None, lod=False):
+    try:
+        fig = dhtraces_figure(df_dh_traces, traces_key, resample_step, lod, mode, point_clouds, extent)
         st.plotly_chart(fig, use_container_width=True)
 
     except Exception as e:
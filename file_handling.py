@@ -2,74 +2,21 @@
 
 import streamlit as st
 import pandas as pd
-import io
-import chardet
-import hashlib
 import logging
-from datetime import datetime
-from utils import File, simplify_dtypes
-from datatype_guesser import REQUIRED_COLUMNS
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ingest import load_file
+from hole_dictionary import HoleDictionary, encode_hole_ids
+from stage_cache import advance_key, dictionary_key
+from config import INGEST_WORKERS
 
 logger = logging.getLogger(__name__)
 
-def get_file_hash(file_content):
-    return hashlib.md5(file_content).hexdigest()
-
-def read_file_chardet(uploaded_file):
-    try:
-        file_content = uploaded_file.read()
-        file_size = len(file_content)
-        file_hash = get_file_hash(file_content)
-        
-        if uploaded_file.name.endswith(('xlsx', 'xls', 'xlsm')):
-            df = pd.read_excel(io.BytesIO(file_content))
-            encoding = "Excel (binary)"
-        else:
-            result = chardet.detect(file_content)
-            encoding = result['encoding']
-            text_content = file_content.decode(encoding)
-            df = pd.read_csv(io.StringIO(text_content))
-        
-        return df, encoding, file_size, file_hash
-    except Exception as e:
-        logger.error(f"File reading error: {str(e)}", exc_info=True)
-        return None, None, None, None
-
 def process_uploaded_file(file, category, dataset, group_name):
-    df, encoding, file_size, file_hash = read_file_chardet(file)
-    if df is not None:
-        simplified_dtypes = simplify_dtypes(df)
-        file_instance = File(
-            name=file.name,
-            df=df,
-            category=category,
-            columns=df.columns.tolist(),
-            columns_dtypes=df.dtypes.to_dict(),
-            simplified_dtypes=simplified_dtypes,
-            dataset=dataset,
-            group_name=group_name
-        )
-        file_instance.required_cols = REQUIRED_COLUMNS[category]
-        
+    file_instance, log_entry = load_file(file, category, dataset, group_name)
+    if file_instance is not None:
         # Remove any existing file of the same category and dataset
         st.session_state.files_list = [f for f in st.session_state.files_list if not (f.category == category and f.dataset == dataset)]
         st.session_state.files_list.append(file_instance)
-        
-        log_entry = {
-            "timestamp": datetime.now(),
-            "action": f"{category} file uploaded for {dataset} in group {group_name}",
-            "username": "user1",
-            "filename": file.name,
-            "category": category,
-            "dataset": dataset,
-            "group_name": group_name,
-            "encoding": encoding,
-            "file_size": f"{file_size / 1024:.2f} KB",
-            "rows": len(df),
-            "columns": len(df.columns),
-            "column_names": df.columns.tolist(),
-            "file_hash": file_hash
-        }
         st.session_state["log"].append(log_entry)
         
         return file_instance
@@ -77,6 +24,82 @@ def process_uploaded_file(file, category, dataset, group_name):
         st.error(f"Failed to read {file.name}.")
         return None
 
+def process_downhole_file(file, category, idx, group_name):
+    """Add a Point or Interval upload to a dataset, with its HoleIDs on the dataset's dictionary."""
+    dataset = f"Dataset_{idx+1}"
+    file_instance = process_uploaded_file(file, category, dataset, group_name)
+    if file_instance is None:
+        return None
+    dictionary = st.session_state.hole_dictionaries.setdefault(dataset, HoleDictionary())
+    encode_hole_ids(file_instance.df, dictionary)
+    file_instance.content_key = advance_key(file_instance.content_key, 'hole_ids', dictionary_key(dictionary))
+
+    # The upload replaced any earlier file of this category, so its data_groups row goes too
+    data_groups = st.session_state.data_groups
+    data_groups = data_groups[~((data_groups["Type"] == category) & (data_groups["Dataset"] == dataset))]
+    new_data = {"Type": category, "Name": file_instance.name, "Dataset": dataset, "Source": "Uploaded", "Data Group": group_name}
+    st.session_state.data_groups = pd.concat([data_groups, pd.DataFrame([new_data])], ignore_index=True)
+    return file_instance
+
+def commit_dataset_pair(idx, group_name, collar_file, collar_log, survey_file, survey_log):
+    dataset = f"Dataset_{idx+1}"
+    # Every file of a dataset shares one HoleID dictionary so joins between them run on integer codes
+    dictionary = st.session_state.hole_dictionaries.setdefault(dataset, HoleDictionary())
+    encode_hole_ids(collar_file.df, dictionary)
+    collar_file.content_key = advance_key(collar_file.content_key, 'hole_ids', dictionary_key(dictionary))
+    encode_hole_ids(survey_file.df, dictionary)
+    survey_file.content_key = advance_key(survey_file.content_key, 'hole_ids', dictionary_key(dictionary))
+
+    # Swap both files and their data_groups rows in one step so a dataset is never half replaced
+    st.session_state.files_list = [f for f in st.session_state.files_list if not (f.category in ("Collar", "Survey") and f.dataset == dataset)] + [collar_file, survey_file]
+    st.session_state["log"].extend([collar_log, survey_log])
+
+    new_data = [
+        {"Type": "Collar", "Name": collar_file.name, "Dataset": dataset, "Source": "Uploaded", "Data Group": group_name},
+        {"Type": "Survey", "Name": survey_file.name, "Dataset": dataset, "Source": "Uploaded", "Data Group": group_name}
+    ]
+    st.session_state.data_groups = pd.concat([st.session_state.data_groups, pd.DataFrame(new_data)], ignore_index=True)
+
+def process_uploaded_datasets(datasets, workers=INGEST_WORKERS, on_file_read=None):
+    """Parse the collar/survey uploads of (idx, dataset) pairs on a thread pool.
+
+    Each dataset is committed to the session as soon as both of its files are read;
+    on_file_read(file_name, success) is called on the script thread after every file.
+    Returns {idx: success} for every dataset.
+    """
+    results = {}
+    loaded = {}
+    group_names = {idx: dataset['group_name'] for idx, dataset in datasets}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for idx, dataset in datasets:
+            for category in ("Collar", "Survey"):
+                upload = dataset[category.lower()]
+                future = pool.submit(load_file, upload, category, f"Dataset_{idx+1}", dataset['group_name'])
+                futures[future] = (idx, category, upload.name)
+
+        for future in as_completed(futures):
+            idx, category, file_name = futures[future]
+            try:
+                file_instance, log_entry = future.result()
+            except Exception as e:
+                logger.error(f"Error reading {file_name}: {str(e)}", exc_info=True)
+                file_instance, log_entry = None, None
+            if file_instance is None:
+                st.error(f"Failed to read {file_name}.")
+            if on_file_read is not None:
+                on_file_read(file_name, file_instance is not None)
+
+            loaded.setdefault(idx, {})[category] = (file_instance, log_entry)
+            if len(loaded[idx]) == 2:
+                pair = loaded.pop(idx)
+                (collar_file, collar_log), (survey_file, survey_log) = pair["Collar"], pair["Survey"]
+                results[idx] = collar_file is not None and survey_file is not None
+                if results[idx]:
+                    commit_dataset_pair(idx, group_names[idx], collar_file, collar_log, survey_file, survey_log)
+
+    return results
+
 def uploaded_files_list():
     files_list = st.session_state.get("files_list", [])
     if len(files_list) > 0:
@@ -0,0 +1,74 @@
+# hole_dictionary.py
+
+import numpy as np
+import pandas as pd
+
+
+class HoleDictionary:
+    """Append-only HoleID -> integer code mapping shared by every file of a dataset.
+
+    Encoded columns are Categoricals over the dictionary's categories, so merges, sorts
+    and groupbys between files of the same dataset run on integer codes. Codes never
+    change once assigned, which keeps earlier files valid as new holes are added.
+    """
+
+    def __init__(self, hole_ids=None):
+        self.categories = pd.Index([], dtype=object)
+        if hole_ids is not None:
+            self.add(hole_ids)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def add(self, hole_ids):
+        values = pd.Index(pd.unique(_as_str(hole_ids)), dtype=object)
+        new = values[self.categories.get_indexer(values) < 0]
+        if len(new):
+            self.categories = self.categories.append(new)
+
+    def encode(self, hole_ids):
+        """Return hole_ids as a Categorical over this dictionary, adding unseen holes first."""
+        if isinstance(getattr(hole_ids, 'dtype', None), pd.CategoricalDtype) and hole_ids.cat.categories.equals(self.categories):
+            return hole_ids
+        values = _as_str(hole_ids)
+        self.add(values)
+        return pd.Series(pd.Categorical(values, categories=self.categories), index=getattr(hole_ids, 'index', None))
+
+    def codes(self, hole_ids):
+        """Integer codes of hole_ids; -1 for holes not in the dictionary."""
+        if isinstance(getattr(hole_ids, 'dtype', None), pd.CategoricalDtype) and hole_ids.cat.categories.equals(self.categories):
+            return hole_ids.cat.codes.to_numpy()
+        return self.categories.get_indexer(_as_str(hole_ids))
+
+
+def _as_str(hole_ids):
+    values = np.asarray(hole_ids, dtype=object)
+    return values.astype(str).astype(object)
+
+
+def encode_hole_ids(df, dictionary, columns=('HoleID',)):
+    """Encode a frame's HoleID columns in place with a dataset's dictionary."""
+    for column in columns:
+        if column in df.columns:
+            df[column] = dictionary.encode(df[column])
+    return df
+
+
+def align_hole_ids(left, right):
+    """Give two categorical HoleID columns the same categories so they join on codes.
+
+    A dictionary only ever appends, so one column's categories are usually a prefix of
+    the other's and the shorter column keeps its codes unchanged.
+    """
+    if not (isinstance(left.dtype, pd.CategoricalDtype) and isinstance(right.dtype, pd.CategoricalDtype)):
+        return left, right
+    left_categories, right_categories = left.cat.categories, right.cat.categories
+    if left_categories.equals(right_categories):
+        return left, right
+    if len(left_categories) < len(right_categories):
+        categories = right_categories if right_categories[:len(left_categories)].equals(left_categories) else None
+    else:
+        categories = left_categories if left_categories[:len(right_categories)].equals(right_categories) else None
+    if categories is None:
+        categories = left_categories.append(right_categories[~right_categories.isin(left_categories)])
+    return left.cat.set_categories(categories), right.cat.set_categories(categories)
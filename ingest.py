@@ -0,0 +1,265 @@
+# ingest.py
+
+import pandas as pd
+import numpy as np
+import io
+import chardet
+import hashlib
+import importlib.util
+import logging
+from datetime import datetime
+from utils import File, simplify_dtypes
+from datatype_guesser import REQUIRED_COLUMNS, profile_frame
+from parse_cache import load_cached, store_cached
+from shared_store import get_store, open_shared, share_frame
+from config import CHUNK_SIZE, MAX_FILE_SIZE, ENCODING_SAMPLE_BYTES, HASH_BLOCK_SIZE, ERROR_MESSAGES, READER_BACKEND, ARROW_BLOCK_SIZE
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # The fast reader falls back to pandas without pyarrow
+    pa = None
+    pa_csv = None
+
+HAS_CALAMINE = importlib.util.find_spec('python_calamine') is not None
+
+logger = logging.getLogger(__name__)
+
+def get_file_hash(file_content):
+    return hashlib.md5(file_content).hexdigest()
+
+def get_stream_hash(stream, block_size=HASH_BLOCK_SIZE):
+    # Same digest as get_file_hash, without holding the whole file as one bytes object
+    md5 = hashlib.md5()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b''):
+        md5.update(block)
+    stream.seek(0)
+    return md5.hexdigest()
+
+def get_file_size(stream):
+    size = getattr(stream, 'size', None)
+    if size is None:
+        position = stream.tell()
+        size = stream.seek(0, io.SEEK_END)
+        stream.seek(position)
+    return size
+
+def detect_encoding(stream, sample_bytes=ENCODING_SAMPLE_BYTES):
+    sample = stream.read(sample_bytes)
+    stream.seek(0)
+    encoding = chardet.detect(sample)['encoding'] or 'utf-8'
+    # An ASCII-only prefix says nothing about later bytes; UTF-8 reads the same prefix and more
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+    return encoding
+
+def detect_encoding_full(stream, block_size=HASH_BLOCK_SIZE):
+    detector = chardet.UniversalDetector()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b''):
+        detector.feed(block)
+        if detector.done:
+            break
+    detector.close()
+    stream.seek(0)
+    return detector.result['encoding'] or 'utf-8'
+
+def downcast_chunk(chunk):
+    for col in chunk.columns:
+        values = chunk[col]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            chunk[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            # Only downcast when float32 holds every value exactly, so coordinates keep full precision
+            values_32 = values.astype('float32')
+            if np.array_equal(values_32.to_numpy(dtype='float64'), values.to_numpy(), equal_nan=True):
+                chunk[col] = values_32
+    return chunk
+
+def read_csv_chunks(stream, encoding, chunk_size=CHUNK_SIZE, dtype=None):
+    text_stream = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    try:
+        return [downcast_chunk(chunk) for chunk in pd.read_csv(text_stream, chunksize=chunk_size, dtype=dtype)]
+    finally:
+        # Hand the byte stream back to the caller instead of closing it with the wrapper
+        text_stream.detach()
+
+def conflicting_columns(chunks):
+    """Columns read as numbers in some chunks and as text (or booleans) in others."""
+    kinds = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            values = chunk[col]
+            # An all-empty chunk says nothing about the column's type
+            if values.isna().all():
+                continue
+            if pd.api.types.is_bool_dtype(values):
+                kind = 'bool'
+            elif pd.api.types.is_numeric_dtype(values):
+                kind = 'number'
+            else:
+                kind = 'text'
+            kinds.setdefault(col, set()).add(kind)
+    return [col for col, col_kinds in kinds.items() if len(col_kinds) > 1]
+
+def read_csv_chunked(stream, encoding, chunk_size=CHUNK_SIZE):
+    """Read a CSV chunk by chunk, with one dtype per column across every chunk.
+
+    Each chunk infers its own dtypes, so a column that turns from numbers to text part
+    way down the file is read again as text throughout rather than mixing ints and strs.
+    """
+    start = stream.tell()
+    chunks = read_csv_chunks(stream, encoding, chunk_size)
+    conflicts = conflicting_columns(chunks)
+    if conflicts:
+        logger.info(f"Re-reading columns {conflicts} as text: their type changes between chunks")
+        stream.seek(start)
+        chunks = read_csv_chunks(stream, encoding, chunk_size, dtype={col: str for col in conflicts})
+    return pd.concat(chunks, ignore_index=True)
+
+def read_csv_arrow(stream, encoding, block_size=ARROW_BLOCK_SIZE):
+    read_options = pa_csv.ReadOptions(encoding=encoding, use_threads=True, block_size=block_size)
+    table = pa_csv.read_csv(stream, read_options=read_options)
+    # Arrow types undecodable text as binary instead of failing; let the pandas path handle the encoding
+    if any(pa.types.is_binary(field.type) for field in table.schema):
+        raise ValueError(f"Text is not valid {encoding}")
+    # Keep date-like text as text, the same as the pandas reader leaves it
+    for idx, field in enumerate(table.schema):
+        if pa.types.is_date(field.type) or pa.types.is_timestamp(field.type) or pa.types.is_time(field.type):
+            table = table.set_column(idx, field.name, table.column(idx).cast(pa.string()))
+    return downcast_chunk(table.to_pandas())
+
+def read_text_file(stream, encoding):
+    if READER_BACKEND == 'fast' and pa_csv is not None:
+        try:
+            return read_csv_arrow(stream, encoding)
+        except Exception as e:
+            logger.warning(f"Arrow CSV reader failed, falling back to pandas: {str(e)}")
+            stream.seek(0)
+    return read_csv_chunked(stream, encoding)
+
+def read_excel_file(stream):
+    if READER_BACKEND == 'fast' and HAS_CALAMINE:
+        try:
+            return pd.read_excel(stream, engine='calamine')
+        except Exception as e:
+            logger.warning(f"Calamine Excel reader failed, falling back to openpyxl: {str(e)}")
+            stream.seek(0)
+    return pd.read_excel(stream)
+
+def hash_upload(uploaded_file):
+    """(file_size, file_hash) of an upload, or (None, None) if it is over MAX_FILE_SIZE."""
+    file_size = get_file_size(uploaded_file)
+    if file_size > MAX_FILE_SIZE:
+        logger.error(f"{uploaded_file.name}: " + ERROR_MESSAGES['file_too_large'].format(max_size=MAX_FILE_SIZE // (1024 * 1024)))
+        return None, None
+    return file_size, get_stream_hash(uploaded_file)
+
+def parse_upload(uploaded_file, file_hash, cache=True):
+    """Parse an upload into (df, encoding), through the parse cache when cache is set."""
+    if cache:
+        df, encoding = load_cached(file_hash)
+        if df is not None:
+            return df, encoding
+
+    if uploaded_file.name.endswith(('xlsx', 'xls', 'xlsm')):
+        df = read_excel_file(uploaded_file)
+        encoding = "Excel (binary)"
+    else:
+        encoding = detect_encoding(uploaded_file)
+        try:
+            df = read_text_file(uploaded_file, encoding)
+        except UnicodeDecodeError:
+            # The prefix sample guessed wrong; detect over the whole file, or use latin-1 which decodes any byte
+            logger.info(f"Encoding {encoding} failed for {uploaded_file.name}, detecting from the full file")
+            fallback = detect_encoding_full(uploaded_file)
+            encoding = 'latin-1' if fallback.lower() in ('ascii', encoding.lower()) else fallback
+            df = read_csv_chunked(uploaded_file, encoding)
+
+    if cache:
+        store_cached(file_hash, df, encoding)
+    return df, encoding
+
+def read_file_chardet(uploaded_file):
+    try:
+        file_size, file_hash = hash_upload(uploaded_file)
+        if file_hash is None:
+            return None, None, None, None
+        df, encoding = parse_upload(uploaded_file, file_hash)
+        return df, encoding, file_size, file_hash
+    except Exception as e:
+        logger.error(f"File reading error: {str(e)}", exc_info=True)
+        return None, None, None, None
+
+def read_shared(uploaded_file):
+    """Like read_file_chardet, but through the shared store; returns (df, encoding, file_size, file_hash, shared_frame).
+
+    An upload already in the store is opened without parsing it again. Otherwise it is
+    parsed and added; the store then takes the parse cache's place, so each upload is
+    kept on disk once. Without a store this is read_file_chardet with no handle.
+    """
+    try:
+        file_size, file_hash = hash_upload(uploaded_file)
+        if file_hash is None:
+            return None, None, None, None, None
+        shared_frame = open_shared(file_hash)
+        if shared_frame is not None:
+            logger.info(f"Shared store hit for {uploaded_file.name}")
+            return shared_frame.frame(), shared_frame.metadata.get('encoding'), file_size, file_hash, shared_frame
+
+        df, encoding = parse_upload(uploaded_file, file_hash, cache=get_store() is None)
+        df, shared_frame = share_frame(df, key=file_hash, metadata={'encoding': encoding})
+        return df, encoding, file_size, file_hash, shared_frame
+    except Exception as e:
+        logger.error(f"File reading error: {str(e)}", exc_info=True)
+        return None, None, None, None, None
+
+def load_file(file, category, dataset, group_name, share=True):
+    """Read a file into a File instance plus its log entry, without touching any session state.
+
+    With share, the frame is a read-only view of the process-wide shared store, so
+    every session that uploads the same file holds one copy of it and only the first parses it.
+    """
+    if share:
+        df, encoding, file_size, file_hash, shared_frame = read_shared(file)
+    else:
+        df, encoding, file_size, file_hash = read_file_chardet(file)
+        shared_frame = None
+    if df is None:
+        return None, None
+
+    simplified_dtypes = simplify_dtypes(df)
+    file_instance = File(
+        name=file.name,
+        df=df,
+        category=category,
+        columns=df.columns.tolist(),
+        columns_dtypes=df.dtypes.to_dict(),
+        simplified_dtypes=simplified_dtypes,
+        dataset=dataset,
+        group_name=group_name,
+        column_fingerprints=profile_frame(df),
+        shared_frame=shared_frame,
+        content_key=file_hash
+    )
+    file_instance.required_cols = REQUIRED_COLUMNS[category]
+
+    log_entry = {
+        "timestamp": datetime.now(),
+        "action": f"{category} file uploaded for {dataset} in group {group_name}",
+        "username": "user1",
+        "filename": file.name,
+        "category": category,
+        "dataset": dataset,
+        "group_name": group_name,
+        "encoding": encoding,
+        "file_size": f"{file_size / 1024:.2f} KB",
+        "rows": len(df),
+        "columns": len(df.columns),
+        "column_names": df.columns.tolist(),
+        "file_hash": file_hash
+    }
+    return file_instance, log_entry
@@ -0,0 +1,168 @@
+# jobs.py
+
+import logging
+import threading
+import itertools
+import streamlit as st
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_WORKERS, JOB_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# One pool for the whole server process: jobs live outside any session's script run,
+# so a rerun or a widget interaction never interrupts them
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_job_ids = itertools.count(1)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when its job has been cancelled."""
+
+
+class Job:
+    """A long-running function on the shared job pool, with progress and cancellation.
+
+    The function is called as fn(job, *args) and should call job.report() as it works;
+    report() raises JobCancelled once cancel() has been called, so cancellation takes
+    effect at the function's next progress report.
+    """
+
+    def __init__(self, name, label):
+        self.id = next(_job_ids)
+        self.name = name
+        self.label = label
+        self.progress = {}
+        self.message = ""
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.collected = False
+        self.started = datetime.now()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def fraction(self):
+        """Overall progress between 0 and 1, averaged over the reported steps."""
+        if self.status == "done":
+            return 1.0
+        return sum(self.progress.values()) / len(self.progress) if self.progress else 0.0
+
+    def report(self, step, fraction, message=""):
+        """Record the progress of one step (a dataset, say) and stop here if cancelled."""
+        self.progress[step] = min(max(float(fraction), 0.0), 1.0)
+        if message:
+            self.message = message
+        if self.cancelled:
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+        # A job still waiting for a worker never starts
+        if self._future is not None and self._future.cancel():
+            self._finish("cancelled")
+
+    def _finish(self, status, result=None, error=None):
+        # Status goes last: the script thread polls it and reads the result as soon as it says done
+        self.result, self.error = result, error
+        self.finished = datetime.now()
+        self.status = status
+
+    def _run(self, fn, args, kwargs):
+        if self.cancelled:
+            self._finish("cancelled")
+            return
+        self.status = "running"
+        try:
+            result = fn(self, *args, **kwargs)
+            self._finish("cancelled" if self.cancelled else "done", result=result)
+        except JobCancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            logger.error(f"Job {self.label} failed: {str(e)}", exc_info=True)
+            self._finish("failed", error=str(e))
+        logger.info(f"Job {self.label} {self.status} after {(self.finished - self.started).total_seconds():.1f} s")
+
+
+class JobRegistry:
+    """Jobs of one session by name, kept in st.session_state so reruns can find them.
+
+    Submitting a name that is already running cancels the older job first. Finished
+    jobs stay in the registry until collect() hands them to the script once.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.announced = set()
+
+    def submit(self, name, label, fn, *args, **kwargs):
+        previous = self.jobs.get(name)
+        if previous is not None and not previous.done:
+            previous.cancel()
+        job = Job(name, label)
+        job._future = _executor.submit(job._run, fn, args, kwargs)
+        self.jobs[name] = job
+        logger.info(f"Submitted job {label}")
+        return job
+
+    def get(self, name):
+        return self.jobs.get(name)
+
+    def running(self):
+        return [job for job in self.jobs.values() if not job.done]
+
+    def collect(self, name):
+        """The finished job of that name, removed from the registry, or None if it is still running.
+
+        Removing it drops the registry's reference to the result, so a result the script
+        replaces later (shared store handles, say) is freed with it.
+        """
+        job = self.jobs.get(name)
+        if job is None or not job.done:
+            return None
+        job.collected = True
+        del self.jobs[name]
+        return job
+
+    def cancel(self, name):
+        job = self.jobs.get(name)
+        if job is not None and not job.done:
+            job.cancel()
+
+
+def show_jobs(jobs):
+    """Progress and cancel buttons of a registry's jobs, polled without rerunning the whole page.
+
+    Polling only runs while a job is running; a job finishing triggers one full rerun
+    so the script can collect its result, and that rerun stops the polling.
+    """
+    if jobs.running():
+        _poll_jobs(jobs)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _poll_jobs(jobs):
+    for job in list(jobs.jobs.values()):
+        if job.collected:
+            continue
+        if job.done:
+            if job.id not in jobs.announced:
+                jobs.announced.add(job.id)
+                st.rerun()
+            continue
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.progress(job.fraction, text=f"{job.label}: {job.message or job.status}")
+        with col2:
+            if st.button("Cancel", key=f"cancel_job_{job.id}"):
+                job.cancel()
@@ -6,13 +6,20 @@ from datetime import datetime
 import logging
 
 # Import functions from other modules
-from file_handling import read_file_chardet, process_uploaded_file
-from data_processing import identify_columns_form, process_file_categories, change_dtypes
-from drill_traces import generate_all_drilltraces, plot3d_dhtraces
-from utils import File, simplify_dtypes, required_cols
-from config import APP_TITLE, APP_ICON, ALLOWED_EXTENSIONS
+from file_handling import process_uploaded_datasets, process_downhole_file
+from data_processing import apply_column_types
+from drill_traces import start_drilltrace_job, locate_downhole_files, plot3d_dhtraces
+from utils import format_bytes
+from compositing import composite_intervals
+from spatial_index import TraceSpatialIndex
+from anticollision import proximity_scan
+from block_model import BlockGrid, block_intercepts_job
+from surfaces import read_surface, intersect_surfaces
+from point_cloud import load_point_cloud
+from jobs import JobRegistry, show_jobs
+from config import APP_TITLE, APP_ICON, ALLOWED_EXTENSIONS, LOD_ENABLED, COMPOSITE_LENGTH, RESAMPLE_STEP, PLOT_3D_RESAMPLE, PROXIMITY_THRESHOLD, SURFACE_EXTENSIONS, COLUMN_PREVIEW_ROWS
 import datatype_guesser
-from datatype_guesser import REQUIRED_COLUMNS, COLUMN_DATATYPES
+from datatype_guesser import REQUIRED_COLUMNS, COLUMN_DATATYPES, DOWNHOLE_CATEGORIES
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +37,20 @@ if "log" not in st.session_state:
     st.session_state["log"] = []
 if "df_drilltraces" not in st.session_state:
     st.session_state["df_drilltraces"] = pd.DataFrame()
+if "trace_fingerprints" not in st.session_state:
+    st.session_state["trace_fingerprints"] = {}
+if "surfaces" not in st.session_state:
+    st.session_state["surfaces"] = {}
+if "spatial_index" not in st.session_state:
+    st.session_state["spatial_index"] = TraceSpatialIndex()
+if "jobs" not in st.session_state:
+    st.session_state["jobs"] = JobRegistry()
+if "point_clouds" not in st.session_state:
+    st.session_state["point_clouds"] = {}
+if "composites" not in st.session_state:
+    st.session_state["composites"] = {}
+if "hole_dictionaries" not in st.session_state:
+    st.session_state["hole_dictionaries"] = {}
 if "data_groups" not in st.session_state:
     st.session_state.data_groups = pd.DataFrame(columns=["Type", "Name", "Dataset", "Source", "Data Group"])
 
@@ -40,6 +61,36 @@ if len(st.session_state["log"]) == 0:
 # Main app
 st.title(APP_TITLE)
 
+# Pick up background jobs that finished since the last run
+desurvey_job = st.session_state.jobs.collect("desurvey")
+if desurvey_job is not None:
+    if desurvey_job.status == "done" and desurvey_job.result[0] is not None:
+        df_all_drilltraces, st.session_state["trace_fingerprints"], st.session_state["shared_traces"], st.session_state["traces_key"] = desurvey_job.result
+        st.session_state["df_drilltraces"] = df_all_drilltraces
+        st.success("All drill traces generated successfully. Switch to the '3D Visualization' tab to view the plot.")
+        st.session_state.spatial_index.update(df_all_drilltraces)
+        located_files = locate_downhole_files(df_all_drilltraces, st.session_state.files_list, st.session_state.hole_dictionaries)
+        if located_files:
+            st.info(f"Added XYZ coordinates to {located_files} Point/Interval files.")
+
+        # Add generated drill traces to data_groups DataFrame
+        new_data = {"Type": "Drill Traces", "Name": "Generated Drill Traces", "Dataset": "All", "Source": "Generated", "Data Group": "All"}
+        st.session_state.data_groups = pd.concat([st.session_state.data_groups, pd.DataFrame([new_data])], ignore_index=True)
+    elif desurvey_job.status == "cancelled":
+        st.warning("Drill trace generation was cancelled.")
+    else:
+        st.error(f"Failed to generate drill traces. Please check your input files. {desurvey_job.error or ''}")
+
+block_job = st.session_state.jobs.collect("block_model")
+if block_job is not None:
+    if block_job.status == "done":
+        st.session_state["df_block_intercepts"] = block_job.result
+    elif block_job.status == "failed":
+        st.error(f"Block model intersection failed: {block_job.error}")
+
+# Filled at the end of the run, so jobs submitted further down are shown and polled straight away
+jobs_area = st.container()
+
 # Create four main tabs
 tab1, tab2, tab3, tab4 = st.tabs(["Data Input", "Data Viewer", "3D Visualization", "Log"])
 
@@ -65,48 +116,62 @@ with tab1:
                 with col2:
                     dataset["survey"] = st.file_uploader(f"Upload Survey File for {dataset['group_name']}", type=ALLOWED_EXTENSIONS, key=f"survey_uploader_{idx}")
 
+                # Downhole data is located on the dataset's traces, now if they exist or when they are generated
+                downhole_upload = st.file_uploader(f"Upload Downhole Data File for {dataset['group_name']}", type=ALLOWED_EXTENSIONS, key=f"downhole_uploader_{idx}")
+                if downhole_upload is not None:
+                    guessed_category = datatype_guesser.guess_file_type(downhole_upload.name)
+                    downhole_category = st.selectbox(
+                        f"File category for {downhole_upload.name}",
+                        DOWNHOLE_CATEGORIES,
+                        index=DOWNHOLE_CATEGORIES.index(guessed_category) if guessed_category in DOWNHOLE_CATEGORIES else 0,
+                        key=f"downhole_category_{idx}"
+                    )
+                    if st.button(f"Add {downhole_category} File", key=f"downhole_add_{idx}"):
+                        file_instance = process_downhole_file(downhole_upload, downhole_category, idx, dataset["group_name"])
+                        if file_instance is not None:
+                            st.success(f"Added {file_instance.name} to Dataset {idx + 1} ({dataset['group_name']}) as a {downhole_category} file")
+                            if not st.session_state["df_drilltraces"].empty and locate_downhole_files(st.session_state["df_drilltraces"], [file_instance], st.session_state.hole_dictionaries):
+                                st.info(f"Added XYZ coordinates to {file_instance.name}.")
+
         # Process uploaded files
         if st.button("Process Uploaded Files"):
-            for idx, dataset in enumerate(st.session_state.datasets):
-                if dataset["collar"] and dataset["survey"]:
-                    collar_file = process_uploaded_file(dataset["collar"], "Collar", f"Dataset_{idx+1}", dataset['group_name'])
-                    survey_file = process_uploaded_file(dataset["survey"], "Survey", f"Dataset_{idx+1}", dataset['group_name'])
-                    if collar_file and survey_file:
-                        st.success(f"Dataset {idx + 1} ({dataset['group_name']}) processed successfully")
-                        
-                        # Update data_groups DataFrame
-                        new_data = [
-                            {"Type": "Collar", "Name": collar_file.name, "Dataset": f"Dataset_{idx+1}", "Source": "Uploaded", "Data Group": dataset['group_name']},
-                            {"Type": "Survey", "Name": survey_file.name, "Dataset": f"Dataset_{idx+1}", "Source": "Uploaded", "Data Group": dataset['group_name']}
-                        ]
-                        st.session_state.data_groups = pd.concat([st.session_state.data_groups, pd.DataFrame(new_data)], ignore_index=True)
-                    else:
-                        st.error(f"Error processing Dataset {idx + 1} ({dataset['group_name']})")
+            pending = [(idx, dataset) for idx, dataset in enumerate(st.session_state.datasets) if dataset["collar"] and dataset["survey"]]
+            total_files = 2 * len(pending)
+            files_read = []
+            progress = st.progress(0.0, text="Reading uploaded files...")
+
+            def report_file_read(file_name, success):
+                files_read.append(file_name)
+                progress.progress(len(files_read) / total_files, text=f"Read {file_name} ({len(files_read)}/{total_files})")
+
+            results = process_uploaded_datasets(pending, on_file_read=report_file_read)
+            for idx, dataset in pending:
+                if results.get(idx):
+                    st.success(f"Dataset {idx + 1} ({dataset['group_name']}) processed successfully")
+                else:
+                    st.error(f"Error processing Dataset {idx + 1} ({dataset['group_name']})")
             st.experimental_rerun()
 
         # Guess and identify columns for each file after upload
         for file in st.session_state.files_list:
-            if file.category in ["Collar", "Survey"]:
+            if file.category in ["Collar", "Survey"] + DOWNHOLE_CATEGORIES:
                 with st.expander(f"Identify columns for {file.name} ({file.dataset})", expanded=True):
                     st.write(f"Select column data types for the {file.category} file: {file.name}")
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.dataframe(file.df)
+                        # Sending the whole table to the browser on every rerun is what made this tab slow
+                        st.dataframe(file.df.head(COLUMN_PREVIEW_ROWS))
+                        if len(file.df) > COLUMN_PREVIEW_ROWS:
+                            st.caption(f"First {COLUMN_PREVIEW_ROWS} of {len(file.df)} rows")
                     with col2:
                         auto_guess = st.button("Auto Guess", key=f"{file.name}_{file.dataset}_auto_guess")
 
                         if auto_guess:
-                            assigned_mandatory_fields = set()
                             column_assignments = {}
 
+                            # One guess per column, read from the fingerprint taken at upload
                             for column in file.df.columns:
-                                guessed_datatype = datatype_guesser.guess_type('datacolumn', f"{file.category}_{column}", file.df[column])
-                                if guessed_datatype in file.required_cols and guessed_datatype not in assigned_mandatory_fields:
-                                    column_assignments[column] = guessed_datatype
-                                    assigned_mandatory_fields.add(guessed_datatype)
-                                else:
-                                    guessed_datatype = datatype_guesser.guess_column_type(file.category, column, file.df[column])
-                                    column_assignments[column] = guessed_datatype
+                                column_assignments[column] = datatype_guesser.guess_column_type(file.category, str(column), file.df[column], file.column_fingerprints.get(column))
 
                             file.user_defined_dtypes.update(column_assignments)
                             st.success(f"Auto guessed data types for {file.name}")
@@ -124,27 +189,53 @@ with tab1:
                             file.user_defined_dtypes[column] = new_dtype
 
                         if st.button("Apply Column Types", key=f"{file.name}_{file.dataset}_apply_types"):
-                            file.df = change_dtypes(file.df, file.user_defined_dtypes)
-                            st.success(f"Applied column types for {file.name}")
+                            bytes_saved = apply_column_types(file, st.session_state.hole_dictionaries.get(file.dataset))
+                            file.column_fingerprints = datatype_guesser.profile_frame(file.df)
+                            st.success(f"Applied column types for {file.name} ({format_bytes(max(bytes_saved, 0))} saved)")
 
-        # Generate drill traces
+        # Generate drill traces in the background; the result is picked up at the top of a later rerun
         if st.button("Generate All Drill Traces"):
-            df_all_drilltraces = generate_all_drilltraces()
-            if df_all_drilltraces is not None:
-                st.session_state["df_drilltraces"] = df_all_drilltraces
-                st.success("All drill traces generated successfully. Switch to the '3D Visualization' tab to view the plot.")
-                
-                # Add generated drill traces to data_groups DataFrame
-                new_data = {"Type": "Drill Traces", "Name": "Generated Drill Traces", "Dataset": "All", "Source": "Generated", "Data Group": "All"}
-                st.session_state.data_groups = pd.concat([st.session_state.data_groups, pd.DataFrame([new_data])], ignore_index=True)
-            else:
-                st.error("Failed to generate drill traces. Please check your input files.")
+            start_drilltrace_job(st.session_state.jobs)
+            st.info("Generating drill traces in the background. You can keep using the app meanwhile.")
+
+        # Composite interval files
+        interval_files = [file for file in st.session_state.files_list if file.category == "Interval"]
+        if interval_files:
+            with st.expander("Composite Interval Files"):
+                composite_length = st.number_input("Composite length (m, 0 composites whole domains)", min_value=0.0, value=float(COMPOSITE_LENGTH))
+                for file in interval_files:
+                    domain_options = ["None"] + [col for col in file.df.columns if file.user_defined_dtypes.get(col) in ("Category", "Text")]
+                    domain_column = st.selectbox(f"Domain column for {file.name}", options=domain_options, key=f"{file.name}_{file.dataset}_domain")
+                    if st.button(f"Composite {file.name}", key=f"{file.name}_{file.dataset}_composite"):
+                        try:
+                            df_composites = composite_intervals(
+                                file.df,
+                                length=composite_length or None,
+                                domain_column=None if domain_column == "None" else domain_column,
+                            )
+                            st.session_state.composites[file.name] = df_composites
+                            st.success(f"Composited {len(file.df)} intervals of {file.name} into {len(df_composites)} composites")
+                        except ValueError as e:
+                            st.error(str(e))
+                    if file.name in st.session_state.composites:
+                        st.dataframe(st.session_state.composites[file.name])
 
 
             
     with data_tabs[1]:  # Points tab
         st.header("Points Data Input")
-        st.info("Points data input functionality to be implemented.")
+        point_uploads = st.file_uploader("Upload point files with X, Y and Z columns", type=ALLOWED_EXTENSIONS, accept_multiple_files=True, key="point_uploader")
+        if st.button("Load Points") and point_uploads:
+            for upload in point_uploads:
+                try:
+                    point_cloud = load_point_cloud(upload)
+                    st.session_state.point_clouds[point_cloud.name] = point_cloud
+                    st.success(f"Loaded {point_cloud.name}: {len(point_cloud)} points")
+                except ValueError as e:
+                    st.error(f"Failed to load {upload.name}: {str(e)}")
+
+        for point_cloud_name, point_cloud in st.session_state.point_clouds.items():
+            st.write(f"{point_cloud_name}: {len(point_cloud)} points, {format_bytes(point_cloud.nbytes)}")
 
     with data_tabs[2]:  # Lines tab
         st.header("Lines Data Input")
@@ -152,7 +243,27 @@ with tab1:
 
     with data_tabs[3]:  # Surfaces tab
         st.header("Surfaces Data Input")
-        st.info("Surfaces data input functionality to be implemented.")
+        surface_uploads = st.file_uploader("Upload triangulated surfaces", type=SURFACE_EXTENSIONS, accept_multiple_files=True, key="surface_uploader")
+        if st.button("Load Surfaces") and surface_uploads:
+            for upload in surface_uploads:
+                try:
+                    surface = read_surface(upload)
+                    st.session_state.surfaces[surface.name] = surface
+                    st.success(f"Loaded {surface.name}: {len(surface)} triangles")
+                except ValueError as e:
+                    st.error(f"Failed to load {upload.name}: {str(e)}")
+
+        for surface_name, surface in st.session_state.surfaces.items():
+            st.write(f"{surface_name}: {len(surface.vertices)} vertices, {len(surface)} triangles")
+
+        if st.session_state.surfaces and not st.session_state["df_drilltraces"].empty:
+            selected_surfaces = st.multiselect("Surfaces to intersect", list(st.session_state.surfaces), default=list(st.session_state.surfaces))
+            if st.button("Find Pierce Points"):
+                df_pierce_points = intersect_surfaces(st.session_state["df_drilltraces"], [st.session_state.surfaces[name] for name in selected_surfaces])
+                st.session_state["df_pierce_points"] = df_pierce_points
+                st.success(f"Found {len(df_pierce_points)} pierce points")
+            if "df_pierce_points" in st.session_state:
+                st.dataframe(st.session_state["df_pierce_points"])
 
 with tab2:
     st.header("Data Viewer")
@@ -211,9 +322,72 @@ with tab2:
 
 with tab3:
     st.header("3D Visualization")
+    point_clouds = list(st.session_state.point_clouds.values())
+    point_extent = None
+    if point_clouds:
+        with st.expander("Point Cloud View Extent"):
+            # The displayed subset is only recomputed when these ranges change
+            cloud_min = [min(float(pc.bounds[0][axis]) for pc in point_clouds) for axis in range(3)]
+            cloud_max = [max(float(pc.bounds[1][axis]) for pc in point_clouds) for axis in range(3)]
+            view_ranges = [st.slider(f"{name} range", cloud_min[axis], max(cloud_max[axis], cloud_min[axis] + 0.01), (cloud_min[axis], max(cloud_max[axis], cloud_min[axis] + 0.01)), key=f"point_view_{name}")
+                           for axis, name in enumerate("XYZ")]
+            point_extent = ([low for low, _ in view_ranges], [high for _, high in view_ranges])
+
     if "df_drilltraces" in st.session_state and not st.session_state["df_drilltraces"].empty:
-        plot3d_dhtraces(st.session_state["df_drilltraces"])
+        resample_step = None
+        if st.checkbox("Resample traces at a fixed interval", value=PLOT_3D_RESAMPLE):
+            resample_step = st.number_input("Resampling interval (m)", min_value=0.1, value=float(RESAMPLE_STEP))
+        # Resampling, simplification and the figure are memoized, so unrelated reruns reuse them
+        plot3d_dhtraces(st.session_state["df_drilltraces"], point_clouds=point_clouds, extent=point_extent,
+                        traces_key=st.session_state.get("traces_key"), resample_step=resample_step, lod=LOD_ENABLED)
+
+        with st.expander("Find Holes Near a Point"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                query_x = st.number_input("X", value=0.0, format="%.2f")
+            with col2:
+                query_y = st.number_input("Y", value=0.0, format="%.2f")
+            with col3:
+                query_z = st.number_input("Z", value=0.0, format="%.2f")
+            query_radius = st.number_input("Search radius (m)", min_value=0.0, value=25.0)
+            query_point = [query_x, query_y, query_z]
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Holes Within Radius"):
+                    st.dataframe(st.session_state.spatial_index.within_radius(query_point, query_radius))
+            with col2:
+                if st.button("Nearest Holes"):
+                    st.dataframe(st.session_state.spatial_index.nearest_holes(query_point, k=5))
+
+        with st.expander("Anti-collision Scan"):
+            proximity_threshold = st.number_input("Minimum separation (m)", min_value=0.0, value=float(PROXIMITY_THRESHOLD))
+            if st.button("Scan Hole Separation"):
+                df_closest, df_close = proximity_scan(st.session_state["df_drilltraces"], proximity_threshold)
+                st.subheader("Closest neighbour of each hole")
+                st.dataframe(df_closest)
+                st.subheader(f"Depth ranges closer than {proximity_threshold} m to another hole")
+                st.dataframe(df_close)
+
+        with st.expander("Block Model Intersection"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                grid_origin = [st.number_input(f"Origin {axis}", value=0.0, format="%.2f", key=f"grid_origin_{axis}") for axis in "XYZ"]
+            with col2:
+                grid_block_size = [st.number_input(f"Block size {axis} (m)", min_value=0.01, value=10.0, key=f"grid_block_{axis}") for axis in "XYZ"]
+            with col3:
+                grid_counts = [st.number_input(f"Blocks along {axis}", min_value=1, value=100, step=1, key=f"grid_count_{axis}") for axis in "XYZ"]
+            grid_rotation = st.number_input("Rotation (degrees counter-clockwise from X)", value=0.0)
+            if st.button("Intersect Traces with Blocks"):
+                grid = BlockGrid(grid_origin, grid_block_size, grid_counts, rotation=grid_rotation)
+                st.session_state.jobs.submit("block_model", "Block model intersection", block_intercepts_job, st.session_state["df_drilltraces"], grid)
+            if "df_block_intercepts" in st.session_state:
+                df_intercepts = st.session_state["df_block_intercepts"]
+                st.write(f"{len(df_intercepts)} block intercepts")
+                st.dataframe(df_intercepts)
+                st.download_button("Download Block Intercepts", df_intercepts.to_csv(index=False), file_name="block_intercepts.csv", mime="text/csv")
     else:
+        if point_clouds:
+            plot3d_dhtraces(None, point_clouds=point_clouds, extent=point_extent)
         st.info("No drill traces data available. Please generate drill traces in the 'Data Input' tab first.")
 
 with tab4:
@@ -232,4 +406,7 @@ with tab4:
                 st.write(f"Columns: {log_entry.get('columns', 'N/A')}")
                 if 'column_names' in log_entry:
                     st.write("Column names:")
-                    st.write(", ".join(log_entry['column_names']))
\ No newline at end of file
+                    st.write(", ".join(log_entry['column_names']))
+
+with jobs_area:
+    show_jobs(st.session_state.jobs)
@@ -0,0 +1,104 @@
+# parse_cache.py
+
+import os
+import logging
+import tempfile
+from config import PARSE_CACHE_ENABLED, PARSE_CACHE_DIR, PARSE_CACHE_MAX_BYTES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # The cache is disabled without pyarrow
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING_METADATA_KEY = b'drillholes.encoding'
+
+
+def cache_available():
+    return PARSE_CACHE_ENABLED and pq is not None
+
+
+def _cache_path(file_hash, cache_dir):
+    return os.path.join(cache_dir, f"{file_hash}.parquet")
+
+
+def load_cached(file_hash, cache_dir=PARSE_CACHE_DIR):
+    """Return (df, encoding) for a previously parsed file, or (None, None) on a miss."""
+    if not cache_available():
+        return None, None
+    path = _cache_path(file_hash, cache_dir)
+    if not os.path.exists(path):
+        return None, None
+    try:
+        table = pq.read_table(path)
+        metadata = table.schema.metadata or {}
+        encoding = metadata.get(ENCODING_METADATA_KEY, b'').decode() or None
+        df = table.to_pandas()
+        # Touch the entry so eviction sees it as recently used
+        os.utime(path)
+        logger.info(f"Parse cache hit for {file_hash}")
+        return df, encoding
+    except Exception as e:
+        logger.warning(f"Discarding unreadable parse cache entry {path}: {str(e)}")
+        _remove(path)
+        return None, None
+
+
+def store_cached(file_hash, df, encoding, cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """Write a parsed file to the cache, then evict least recently used entries over max_bytes."""
+    if not cache_available():
+        return False
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        table = pa.Table.from_pandas(df)
+        metadata = dict(table.schema.metadata or {})
+        metadata[ENCODING_METADATA_KEY] = (encoding or '').encode()
+        table = table.replace_schema_metadata(metadata)
+
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, _cache_path(file_hash, cache_dir))
+        finally:
+            _remove(tmp_path)
+    except Exception as e:
+        # Mixed-type object columns and similar cannot be stored as Parquet; those files are just re-parsed
+        logger.warning(f"Could not cache parsed file {file_hash}: {str(e)}")
+        return False
+
+    evict(cache_dir, max_bytes)
+    return True
+
+
+def evict(cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """Delete least recently used cache entries until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.parquet'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        logger.info(f"Evicted parse cache entry {path}")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,124 @@
+# point_cloud.py
+
+import logging
+import numpy as np
+import pandas as pd
+from ingest import read_file_chardet, downcast_chunk
+from datatype_guesser import match_mandatory_field
+from config import POINT_CLOUD_BUDGET
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_FIELDS = ['DH_X', 'DH_Y', 'DH_Z']
+
+# Voxel sizes tried before settling for a subset slightly over budget
+MAX_VOXEL_PASSES = 20
+
+
+def guess_coordinate_columns(columns):
+    """Map DH_X, DH_Y and DH_Z to the first column the header guesser assigns to each."""
+    mapping = {}
+    for column in columns:
+        field = match_mandatory_field('Collar', str(column))
+        if field in COORDINATE_FIELDS and field not in mapping:
+            mapping[field] = column
+    return mapping
+
+
+def voxel_downsample(points, point_budget=POINT_CLOUD_BUDGET, extent=None):
+    """Row indices of a subset of points within extent keeping one point per voxel, within point_budget.
+
+    The voxel size starts from the extent's size over the budget and grows until the
+    occupied voxels fit. Flat axes are left out so 2D point sets get square voxels.
+    """
+    if extent is None:
+        lo, hi = np.nanmin(points, axis=0), np.nanmax(points, axis=0)
+        in_view = np.flatnonzero(~np.isnan(points).any(axis=1))
+    else:
+        lo, hi = np.asarray(extent[0], dtype=points.dtype), np.asarray(extent[1], dtype=points.dtype)
+        in_view = np.flatnonzero(((points >= lo) & (points <= hi)).all(axis=1))
+    if len(in_view) <= point_budget:
+        return in_view
+
+    size = (hi - lo).astype(float)
+    spread = size > size.max() * 1e-6
+    dims = max(int(spread.sum()), 1)
+    voxel = float(np.prod(size[spread]) / point_budget) ** (1 / dims) if spread.any() else 1.0
+    view_points = points[in_view]
+    for _ in range(MAX_VOXEL_PASSES):
+        cells = np.floor((view_points - lo) / voxel).astype(np.int64)
+        shape = cells.max(axis=0) + 1
+        keys = cells[:, 0] + shape[0] * (cells[:, 1] + shape[1] * cells[:, 2])
+        _, first = np.unique(keys, return_index=True)
+        if len(first) <= point_budget:
+            break
+        voxel *= max((len(first) / point_budget) ** (1 / dims), 1.05)
+    logger.info(f"Voxel downsampling kept {len(first)} of {len(view_points)} points at voxel size {voxel:.3f}")
+    return in_view[np.sort(first)]
+
+
+class PointCloud:
+    """Point set held as float32 offsets from a float64 origin, plus its other columns.
+
+    Offsets keep millimetre precision across tens of kilometres at half the memory of
+    float64 coordinates. The display subset is cached and only recomputed when the
+    view extent or point budget changes.
+    """
+
+    def __init__(self, name, coordinates, attributes=None, key=None):
+        coordinates = np.asarray(coordinates, dtype=float)
+        self.name = name
+        # Content key of the source file, for the stage cache
+        self.key = key
+        self.origin = np.nanmin(coordinates, axis=0) if len(coordinates) else np.zeros(3)
+        self.offsets = (coordinates - self.origin).astype(np.float32)
+        self.attributes = attributes if attributes is not None else pd.DataFrame(index=pd.RangeIndex(len(coordinates)))
+        self._display_key = None
+        self._display_rows = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + int(self.attributes.memory_usage(deep=True).sum())
+
+    @property
+    def bounds(self):
+        """((min_x, min_y, min_z), (max_x, max_y, max_z)) in world coordinates."""
+        return self.origin + np.nanmin(self.offsets, axis=0), self.origin + np.nanmax(self.offsets, axis=0)
+
+    def coordinates(self, rows=None):
+        offsets = self.offsets if rows is None else self.offsets[rows]
+        return offsets.astype(float) + self.origin
+
+    def display_rows(self, extent=None, point_budget=POINT_CLOUD_BUDGET):
+        """Rows to draw for a view extent in world coordinates, recomputed only when the view changes."""
+        key = (None if extent is None else tuple(map(tuple, np.round(np.asarray(extent, dtype=float), 3))), point_budget)
+        if key != self._display_key:
+            local_extent = None if extent is None else (np.asarray(extent[0]) - self.origin, np.asarray(extent[1]) - self.origin)
+            self._display_rows = voxel_downsample(self.offsets, point_budget, local_extent)
+            self._display_key = key
+        return self._display_rows
+
+
+def load_point_cloud(uploaded_file, name=None):
+    """Read a point file through the shared reader and guess its coordinate columns."""
+    df, encoding, file_size, file_hash = read_file_chardet(uploaded_file)
+    if df is None:
+        raise ValueError(f"Could not read {uploaded_file.name}")
+
+    mapping = guess_coordinate_columns(df.columns)
+    missing = [field for field in COORDINATE_FIELDS if field not in mapping]
+    if missing:
+        raise ValueError(f"Could not find columns for {', '.join(missing)} in {uploaded_file.name}")
+
+    coordinates = np.column_stack([pd.to_numeric(df[mapping[field]], errors='coerce').to_numpy(dtype=float) for field in COORDINATE_FIELDS])
+    located = ~np.isnan(coordinates).any(axis=1)
+    if not located.all():
+        logger.warning(f"Dropping {int((~located).sum())} points without coordinates from {uploaded_file.name}")
+    attributes = downcast_chunk(df.loc[located, [column for column in df.columns if column not in mapping.values()]].reset_index(drop=True))
+
+    point_cloud = PointCloud(name or uploaded_file.name, coordinates[located], attributes, key=file_hash)
+    logger.info(f"Loaded {len(point_cloud)} points from {uploaded_file.name} ({point_cloud.nbytes} bytes)")
+    return point_cloud
@@ -0,0 +1,301 @@
+# shared_store.py
+
+import os
+import sys
+import json
+import shutil
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+import weakref
+import functools
+import numpy as np
+import pandas as pd
+from config import SHARED_STORE_ENABLED, SHARED_STORE_DIR, SHARED_STORE_MAX_BYTES, READER_BACKEND
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+# Bump when the on-disk layout of an entry changes
+STORE_FORMAT_VERSION = 1
+
+# Modules whose code decides what a stored frame contains, from parsing to desurvey
+PIPELINE_MODULES = ['ingest.py', 'parse_cache.py', 'hole_dictionary.py', 'data_processing.py', 'desurvey.py', 'drill_traces.py', 'shared_store.py']
+
+
+@functools.lru_cache(maxsize=None)
+def store_version():
+    """Salt for every store key: format version, reader backend, library versions and pipeline source.
+
+    Entries written by an earlier deploy or with another reader backend get different
+    keys, so they are never mistaken for fresh ones; they just age out of the store.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((STORE_FORMAT_VERSION, READER_BACKEND, sys.version_info[:2], pd.__version__, np.__version__)).encode())
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in PIPELINE_MODULES:
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def store_key(key):
+    """The key an entry is stored under: the caller's content or stage key salted with store_version()."""
+    return hashlib.blake2b(f"{key}:{store_version()}".encode(), digest_size=16).hexdigest()
+
+
+def frame_key(df):
+    """Content hash of a frame: column names, dtypes, index and every value."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _write_column(directory, position, values):
+    """Save one column and return how to load it.
+
+    Plain numpy columns and categorical codes are saved as .npy files that load as
+    read-only memory maps; anything else is pickled and loaded into memory once per process.
+    """
+    path = os.path.join(directory, f"{position}")
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        np.save(path + '.npy', np.ascontiguousarray(values.cat.codes.to_numpy()))
+        with open(path + '.categories', 'wb') as f:
+            pickle.dump(values.dtype, f)
+        return 'categorical'
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biufcmM':
+        np.save(path + '.npy', np.ascontiguousarray(values.to_numpy()))
+        return 'array'
+    with open(path + '.pickle', 'wb') as f:
+        pickle.dump(values.to_numpy() if values.dtype == object else values.array, f)
+    return 'pickle'
+
+
+def _read_column(directory, position, kind):
+    path = os.path.join(directory, f"{position}")
+    if kind == 'array':
+        return np.load(path + '.npy', mmap_mode='r')
+    if kind == 'categorical':
+        with open(path + '.categories', 'rb') as f:
+            dtype = pickle.load(f)
+        return pd.Categorical.from_codes(np.load(path + '.npy', mmap_mode='r'), dtype=dtype)
+    with open(path + '.pickle', 'rb') as f:
+        values = pickle.load(f)
+    if isinstance(values, np.ndarray):
+        values.flags.writeable = False
+    return values
+
+
+def _session_view(values):
+    """The shared values as one frame may hold them without in-place writes reaching other sessions.
+
+    Memory maps and read-only arrays are shared as they are, Arrow-backed arrays through
+    a zero-copy slice; other extension arrays have writable buffers, so each frame gets a copy.
+    """
+    if isinstance(values, (np.ndarray, pd.Categorical)):
+        return values
+    if isinstance(values, pd.arrays.ArrowExtensionArray):
+        return values[:]
+    return values.copy()
+
+
+class SharedFrame:
+    """A session's reference to a stored frame; the entry cannot be evicted while any exist.
+
+    Drop the handle (or the session holding it) to release the reference.
+    """
+
+    def __init__(self, store, key):
+        self.key = key
+        self.metadata = store.entries[key]['metadata']
+        self._store = store
+        weakref.finalize(self, store.release, key)
+
+    def frame(self):
+        """A new DataFrame over the shared read-only columns.
+
+        Adding or replacing columns only changes this DataFrame; writing into the
+        shared values in place raises, as they are read-only.
+        """
+        return self._store.frame(self.key)
+
+
+class SharedFrameStore:
+    """Process-wide store of DataFrames as memory-mapped columns on local disk, keyed by content hash.
+
+    Every session asking for the same content gets a view of the same pages, so memory
+    grows with the number of distinct frames rather than the number of viewers. Entries
+    no session references are kept for reuse, and deleted least recently used first
+    once the store is over max_bytes.
+    """
+
+    def __init__(self, directory=SHARED_STORE_DIR, max_bytes=SHARED_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        # Entries written by an earlier server process are reused; their keys carry the
+        # version they were written with, so only entries of this version can ever match
+        for key in os.listdir(directory):
+            if key.endswith('.tmp'):
+                # Left by a write that was interrupted
+                shutil.rmtree(os.path.join(directory, key), ignore_errors=True)
+                logger.info(f"Shared store removed unfinished entry {key}")
+                continue
+            manifest = os.path.join(directory, key, MANIFEST_NAME)
+            if os.path.exists(manifest):
+                with open(manifest) as f:
+                    self._add_entry(key, json.load(f), os.path.getmtime(manifest))
+
+    def _add_entry(self, key, manifest, last_used):
+        self.entries[key] = {
+            'kinds': manifest['kinds'],
+            'rows': manifest['rows'],
+            'bytes': manifest['bytes'],
+            'metadata': manifest.get('metadata', {}),
+            'refs': 0,
+            'last_used': last_used,
+            'values': None,
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    @property
+    def nbytes(self):
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def share(self, df, key=None, metadata=None):
+        """Store a frame unless its content is already stored, and return a handle to it."""
+        key = store_key(key or frame_key(df))
+        with self._lock:
+            if key not in self.entries:
+                self._write(key, df, metadata or {})
+            # Evict only once the new entry is referenced, or it could be the one evicted
+            handle = self._acquire(key)
+            self.evict()
+            return handle
+
+    def open(self, key):
+        """A handle to a stored frame, or None if the key is not stored."""
+        key = store_key(key)
+        with self._lock:
+            return self._acquire(key) if key in self.entries else None
+
+    def _acquire(self, key):
+        entry = self.entries[key]
+        entry['refs'] += 1
+        entry['last_used'] = time.time()
+        return SharedFrame(self, key)
+
+    def release(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                # Unmap once the last session lets go; frames still viewing the pages keep them mapped
+                entry['refs'], entry['values'] = 0, None
+                self.evict()
+
+    def frame(self, key):
+        with self._lock:
+            entry = self.entries[key]
+            entry['last_used'] = time.time()
+            if entry['values'] is None:
+                entry['values'] = self._read(key, entry)
+            columns, index, values = entry['values']
+        df = pd.DataFrame({position: _session_view(column) for position, column in enumerate(values)}, index=index, copy=False)
+        df.columns = columns
+        return df
+
+    def _read(self, key, entry):
+        directory = os.path.join(self.directory, key)
+        with open(os.path.join(directory, 'labels.pickle'), 'rb') as f:
+            columns, index = pickle.load(f)
+        if index is None:
+            index = pd.RangeIndex(entry['rows'])
+        return columns, index, [_read_column(directory, position, kind) for position, kind in enumerate(entry['kinds'])]
+
+    def _write(self, key, df, metadata):
+        # Build the entry in a temporary directory and rename it into place
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, suffix='.tmp')
+        try:
+            kinds = [_write_column(tmp_dir, position, df.iloc[:, position]) for position in range(df.shape[1])]
+            default_index = isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+            with open(os.path.join(tmp_dir, 'labels.pickle'), 'wb') as f:
+                pickle.dump((df.columns, None if default_index else df.index), f)
+            manifest = {
+                'kinds': kinds,
+                'rows': len(df),
+                'bytes': sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir)),
+                'metadata': metadata,
+            }
+            with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_dir, os.path.join(self.directory, key))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._add_entry(key, manifest, time.time())
+        logger.info(f"Shared store added {key}: {len(df)} rows, {manifest['bytes']} bytes")
+
+    def evict(self):
+        """Delete unreferenced entries, least recently used first, until the store fits in max_bytes."""
+        with self._lock:
+            total = self.nbytes
+            idle = sorted((entry['last_used'], key) for key, entry in self.entries.items() if entry['refs'] == 0)
+            for _, key in idle:
+                if total <= self.max_bytes:
+                    break
+                total -= self.entries.pop(key)['bytes']
+                # Deleting mapped files is safe: existing mappings stay valid until they are dropped
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+                logger.info(f"Shared store evicted {key}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The process-wide store, created on first use; None when disabled."""
+    global _store
+    if not SHARED_STORE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SharedFrameStore()
+        return _store
+
+
+def share_frame(df, key=None, metadata=None):
+    """Swap a frame for a shared read-only copy; returns (frame, handle), or (df, None) when the store is unavailable."""
+    store = get_store()
+    if store is None or df is None:
+        return df, None
+    try:
+        handle = store.share(df, key=key, metadata=metadata)
+        return handle.frame(), handle
+    except Exception as e:
+        logger.warning(f"Could not share frame: {str(e)}")
+        return df, None
+
+
+def open_shared(key):
+    """A handle to the stored frame of key, or None when it is not stored or the store is unavailable."""
+    store = get_store()
+    if store is None or key is None:
+        return None
+    try:
+        return store.open(key)
+    except Exception as e:
+        logger.warning(f"Could not open shared frame {key}: {str(e)}")
+        return None
@@ -0,0 +1,192 @@
+# spatial_index.py
+
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from trace_query import TraceIndex, resample_depths
+from config import SPATIAL_INDEX_STEP
+
+logger = logging.getLogger(__name__)
+
+# Stations fetched per requested neighbour on the first k-nearest pass; grown until the answer is exact
+NEAREST_CANDIDATE_FACTOR = 16
+
+RESULT_COLUMNS = ['Query', 'Dataset', 'HoleID', 'Depth', 'Distance']
+
+
+def closest_on_segments(p, a, b):
+    """Distance from points p to segments a-b, row by row, and the fraction t along each segment."""
+    ab = b - a
+    ab_len2 = np.einsum('ij,ij->i', ab, ab)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(ab_len2 > 0, np.einsum('ij,ij->i', p - a, ab) / ab_len2, 0.0)
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    return np.linalg.norm(p - (a + t[:, None] * ab), axis=1), t
+
+
+def traces_key(df_dh_traces):
+    """Content hash of a dataset's trace stations, used to skip rebuilding unchanged datasets."""
+    row_hash = pd.util.hash_pandas_object(df_dh_traces[['HoleID', 'Depth', 'DH_X', 'DH_Y', 'DH_Z']], index=False)
+    return hashlib.blake2b(row_hash.to_numpy().tobytes(), digest_size=16).hexdigest()
+
+
+class DatasetSpatialIndex:
+    """KD-tree over one dataset's traces, resampled every step metres.
+
+    Stations are only candidates: answers are refined against the polyline segments on
+    either side of each candidate, so distances are exact along the resampled trace.
+    """
+
+    def __init__(self, df_dh_traces, step=SPATIAL_INDEX_STEP):
+        trace_index = TraceIndex(df_dh_traces)
+        hole, depth = resample_depths(trace_index.hole_depths, step)
+        x, y, z = trace_index.locate_indexed(hole, depth)
+        valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(z))
+
+        self.hole_ids = trace_index.hole_ids
+        self.hole = hole[valid]
+        self.depth = depth[valid]
+        self.xyz = np.column_stack([x, y, z])[valid]
+        self.tree = cKDTree(self.xyz)
+        # Any point within r of a segment is within r + half a segment of one of its ends
+        same_hole = self.hole[1:] == self.hole[:-1]
+        segment_length = np.linalg.norm(np.diff(self.xyz, axis=0), axis=1)[same_hole]
+        self.half_segment = float(segment_length.max()) / 2 if len(segment_length) else 0.0
+        self.has_next = np.r_[same_hole, False]
+        self.has_prev = np.r_[False, same_hole]
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def refine(self, points, query, station):
+        """Exact closest approach of each (query, station) pair's hole around that station.
+
+        Returns query, hole, depth and distance, reduced to one row per query and hole.
+        """
+        best_dist = np.full(len(query), np.inf)
+        best_depth = self.depth[station].astype(float)
+        for neighbour, has_neighbour in ((station + 1, self.has_next), (station - 1, self.has_prev)):
+            ok = has_neighbour[station]
+            dist, t = closest_on_segments(points[query[ok]], self.xyz[station[ok]], self.xyz[neighbour[ok]])
+            depth = self.depth[station[ok]] + t * (self.depth[neighbour[ok]] - self.depth[station[ok]])
+            better = dist < best_dist[ok]
+            rows = np.flatnonzero(ok)[better]
+            best_dist[rows] = dist[better]
+            best_depth[rows] = depth[better]
+        # Holes of a single station have no segment, only the station itself
+        lone = np.isinf(best_dist)
+        best_dist[lone] = np.linalg.norm(points[query[lone]] - self.xyz[station[lone]], axis=1)
+
+        hole = self.hole[station]
+        order = np.lexsort((best_dist, hole, query))
+        query, hole, best_depth, best_dist = query[order], hole[order], best_depth[order], best_dist[order]
+        first = np.r_[True, (query[1:] != query[:-1]) | (hole[1:] != hole[:-1])] if len(order) else np.empty(0, dtype=bool)
+        return query[first], hole[first], best_depth[first], best_dist[first]
+
+    def within_radius(self, points, radius):
+        """(query, hole, depth, distance) of every hole passing within radius of each point."""
+        candidates = self.tree.query_ball_point(points, radius + self.half_segment, return_sorted=False)
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=len(candidates))
+        query = np.repeat(np.arange(len(points)), counts)
+        station = np.concatenate([np.asarray(c, dtype=np.int64) for c in candidates]) if counts.sum() else np.empty(0, dtype=np.int64)
+        query, hole, depth, dist = self.refine(points, query, station)
+        within = dist <= radius
+        return query[within], hole[within], depth[within], dist[within]
+
+    def nearest(self, points, k):
+        """(query, hole, depth, distance) of the k nearest holes to each point.
+
+        Nearest stations are fetched in growing batches until no hole outside the batch
+        can be closer than the k-th hole found.
+        """
+        results = []
+        pending = np.arange(len(points)) if len(self) else np.empty(0, dtype=np.int64)
+        n_stations = k * NEAREST_CANDIDATE_FACTOR
+        while len(pending):
+            n_stations = min(n_stations, len(self))
+            station_dist, station = self.tree.query(points[pending], n_stations)
+            station_dist = station_dist.reshape(len(pending), -1)
+            station = station.reshape(len(pending), -1)
+            local_query = np.repeat(np.arange(len(pending)), station.shape[1])
+            query, hole, depth, dist = self.refine(points[pending], local_query, station.ravel())
+
+            # Keep the k closest holes of every query
+            order = np.lexsort((dist, query))
+            query, hole, depth, dist = query[order], hole[order], depth[order], dist[order]
+            rank = np.arange(len(query)) - np.searchsorted(query, query)
+            top = rank < k
+            query, hole, depth, dist = query[top], hole[top], depth[top], dist[top]
+
+            found = np.bincount(query, minlength=len(pending))
+            kth = np.full(len(pending), np.inf)
+            full = found >= k
+            # Rows are sorted by distance within a query, so a full query's k-th hole is its last row
+            kth[full] = dist[np.searchsorted(query, np.flatnonzero(full), side='right') - 1]
+            complete = (n_stations >= len(self)) | (kth <= station_dist[:, -1] - self.half_segment)
+
+            done = complete[query]
+            results.append((pending[query[done]], hole[done], depth[done], dist[done]))
+            pending = pending[~complete]
+            n_stations *= 4
+
+        return tuple(np.concatenate(parts) for parts in zip(*results)) if results else (np.empty(0, dtype=np.int64),) * 4
+
+
+class TraceSpatialIndex:
+    """Spatial index over every dataset of a trace frame, for batched radius and nearest-hole queries.
+
+    Each dataset has its own KD-tree; update() only rebuilds datasets whose traces changed.
+    """
+
+    def __init__(self, step=SPATIAL_INDEX_STEP):
+        self.step = step
+        self.datasets = {}
+
+    def update(self, df_dh_traces):
+        """Bring the index in line with a trace frame; returns the names of the rebuilt datasets."""
+        groups = df_dh_traces.groupby('Dataset', sort=False, observed=True) if 'Dataset' in df_dh_traces.columns else [(None, df_dh_traces)]
+        rebuilt = []
+        current = {}
+        for name, dataset_traces in groups:
+            key = traces_key(dataset_traces)
+            previous = self.datasets.get(name)
+            if previous is not None and previous[0] == key:
+                current[name] = previous
+            else:
+                current[name] = (key, DatasetSpatialIndex(dataset_traces, self.step))
+                rebuilt.append(name)
+        self.datasets = current
+        logger.info(f"Spatial index rebuilt {len(rebuilt)} of {len(current)} datasets")
+        return rebuilt
+
+    def _collect(self, parts):
+        frames = [
+            pd.DataFrame({
+                'Query': query,
+                'Dataset': name,
+                'HoleID': index.hole_ids[hole],
+                'Depth': depth,
+                'Distance': dist,
+            })
+            for name, index, (query, hole, depth, dist) in parts
+        ]
+        if not frames:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        return pd.concat(frames, ignore_index=True).sort_values(['Query', 'Distance'], kind='stable').reset_index(drop=True)
+
+    def within_radius(self, points, radius):
+        """Every hole passing within radius of each point, with the depth and distance of closest approach.
+
+        Query is the row of points each result belongs to.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        return self._collect([(name, index, index.within_radius(points, radius)) for name, (_, index) in self.datasets.items()])
+
+    def nearest_holes(self, points, k=1):
+        """The k nearest holes to each point across all datasets, ranked from 1."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        df_nearest = self._collect([(name, index, index.nearest(points, k)) for name, (_, index) in self.datasets.items()])
+        df_nearest['Rank'] = df_nearest.groupby('Query').cumcount() + 1
+        return df_nearest[df_nearest['Rank'] <= k].reset_index(drop=True)
@@ -0,0 +1,137 @@
+# stage_cache.py
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from config import STAGE_CACHE_ENABLED, STAGE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def stage_key(*parts):
+    """Key of a stage output from its upstream keys and parameters.
+
+    Parts are reduced to their repr, so they must be plain values (strings, numbers,
+    tuples, sorted items of dicts) whose repr is stable between runs.
+    """
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def advance_key(key, *parts):
+    """Key after applying a stage with these parameters to content with key; None stays None."""
+    return None if key is None else stage_key(key, *parts)
+
+
+def dictionary_key(dictionary):
+    """Key of a HoleID dictionary's current categories, or None without one."""
+    if dictionary is None:
+        return None
+    row_hash = pd.util.hash_pandas_object(pd.Series(dictionary.categories, dtype=object), index=False)
+    return hashlib.blake2b(row_hash.to_numpy().tobytes(), digest_size=16).hexdigest()
+
+
+def estimate_bytes(value):
+    """Rough in-memory size of a cached value, used for the memory cap."""
+    # Deep sizing counts the strings behind object and text columns, not just their pointers
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_bytes(item) for item in value.values())
+    if hasattr(value, 'data') and hasattr(value, 'layout'):
+        # Plotly figures: the trace arrays dominate
+        return sum(estimate_bytes(np.asarray(trace[name])) for trace in value.data for name in ('x', 'y', 'z', 'customdata') if trace[name] is not None)
+    return 64
+
+
+def _shallow(value):
+    # Sessions get their own DataFrame shells, so adding a column in one never reaches another
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(_shallow(item) for item in value)
+    return value
+
+
+class StageCache:
+    """Process-wide LRU cache of pipeline stage outputs, capped at max_bytes.
+
+    Outputs are keyed by stage name and a key built from the stage's upstream keys and
+    parameters, so a rerun that changed nothing upstream finds every stage cached and
+    only invalidated stages recompute.
+    """
+
+    def __init__(self, max_bytes=STAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, stage, key):
+        """The cached output, or None on a miss."""
+        with self._lock:
+            entry = self.entries.get((stage, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((stage, key))
+            self.hits += 1
+            return _shallow(entry[0])
+
+    def put(self, stage, key, value):
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            logger.info(f"Not caching {stage}: {size} bytes is over the {self.max_bytes} byte cap")
+            return
+        with self._lock:
+            previous = self.entries.pop((stage, key), None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self.entries[(stage, key)] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                (evicted_stage, _), (_, evicted_size) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_size
+                logger.info(f"Stage cache evicted a {evicted_stage} output ({evicted_size} bytes)")
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+_cache = StageCache()
+
+
+def cached_stage(stage, key, compute, *args, **kwargs):
+    """compute(*args, **kwargs), or its cached output for this stage and key.
+
+    A key of None, or the cache being disabled, always computes.
+    """
+    if not STAGE_CACHE_ENABLED or key is None:
+        return compute(*args, **kwargs)
+    value = _cache.get(stage, key)
+    if value is not None:
+        logger.debug(f"Stage cache hit for {stage}")
+        return value
+    value = compute(*args, **kwargs)
+    if value is not None:
+        _cache.put(stage, key, value)
+    return _shallow(value)
+
+
+def stage_cache():
+    return _cache
@@ -0,0 +1,226 @@
+# surfaces.py
+
+import os
+import re
+import logging
+import numpy as np
+import pandas as pd
+from anticollision import TraceSegments
+from config import SURFACE_TRACE_STEP, SURFACE_BATCH_SEGMENTS, SURFACE_CELL_FACTOR
+
+logger = logging.getLogger(__name__)
+
+PIERCE_COLUMNS = ['Dataset', 'HoleID', 'Surface', 'Depth', 'DH_X', 'DH_Y', 'DH_Z', 'Triangle']
+
+EPSILON = 1e-12
+
+STL_DTYPE = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+
+class Surface:
+    """Triangle mesh: float vertex coordinates and integer vertex indices of every triangle."""
+
+    def __init__(self, name, vertices, triangles):
+        self.name = name
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        if len(self.triangles) and (self.triangles.min() < 0 or self.triangles.max() >= len(self.vertices)):
+            raise ValueError(f"Surface {name} has triangles referring to missing vertices")
+        self._grid = None
+
+    def __len__(self):
+        return len(self.triangles)
+
+    @property
+    def grid(self):
+        """Uniform grid over the triangles, built on first use."""
+        if self._grid is None:
+            self._grid = TriangleGrid(self.vertices[self.triangles])
+        return self._grid
+
+
+def read_obj(data):
+    """Vertices and triangles of a Wavefront OBJ file; polygons are split into triangle fans."""
+    text = data.decode('utf-8', errors='replace')
+    vertex_lines = re.findall(r'^v\s+(\S+)\s+(\S+)\s+(\S+)', text, flags=re.MULTILINE)
+    vertices = np.array(vertex_lines, dtype=float).reshape(-1, 3)
+
+    # Only the vertex index of each v/vt/vn corner is needed
+    face_lines = re.findall(r'^f\s+(.+)$', text, flags=re.MULTILINE)
+    faces = [[int(corner.split('/')[0]) for corner in line.split()] for line in face_lines]
+    sizes = np.fromiter((len(face) for face in faces), dtype=np.int64, count=len(faces))
+    if len(faces) and (sizes == 3).all():
+        corners = np.array(faces, dtype=np.int64)
+    else:
+        corners = np.array([[face[0], face[k], face[k + 1]] for face in faces for k in range(1, len(face) - 1)], dtype=np.int64).reshape(-1, 3)
+    # OBJ indices are 1-based, negative ones count back from the end
+    triangles = np.where(corners < 0, len(vertices) + corners, corners - 1)
+    return vertices, triangles
+
+
+def read_stl(data):
+    """Vertices and triangles of a binary or ASCII STL file, with shared corners merged."""
+    n_binary = int.from_bytes(data[80:84], 'little') if len(data) >= 84 else -1
+    if len(data) == 84 + n_binary * STL_DTYPE.itemsize:
+        corners = np.frombuffer(data, dtype=STL_DTYPE, count=n_binary, offset=84)['vertices'].astype(float).reshape(-1, 3)
+    else:
+        text = data.decode('utf-8', errors='replace')
+        corners = np.array(re.findall(r'vertex\s+(\S+)\s+(\S+)\s+(\S+)', text), dtype=float).reshape(-1, 3)
+    vertices, inverse = np.unique(corners, axis=0, return_inverse=True)
+    return vertices, inverse.reshape(-1, 3)
+
+
+SURFACE_READERS = {'obj': read_obj, 'stl': read_stl}
+
+
+def read_surface(file, name=None):
+    """Load an uploaded or local OBJ/STL file as a Surface."""
+    file_name = getattr(file, 'name', file)
+    extension = os.path.splitext(str(file_name))[1].lower().lstrip('.')
+    if extension not in SURFACE_READERS:
+        raise ValueError(f"Unsupported surface format '{extension}'")
+    if hasattr(file, 'getvalue'):
+        data = file.getvalue()
+    else:
+        with open(file, 'rb') as f:
+            data = f.read()
+    vertices, triangles = SURFACE_READERS[extension](data)
+    surface = Surface(name or os.path.splitext(os.path.basename(str(file_name)))[0], vertices, triangles)
+    logger.info(f"Loaded surface {surface.name}: {len(surface.vertices)} vertices, {len(surface)} triangles")
+    return surface
+
+
+def expand_boxes(lo, hi):
+    """Every integer cell of every box lo..hi (inclusive); returns the box and cell of each."""
+    extent = hi - lo + 1
+    counts = extent.prod(axis=1)
+    box = np.repeat(np.arange(len(lo)), counts)
+    local = np.arange(len(box)) - np.repeat(np.cumsum(counts) - counts, counts)
+    nx, ny = extent[box, 0], extent[box, 1]
+    cell = lo[box] + np.column_stack([local % nx, (local // nx) % ny, local // (nx * ny)])
+    return box, cell
+
+
+class TriangleGrid:
+    """Uniform grid acceleration structure over triangles, stored sparsely.
+
+    Only occupied cells are kept, as a sorted cell id array with the triangles of each
+    cell in CSR form, so memory follows the triangle count rather than the grid size.
+    """
+
+    def __init__(self, corners, cell_factor=SURFACE_CELL_FACTOR):
+        self.corners = corners
+        tri_min, tri_max = corners.min(axis=1), corners.max(axis=1)
+        self.origin = tri_min.min(axis=0) if len(corners) else np.zeros(3)
+        top = tri_max.max(axis=0) if len(corners) else np.ones(3)
+        # Cells a few median triangles wide keep both the cells per triangle and triangles per cell small
+        extent = (tri_max - tri_min).max(axis=1) if len(corners) else np.ones(1)
+        self.cell_size = max(float(np.median(extent)) * cell_factor, float((top - self.origin).max()) / 2 ** 20, EPSILON)
+        self.shape = np.floor((top - self.origin) / self.cell_size).astype(np.int64) + 1
+
+        box, cell = expand_boxes(self.cell_of(tri_min), self.cell_of(tri_max))
+        cell_ids = self.cell_id(cell)
+        order = np.argsort(cell_ids, kind='stable')
+        cell_ids, self.cell_triangles = cell_ids[order], box[order]
+        self.cells, self.cell_starts = np.unique(cell_ids, return_index=True)
+        self.cell_ends = np.r_[self.cell_starts[1:], len(cell_ids)]
+
+    def cell_of(self, points):
+        return np.clip(np.floor((points - self.origin) / self.cell_size).astype(np.int64), 0, self.shape - 1)
+
+    def cell_id(self, cell):
+        return cell[:, 0] + self.shape[0] * (cell[:, 1] + self.shape[1] * cell[:, 2])
+
+    def candidates(self, seg_min, seg_max):
+        """Unique (segment, triangle) pairs whose grid cells overlap."""
+        # Segments entirely outside the grid cannot reach a triangle
+        inside = ((seg_max >= self.origin) & (seg_min <= self.origin + self.shape * self.cell_size)).all(axis=1)
+        segment = np.flatnonzero(inside)
+        box, cell = expand_boxes(self.cell_of(seg_min[segment]), self.cell_of(seg_max[segment]))
+        cell_ids = self.cell_id(cell)
+        position = np.clip(np.searchsorted(self.cells, cell_ids), 0, max(len(self.cells) - 1, 0))
+        occupied = self.cells[position] == cell_ids if len(self.cells) else np.zeros(len(cell_ids), dtype=bool)
+        box, position = box[occupied], position[occupied]
+
+        counts = self.cell_ends[position] - self.cell_starts[position]
+        pair_segment = np.repeat(segment[box], counts)
+        entry = np.repeat(self.cell_starts[position], counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        pair_triangle = self.cell_triangles[entry]
+        # A pair sharing several cells is only tested once
+        keys = np.unique(pair_segment * len(self.corners) + pair_triangle)
+        return keys // len(self.corners), keys % len(self.corners)
+
+
+def segment_triangle_hits(p, q, corners):
+    """Moller-Trumbore test of segments p-q against triangles, row by row; returns hit mask and t."""
+    v0, v1, v2 = corners[:, 0], corners[:, 1], corners[:, 2]
+    e1, e2 = v1 - v0, v2 - v0
+    d = q - p
+    h = np.cross(d, e2)
+    a = np.einsum('ij,ij->i', e1, h)
+    parallel = np.abs(a) < EPSILON
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = 1.0 / a
+        s = p - v0
+        u = f * np.einsum('ij,ij->i', s, h)
+        qv = np.cross(s, e1)
+        v = f * np.einsum('ij,ij->i', d, qv)
+        t = f * np.einsum('ij,ij->i', e2, qv)
+    hit = ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= 1)
+    return hit, t
+
+
+def intersect_surface(df_dh_traces, surface, step=SURFACE_TRACE_STEP, batch_segments=SURFACE_BATCH_SEGMENTS):
+    """Every pierce of every hole through a surface, with its depth and XYZ."""
+    return pierce_points(TraceSegments(df_dh_traces, step), surface, batch_segments)
+
+
+def intersect_surfaces(df_dh_traces, surfaces, step=SURFACE_TRACE_STEP, batch_segments=SURFACE_BATCH_SEGMENTS):
+    """Pierce points of the traces through several surfaces, in one frame."""
+    segments = TraceSegments(df_dh_traces, step)
+    frames = [pierce_points(segments, surface, batch_segments) for surface in surfaces]
+    if not frames:
+        return pd.DataFrame(columns=PIERCE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def pierce_points(segments, surface, batch_segments=SURFACE_BATCH_SEGMENTS):
+    """Pierce points of trace segments through a surface.
+
+    Segments are matched to triangles through the surface's uniform grid, in batches,
+    and only those pairs get the exact segment-triangle test. A pierce on a shared
+    edge or at a segment end is reported once.
+    """
+    if len(segments) == 0 or len(surface) == 0:
+        return pd.DataFrame(columns=PIERCE_COLUMNS)
+    grid = surface.grid
+    corners = grid.corners
+
+    hits = []
+    for lo in range(0, len(segments), batch_segments):
+        start, end = segments.start[lo:lo + batch_segments], segments.end[lo:lo + batch_segments]
+        segment, triangle = grid.candidates(np.minimum(start, end), np.maximum(start, end))
+        hit, t = segment_triangle_hits(start[segment], end[segment], corners[triangle])
+        hits.append((segment[hit] + lo, triangle[hit], t[hit]))
+    segment, triangle, t = (np.concatenate(parts) for parts in zip(*hits))
+
+    depth = segments.depth_from[segment] + t * (segments.depth_to[segment] - segments.depth_from[segment])
+    xyz = segments.start[segment] + t[:, None] * (segments.end[segment] - segments.start[segment])
+    hole = segments.hole[segment]
+    order = np.lexsort((depth, hole))
+    hole, depth, xyz, triangle = hole[order], depth[order], xyz[order], triangle[order]
+    distinct = np.r_[True, (hole[1:] != hole[:-1]) | (np.diff(depth) > 1e-6)] if len(hole) else np.empty(0, dtype=bool)
+    hole, depth, xyz, triangle = hole[distinct], depth[distinct], xyz[distinct], triangle[distinct]
+
+    logger.info(f"{len(hole)} pierce points through surface {surface.name}")
+    return pd.DataFrame({
+        'Dataset': segments.holes['Dataset'].to_numpy()[hole],
+        'HoleID': segments.holes['HoleID'].to_numpy()[hole],
+        'Surface': surface.name,
+        'Depth': depth,
+        'DH_X': xyz[:, 0],
+        'DH_Y': xyz[:, 1],
+        'DH_Z': xyz[:, 2],
+        'Triangle': triangle,
+    }, columns=PIERCE_COLUMNS)
+
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import pytest
+from desurvey import desurvey_datasets
+
+
+def synthetic_dataset(holes, seed):
+    rng = np.random.default_rng(seed)
+    hole_ids = [f"S{seed}H{i:02d}" for i in range(holes)]
+    df_collar = pd.DataFrame({
+        'HoleID': hole_ids,
+        'DH_X': rng.uniform(0, 200, holes),
+        'DH_Y': rng.uniform(0, 200, holes),
+        'DH_Z': rng.uniform(90, 110, holes),
+    })
+    depth = np.tile([0.0, 40.0, 80.0, 120.0, 150.0], holes)
+    df_survey = pd.DataFrame({
+        'HoleID': np.repeat(hole_ids, 5),
+        'Depth': depth,
+        'Azimuth': np.repeat(rng.uniform(0, 360, holes), 5) + rng.uniform(-5, 5, len(depth)),
+        'Dip': np.repeat(rng.uniform(-85, -50, holes), 5) + rng.uniform(-3, 3, len(depth)),
+    })
+    return df_collar, df_survey
+
+
+@pytest.fixture
+def traces():
+    """Desurveyed traces of two small datasets of randomly placed, gently curving holes."""
+    datasets = [(f"Dataset_{seed}", *synthetic_dataset(12, seed)) for seed in (1, 2)]
+    return desurvey_datasets(datasets, workers=1)
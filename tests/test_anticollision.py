@@ -0,0 +1,58 @@
+import numpy as np
+from anticollision import TraceSegments, proximity_scan, segment_distances
+
+STEP = 5.0
+THRESHOLD = 15.0
+
+
+def brute_force_pairs(segments):
+    """Distance between every pair of segments of different holes."""
+    i, j = np.triu_indices(len(segments), k=1)
+    other = segments.hole[i] != segments.hole[j]
+    i, j = i[other], j[other]
+    dist, _, _ = segment_distances(segments.start[i], segments.end[i], segments.start[j], segments.end[j])
+    return i, j, dist
+
+
+def test_segment_distance_matches_dense_sampling():
+    rng = np.random.default_rng(0)
+    p1, q1, p2, q2 = (rng.uniform(0, 10, (60, 3)) for _ in range(4))
+    # Parallel and touching pairs as well as random ones
+    q2[:10] = p2[:10] + (q1[:10] - p1[:10])
+    p2[10:20] = q1[10:20]
+
+    dist, _, _ = segment_distances(p1, q1, p2, q2)
+
+    s = np.linspace(0, 1, 201)
+    a = p1[:, None, :] + s[None, :, None] * (q1 - p1)[:, None, :]
+    b = p2[:, None, :] + s[None, :, None] * (q2 - p2)[:, None, :]
+    sampled = np.linalg.norm(a[:, :, None, :] - b[:, None, :, :], axis=3).min(axis=(1, 2))
+    assert (dist <= sampled + 1e-9).all()
+    np.testing.assert_allclose(dist, sampled, atol=0.1)
+
+
+def test_closest_neighbours_match_brute_force(traces):
+    segments = TraceSegments(traces, STEP)
+    i, j, dist = brute_force_pairs(segments)
+    expected = np.full(len(segments.holes), np.inf)
+    np.minimum.at(expected, segments.hole[i], dist)
+    np.minimum.at(expected, segments.hole[j], dist)
+
+    closest, _ = proximity_scan(traces, threshold=THRESHOLD, step=STEP, batch_size=64)
+
+    np.testing.assert_allclose(closest['Distance'].to_numpy(), expected, atol=1e-9)
+
+
+def test_close_approaches_match_brute_force(traces):
+    segments = TraceSegments(traces, STEP)
+    i, j, dist = brute_force_pairs(segments)
+    close = dist < THRESHOLD
+    holes = segments.holes['HoleID'].to_numpy()
+    expected = {(holes[a], holes[b]) for a, b in zip(segments.hole[i[close]], segments.hole[j[close]])}
+    expected |= {(b, a) for a, b in expected}
+
+    _, df_close = proximity_scan(traces, threshold=THRESHOLD, step=STEP, batch_size=64)
+
+    assert expected
+    assert set(zip(df_close['HoleID'], df_close['Neighbour HoleID'])) == expected
+    assert (df_close['Min Distance'] < THRESHOLD).all()
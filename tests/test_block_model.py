@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anticollision import TraceSegments
+from block_model import BlockGrid, block_intercepts
+
+STEP = 5.0
+SAMPLES = 400
+
+
+def brute_force_lengths(segments, grid):
+    """Length of every hole in every block, by cutting each segment into many short pieces."""
+    u = (np.arange(SAMPLES) + 0.5) / SAMPLES
+    points = segments.start[:, None, :] + u[None, :, None] * (segments.end - segments.start)[:, None, :]
+    cell = np.floor(grid.to_grid(points.reshape(-1, 3))).astype(np.int64)
+    inside = ((cell >= 0) & (cell < grid.counts)).all(axis=1)
+    hole = np.repeat(segments.hole, SAMPLES)[inside]
+    block = grid.block_index(cell[inside, 0], cell[inside, 1], cell[inside, 2])
+    length = np.repeat(segments.half_length * 2 / SAMPLES, SAMPLES)[inside]
+    df = pd.DataFrame({'HoleID': segments.holes['HoleID'].to_numpy()[hole], 'Block': block, 'Length': length})
+    return df.groupby(['HoleID', 'Block'])['Length'].sum()
+
+
+@pytest.mark.parametrize('rotation', [0.0, 30.0])
+def test_block_lengths_match_dense_sampling(traces, rotation):
+    grid = BlockGrid(origin=[0, 0, -60], block_size=[25, 20, 15], counts=[8, 10, 10], rotation=rotation)
+    segments = TraceSegments(traces, STEP)
+
+    result = block_intercepts(traces, grid, step=STEP, batch_segments=40)
+
+    lengths = result.groupby(['HoleID', 'Block'])['Length'].sum()
+    expected = brute_force_lengths(segments, grid)
+    # Blocks clipped by less than one sample may be missing from the sampled answer
+    lengths = lengths[lengths > 2 * STEP / SAMPLES]
+    assert len(lengths) > len(segments.holes)
+    expected = expected.reindex(lengths.index, fill_value=0.0)
+    np.testing.assert_allclose(lengths.to_numpy(), expected.to_numpy(), atol=2 * STEP / SAMPLES)
+
+
+def test_intercepts_cover_holes_inside_the_grid(traces):
+    grid = BlockGrid(origin=[-100, -100, -200], block_size=[10, 10, 10], counts=[50, 50, 40])
+
+    result = block_intercepts(traces, grid, step=STEP)
+
+    # Every hole lies wholly inside the grid, so its intercepts run from collar to end of hole
+    by_hole = result.groupby('HoleID')
+    np.testing.assert_allclose(by_hole['Length'].sum().to_numpy(), 150.0, rtol=1e-3)
+    np.testing.assert_allclose(by_hole['From'].min().to_numpy(), 0.0, atol=1e-9)
+    np.testing.assert_allclose(by_hole['To'].max().to_numpy(), 150.0, atol=1e-9)
+    assert (result['From'] < result['To']).all()
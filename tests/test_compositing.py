@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+from compositing import composite_intervals
+
+
+def intervals():
+    return pd.DataFrame({
+        'HoleID': ['H1', 'H1', 'H1', 'H2'],
+        'From': [0.0, 1.0, 2.0, 0.0],
+        'To': [1.0, 2.0, 4.0, 2.0],
+        'Au': [1.0, 3.0, 2.0, 5.0],
+    })
+
+
+def test_composites_are_length_weighted_per_hole():
+    result = composite_intervals(intervals(), length=2)
+
+    assert result['HoleID'].tolist() == ['H1', 'H1', 'H2']
+    assert result['From'].tolist() == [0.0, 2.0, 0.0]
+    assert result['To'].tolist() == [2.0, 4.0, 2.0]
+    assert np.allclose(result['Au'], [2.0, 2.0, 5.0])
+
+
+def test_gaps_are_left_out_of_the_weights():
+    df = pd.DataFrame({'HoleID': ['H1', 'H1'], 'From': [0.0, 3.0], 'To': [1.0, 4.0], 'Au': [2.0, 4.0]})
+
+    result = composite_intervals(df, length=None)
+
+    assert len(result) == 1
+    assert result['Au'].iloc[0] == pytest.approx(3.0)
+
+
+def test_missing_required_column_raises():
+    with pytest.raises(ValueError):
+        composite_intervals(intervals().drop(columns='To'))
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datatype_guesser import guess_column_type, profile_column, match_mandatory_field
+
+
+def test_month_names_are_categories_not_dates():
+    months = pd.Series(['March', 'May', 'June'] * 20)
+
+    assert profile_column(months)['datetime_ratio'] == 0.0
+    assert guess_column_type('Collar', 'Month', months) == 'Category'
+
+
+def test_date_strings_are_dates():
+    dates = pd.Series(['2021-03-01', '2022-05-04', '1 March 2020'] * 20)
+
+    assert guess_column_type('Collar', 'Drilled', dates) == 'Datetime'
+
+
+def test_sampled_profile_guesses_like_the_full_column():
+    values = pd.Series(np.arange(100000, dtype=float))
+
+    assert profile_column(values)['sample_size'] < len(values)
+    assert guess_column_type('Collar', 'Au_ppm', values) == 'Numeric'
+
+
+@pytest.mark.parametrize('file_type, header, field', [
+    ('Collar', 'Depth_From', 'Depth'),
+    ('Interval', 'Depth_From', 'From'),
+    ('Interval', 'depth_to', 'To'),
+    ('Collar', 'Hole_ID', 'HoleID'),
+    ('Collar', 'BHID', 'HoleID'),
+    ('Collar', 'Easting', 'DH_X'),
+    ('Survey', 'Dip (deg)', 'Dip'),
+    ('Collar', 'Max Depth', 'Depth'),
+    ('Collar', 'max_au', None),
+])
+def test_header_matcher(file_type, header, field):
+    assert match_mandatory_field(file_type, header) == field
@@ -0,0 +1,101 @@
+import math
+import numpy as np
+import pandas as pd
+import desurvey
+from desurvey import desurvey_traces, desurvey_traces_parallel, desurvey_datasets_incremental, merge_collar_survey, TRACE_OUTPUT_COLUMNS
+
+
+def reference_step(depth_1, dip_1, azi_1, depth_2, dip_2, azi_2):
+    """The original per-station minimum curvature step."""
+    MD = depth_2 - depth_1
+    if abs(dip_1) == 90:
+        return 0.0, 0.0, MD
+    dip_1, dip_2 = math.radians(90 + dip_1), math.radians(90 + dip_2)
+    azi_1, azi_2 = math.radians(azi_1), math.radians(azi_2)
+    B = math.acos(math.cos(dip_2 - dip_1) - math.sin(dip_1) * math.sin(dip_2) * (1 - math.cos(azi_2 - azi_1)))
+    RF = (2 / B) * math.tan(B / 2) if B != 0 else 1
+    half = MD / 2
+    dN = half * (math.sin(dip_1) * math.cos(azi_1) + math.sin(dip_2) * math.cos(azi_2)) * RF
+    dE = half * (math.sin(dip_1) * math.sin(azi_1) + math.sin(dip_2) * math.sin(azi_2)) * RF
+    dV = half * (math.cos(dip_1) + math.cos(dip_2)) * RF
+    return dN, dE, dV
+
+
+def reference_desurvey(df_traces):
+    """The original row-by-row desurvey loop, on a merged and sorted frame."""
+    df_traces = df_traces.copy()
+    for col in ['DH_dX', 'DH_dY', 'DH_dZ']:
+        df_traces[col] = 0.0
+    for _, group in df_traces.groupby('HoleID', observed=True):
+        x, y, z = group.iloc[0][['DH_X', 'DH_Y', 'DH_Z']]
+        depth_prev, dip_prev, azi_prev = 0, group.iloc[0]['Dip'], group.iloc[0]['Azimuth']
+        for idx, row in group.iterrows():
+            if row['Depth'] > 0:
+                dN, dE, dV = reference_step(depth_prev, dip_prev, azi_prev, row['Depth'], row['Dip'], row['Azimuth'])
+                x, y, z = x + dE, y + dN, z - dV
+                df_traces.loc[idx, ['DH_X', 'DH_Y', 'DH_Z', 'DH_dX', 'DH_dY', 'DH_dZ']] = [x, y, z, dE, dN, dV]
+            depth_prev, dip_prev, azi_prev = row['Depth'], row['Dip'], row['Azimuth']
+    return df_traces
+
+
+def random_holes(holes=40, stations=12, seed=0):
+    rng = np.random.default_rng(seed)
+    hole_ids = [f"DH{i:03d}" for i in range(holes)]
+    df_collar = pd.DataFrame({
+        'HoleID': hole_ids,
+        'DH_X': rng.uniform(0, 1000, holes),
+        'DH_Y': rng.uniform(0, 1000, holes),
+        'DH_Z': rng.uniform(100, 200, holes),
+    })
+    depth = np.sort(rng.uniform(0, 300, (holes, stations)), axis=1)
+    depth[::3, 0] = 0.0  # Some holes are surveyed at the collar, others start below it
+    dip = rng.uniform(-89, -45, (holes, stations))
+    dip[::5] = -90.0  # Vertical holes take the straight-down branch
+    df_survey = pd.DataFrame({
+        'HoleID': np.repeat(hole_ids, stations),
+        'Depth': depth.ravel(),
+        'Azimuth': rng.uniform(0, 360, holes * stations),
+        'Dip': dip.ravel(),
+    })
+    return df_collar, df_survey
+
+
+def test_vectorized_desurvey_matches_the_original_loop():
+    df_traces = merge_collar_survey(*random_holes())
+
+    expected = reference_desurvey(df_traces)
+    result = desurvey_traces(df_traces.copy())
+
+    np.testing.assert_allclose(result[TRACE_OUTPUT_COLUMNS].to_numpy(), expected[TRACE_OUTPUT_COLUMNS].to_numpy(), atol=1e-6)
+
+
+def test_parallel_desurvey_matches_serial_across_shards():
+    frames = [merge_collar_survey(*random_holes(seed=seed)) for seed in (1, 2)]
+    expected = [desurvey_traces(df.copy()) for df in frames]
+
+    # Small shards split each dataset over several workers
+    result = desurvey_traces_parallel([df.copy() for df in frames], workers=2, shard_rows=50)
+
+    for df_result, df_expected in zip(result, expected):
+        pd.testing.assert_frame_equal(df_result, df_expected)
+
+
+def test_incremental_desurvey_matches_full_and_redoes_only_changed_holes(monkeypatch):
+    df_collar, df_survey = random_holes()
+    previous, fingerprints = desurvey_datasets_incremental([('Dataset_1', df_collar, df_survey)], workers=1)
+
+    # Change one station of one hole and add a new hole
+    df_survey = df_survey.copy()
+    df_survey.loc[df_survey['HoleID'] == 'DH007', 'Dip'] -= 1.0
+    df_collar = pd.concat([df_collar, pd.DataFrame({'HoleID': ['NEW'], 'DH_X': [0.0], 'DH_Y': [0.0], 'DH_Z': [0.0]})], ignore_index=True)
+    df_survey = pd.concat([df_survey, pd.DataFrame({'HoleID': ['NEW', 'NEW'], 'Depth': [0.0, 50.0], 'Azimuth': [0.0, 0.0], 'Dip': [-60.0, -60.0]})], ignore_index=True)
+
+    desurveyed_holes = []
+    original = desurvey.desurvey
+    monkeypatch.setattr(desurvey, 'desurvey', lambda starts, *columns: desurveyed_holes.append(len(starts)) or original(starts, *columns))
+    result, _ = desurvey_datasets_incremental([('Dataset_1', df_collar, df_survey)], previous, fingerprints, workers=1)
+
+    assert desurveyed_holes == [2]
+    expected = desurvey_traces(merge_collar_survey(df_collar, df_survey))
+    np.testing.assert_allclose(result[TRACE_OUTPUT_COLUMNS].to_numpy(), expected[TRACE_OUTPUT_COLUMNS].to_numpy())
+    assert (result['Dataset'] == 'Dataset_1').all()
@@ -0,0 +1,45 @@
+import pandas as pd
+from conftest import synthetic_dataset
+from desurvey import desurvey_datasets
+from desurvey_cli import find_datasets, main
+
+
+def write_pair(directory, name, seed, collar_columns=None):
+    df_collar, df_survey = synthetic_dataset(4, seed)
+    df_collar.rename(columns=collar_columns or {}).to_csv(directory / f"{name}_collar.csv", index=False)
+    df_survey.to_csv(directory / f"{name}_survey.csv", index=False)
+    return df_collar, df_survey
+
+
+def test_files_are_paired_by_name(tmp_path):
+    write_pair(tmp_path, 'north', 1)
+    write_pair(tmp_path, 'south', 2)
+    (tmp_path / 'east_collar.csv').write_text("HoleID\n")
+    (tmp_path / 'notes.txt').write_text("")
+
+    datasets = find_datasets(str(tmp_path))
+
+    assert [name for name, _, _ in datasets] == ['north', 'south']
+    assert datasets[0][1].endswith('north_collar.csv')
+    assert datasets[0][2].endswith('north_survey.csv')
+
+
+def test_cli_writes_the_same_traces_as_the_api(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    input_dir.mkdir()
+    df_collar, df_survey = write_pair(input_dir, 'north', 1, collar_columns={'DH_X': 'Easting', 'DH_Y': 'Northing', 'DH_Z': 'RL'})
+
+    assert main([str(input_dir), str(output_dir), '--workers', '1', '--guess-columns']) == 0
+
+    written = pd.read_csv(output_dir / 'north_traces.csv')
+    expected = desurvey_datasets([('north', df_collar, df_survey)], workers=1)
+    assert len(written) == len(expected)
+    pd.testing.assert_series_equal(written['HoleID'], expected['HoleID'].astype(str).reset_index(drop=True), check_names=False)
+    for column in ['Depth', 'DH_X', 'DH_Y', 'DH_Z']:
+        pd.testing.assert_series_equal(written[column], expected[column].reset_index(drop=True).astype(float), check_names=False, atol=1e-6)
+
+
+def test_cli_fails_when_required_columns_are_missing(tmp_path):
+    write_pair(tmp_path, 'north', 1, collar_columns={'DH_X': 'Easting'})
+
+    assert main([str(tmp_path), str(tmp_path / 'out'), '--workers', '1']) == 1
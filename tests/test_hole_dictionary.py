@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from hole_dictionary import HoleDictionary, align_hole_ids, encode_hole_ids
+
+
+def test_codes_never_change_as_holes_are_added():
+    dictionary = HoleDictionary(['A', 'B'])
+    collar = dictionary.encode(pd.Series(['B', 'A']))
+
+    dictionary.add(['C', 'A'])
+
+    assert list(dictionary.categories) == ['A', 'B', 'C']
+    assert collar.cat.codes.tolist() == [1, 0]
+    assert dictionary.codes(pd.Series(['C', 'X', 'B'])).tolist() == [2, -1, 1]
+
+
+def test_align_extends_the_shorter_prefix_and_keeps_codes():
+    dictionary = HoleDictionary()
+    collar = dictionary.encode(pd.Series(['A', 'B']))
+    survey = dictionary.encode(pd.Series(['B', 'C', 'A']))
+
+    left, right = align_hole_ids(collar, survey)
+
+    assert left.cat.categories.equals(right.cat.categories)
+    assert left.cat.codes.tolist() == collar.cat.codes.tolist()
+    assert right.cat.codes.tolist() == survey.cat.codes.tolist()
+    assert left.astype(str).tolist() == ['A', 'B']
+
+
+def test_align_merges_unrelated_categories():
+    left = pd.Series(pd.Categorical(['A', 'B']))
+    right = pd.Series(pd.Categorical(['C', 'A'], categories=['C', 'A']))
+
+    aligned_left, aligned_right = align_hole_ids(left, right)
+
+    assert aligned_left.cat.categories.equals(aligned_right.cat.categories)
+    assert aligned_left.astype(str).tolist() == ['A', 'B']
+    assert aligned_right.astype(str).tolist() == ['C', 'A']
+
+
+def test_align_leaves_text_columns_alone():
+    left, right = pd.Series(['A']), pd.Series(pd.Categorical(['A']))
+
+    assert align_hole_ids(left, right) == (left, right)
+
+
+def test_encoded_frames_merge_like_strings():
+    dictionary = HoleDictionary()
+    collar = pd.DataFrame({'HoleID': ['A', 'B', 'C'], 'X': [1.0, 2.0, 3.0]})
+    survey = pd.DataFrame({'HoleID': ['C', 'A', 'A'], 'Depth': [0.0, 0.0, 10.0]})
+    expected = collar.merge(survey, on='HoleID').sort_values(['HoleID', 'Depth'], ignore_index=True)
+
+    encode_hole_ids(collar, dictionary)
+    encode_hole_ids(survey, dictionary)
+    result = collar.merge(survey, on='HoleID').sort_values(['HoleID', 'Depth'], ignore_index=True)
+
+    assert isinstance(result['HoleID'].dtype, pd.CategoricalDtype)
+    assert result['HoleID'].astype(str).tolist() == expected['HoleID'].tolist()
+    assert np.array_equal(result['Depth'], expected['Depth'])
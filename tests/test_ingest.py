@@ -0,0 +1,41 @@
+import io
+import numpy as np
+import pandas as pd
+from ingest import read_csv_chunked
+from parse_cache import store_cached, cache_available
+
+
+def csv_stream(df):
+    return io.BytesIO(df.to_csv(index=False).encode('utf-8'))
+
+
+def test_column_changing_type_between_chunks_is_read_as_text():
+    values = [str(i) for i in range(100)] + [f"S{i}" for i in range(50)]
+    df = pd.DataFrame({'Sample': values, 'Depth': np.arange(150, dtype=float)})
+
+    result = read_csv_chunked(csv_stream(df), 'utf-8', chunk_size=40)
+
+    assert not pd.api.types.is_numeric_dtype(result['Sample'])
+    assert {type(value) for value in result['Sample']} == {str}
+    assert result['Sample'].tolist() == values
+    assert pd.api.types.is_numeric_dtype(result['Depth'])
+    assert result['Depth'].tolist() == list(range(150))
+
+
+def test_chunked_read_keeps_empty_text_as_missing():
+    df = pd.DataFrame({'Code': ['1', '2', None, 'A'], 'Value': [1, 2, 3, 4]})
+
+    result = read_csv_chunked(csv_stream(df), 'utf-8', chunk_size=2)
+
+    assert result['Code'].isna().tolist() == [False, False, True, False]
+    assert result['Code'].dropna().tolist() == ['1', '2', 'A']
+
+
+def test_reconciled_frame_can_be_cached(tmp_path):
+    if not cache_available():
+        return
+    df = pd.DataFrame({'Sample': [str(i) for i in range(30)] + ['X'] * 30})
+
+    result = read_csv_chunked(csv_stream(df), 'utf-8', chunk_size=20)
+
+    assert store_cached('test', result, 'utf-8', cache_dir=str(tmp_path))
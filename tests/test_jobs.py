@@ -0,0 +1,73 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("streamlit")
+from jobs import JobRegistry  # noqa: E402
+
+TIMEOUT = 10
+
+
+def counting_job(job, steps, gate=None):
+    if gate is not None:
+        gate.wait(TIMEOUT)
+    for i in range(steps):
+        job.report("Count", (i + 1) / steps, f"{i + 1} of {steps}")
+    return steps
+
+
+def wait_for(job):
+    # A job cancelled while queued never runs, so wait on its status and not its future
+    deadline = time.monotonic() + TIMEOUT
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_finished_job_is_collected_once():
+    jobs = JobRegistry()
+    job = wait_for(jobs.submit("count", "Counting", counting_job, 5))
+
+    assert job.status == "done" and job.result == 5 and job.fraction == 1.0
+    assert job.message == "5 of 5"
+    assert jobs.running() == []
+    assert jobs.collect("count") is job
+    assert job.collected
+    assert jobs.collect("count") is None
+
+
+def test_cancel_stops_at_the_next_report():
+    jobs = JobRegistry()
+    gate = threading.Event()
+    job = jobs.submit("count", "Counting", counting_job, 5, gate=gate)
+    assert jobs.collect("count") is None
+
+    jobs.cancel("count")
+    gate.set()
+    wait_for(job)
+
+    assert job.status == "cancelled"
+    assert job.result is None
+
+
+def test_resubmitting_a_name_cancels_the_running_job():
+    jobs = JobRegistry()
+    gate = threading.Event()
+    first = jobs.submit("count", "Counting", counting_job, 5, gate=gate)
+    second = jobs.submit("count", "Counting again", counting_job, 3)
+    gate.set()
+
+    assert wait_for(first).status == "cancelled"
+    assert wait_for(second).result == 3
+    assert jobs.get("count") is second
+
+
+def test_failures_are_recorded_not_raised():
+    def failing_job(job):
+        raise RuntimeError("no survey")
+
+    jobs = JobRegistry()
+    job = wait_for(jobs.submit("fail", "Failing", failing_job))
+
+    assert job.status == "failed"
+    assert job.error == "no survey"
@@ -0,0 +1,58 @@
+import numpy as np
+from point_cloud import PointCloud, voxel_downsample, guess_coordinate_columns
+
+
+def scattered_points(n=20000, seed=5):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(0, 1000, n), rng.uniform(0, 500, n), rng.uniform(0, 100, n)])
+
+
+def test_downsample_keeps_budget_and_spread():
+    points = scattered_points()
+
+    rows = voxel_downsample(points, point_budget=1000)
+
+    assert 0 < len(rows) <= 1000
+    assert len(np.unique(rows)) == len(rows)
+    assert (np.diff(rows) > 0).all()
+    # One point per voxel still spans the whole set
+    kept = points[rows]
+    assert (np.ptp(kept, axis=0) > 0.8 * np.ptp(points, axis=0)).all()
+
+
+def test_downsample_keeps_only_points_in_extent():
+    points = scattered_points()
+    extent = ([100, 100, 0], [300, 200, 50])
+
+    rows = voxel_downsample(points, point_budget=200, extent=extent)
+
+    assert 0 < len(rows) <= 200
+    assert ((points[rows] >= extent[0]) & (points[rows] <= extent[1])).all()
+    # Under budget every point in the extent is kept
+    inside = ((points >= extent[0]) & (points <= extent[1])).all(axis=1)
+    assert voxel_downsample(points, point_budget=len(points), extent=extent).tolist() == np.flatnonzero(inside).tolist()
+
+
+def test_flat_points_get_square_voxels():
+    points = scattered_points()
+    points[:, 2] = 42.0
+
+    rows = voxel_downsample(points, point_budget=500)
+
+    assert 250 <= len(rows) <= 500
+
+
+def test_offsets_keep_precision_and_display_rows_are_cached():
+    coordinates = scattered_points(5000) + [500000.0, 7000000.0, 300.0]
+    cloud = PointCloud('cloud', coordinates)
+
+    np.testing.assert_allclose(cloud.coordinates(), coordinates, atol=1e-3)
+    rows = cloud.display_rows(point_budget=100)
+    assert cloud.display_rows(point_budget=100) is rows
+    assert cloud.display_rows(point_budget=200) is not rows
+
+
+def test_coordinate_columns_are_guessed_from_headers():
+    assert guess_coordinate_columns(['Sample', 'Easting', 'Northing', 'RL', 'Au']) == {
+        'DH_X': 'Easting', 'DH_Y': 'Northing', 'DH_Z': 'RL',
+    }
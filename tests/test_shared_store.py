@@ -0,0 +1,66 @@
+import gc
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from shared_store import SharedFrameStore, store_key
+
+
+def frame():
+    return pd.DataFrame({
+        'HoleID': pd.Categorical(['A', 'B', 'A']),
+        'Depth': [0.0, 10.0, 20.0],
+        'Code': pd.array(['x', None, 'z'], dtype=object),
+        'Count': np.array([1, 2, 3], dtype=np.int32),
+    })
+
+
+def test_round_trip_is_read_only_and_equal(tmp_path):
+    store = SharedFrameStore(directory=str(tmp_path))
+    df = frame()
+
+    handle = store.share(df, key='upload')
+    shared = handle.frame()
+
+    pd.testing.assert_frame_equal(shared.copy(deep=True), df)
+    _, _, values = store.entries[handle.key]['values']
+    assert not values[1].flags.writeable
+    with pytest.raises(ValueError):
+        values[1][0] = 5.0
+    with pytest.raises(ValueError):
+        shared.loc[0, 'Depth'] = 5.0
+    # Replacing or adding columns only changes this frame
+    shared['Depth'] = shared['Depth'] + 1
+    shared['New'] = 1
+    assert handle.frame()['Depth'].tolist() == [0.0, 10.0, 20.0]
+    assert 'New' not in handle.frame().columns
+
+
+def test_entries_are_ref_counted_and_evicted_once_released(tmp_path):
+    store = SharedFrameStore(directory=str(tmp_path), max_bytes=0)
+
+    first = store.share(frame(), key='upload')
+    second = store.open('upload')
+    key = first.key
+    assert store.entries[key]['refs'] == 2
+
+    del first
+    gc.collect()
+    assert store.entries[key]['refs'] == 1
+
+    del second
+    gc.collect()
+    assert key not in store
+    assert not os.path.exists(tmp_path / key)
+
+
+def test_store_reopens_entries_and_drops_unfinished_writes(tmp_path):
+    SharedFrameStore(directory=str(tmp_path)).share(frame(), key='upload')
+    (tmp_path / 'partial.tmp').mkdir()
+
+    store = SharedFrameStore(directory=str(tmp_path))
+
+    assert store_key('upload') in store
+    assert not (tmp_path / 'partial.tmp').exists()
+    pd.testing.assert_frame_equal(store.open('upload').frame().copy(deep=True), frame())
+    assert store.open('other') is None
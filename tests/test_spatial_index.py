@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from spatial_index import TraceSpatialIndex
+from trace_query import resample_traces
+
+STEP = 5.0
+
+
+def brute_force_hole_distances(traces, points):
+    """Distance from every point to every hole's resampled polyline, checking every segment."""
+    stations = resample_traces(traces, STEP)
+    rows = []
+    for (dataset, hole_id), hole in stations.groupby(['Dataset', 'HoleID'], observed=True, sort=False):
+        xyz = hole.sort_values('Depth')[['DH_X', 'DH_Y', 'DH_Z']].to_numpy()
+        a, b = xyz[:-1], xyz[1:]
+        for query, p in enumerate(points):
+            ab = b - a
+            t = np.clip(np.einsum('ij,ij->i', p - a, ab) / np.einsum('ij,ij->i', ab, ab), 0.0, 1.0)
+            distance = np.linalg.norm(p - (a + t[:, None] * ab), axis=1).min()
+            rows.append((query, dataset, str(hole_id), distance))
+    return pd.DataFrame(rows, columns=['Query', 'Dataset', 'HoleID', 'Distance'])
+
+
+def query_points(n=25, seed=3):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(-20, 220, n), rng.uniform(-20, 220, n), rng.uniform(-40, 110, n)])
+
+
+def test_nearest_holes_match_brute_force(traces):
+    index = TraceSpatialIndex(step=STEP)
+    index.update(traces)
+    points = query_points()
+
+    result = index.nearest_holes(points, k=3)
+
+    expected = brute_force_hole_distances(traces, points).sort_values(['Query', 'Distance'], kind='stable').groupby('Query').head(3)
+    assert result['Query'].tolist() == expected['Query'].tolist()
+    assert result['HoleID'].astype(str).tolist() == expected['HoleID'].tolist()
+    np.testing.assert_allclose(result['Distance'], expected['Distance'], atol=1e-6)
+
+
+def test_within_radius_matches_brute_force(traces):
+    index = TraceSpatialIndex(step=STEP)
+    index.update(traces)
+    points = query_points(seed=4)
+
+    result = index.within_radius(points, 30.0)
+
+    expected = brute_force_hole_distances(traces, points)
+    expected = expected[expected['Distance'] <= 30.0]
+    found = set(zip(result['Query'], result['HoleID'].astype(str)))
+    assert found == set(zip(expected['Query'], expected['HoleID']))
+    np.testing.assert_allclose(
+        result.sort_values(['Query', 'HoleID'])['Distance'],
+        expected.sort_values(['Query', 'HoleID'])['Distance'],
+        atol=1e-6,
+    )
+
+
+def test_update_rebuilds_only_changed_datasets(traces):
+    index = TraceSpatialIndex(step=STEP)
+    assert sorted(index.update(traces)) == ['Dataset_1', 'Dataset_2']
+
+    moved = traces.copy()
+    moved.loc[moved['Dataset'] == 'Dataset_2', 'DH_X'] += 1.0
+
+    assert index.update(moved) == ['Dataset_2']
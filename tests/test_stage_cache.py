@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from stage_cache import StageCache, advance_key, estimate_bytes, stage_key
+
+
+def test_estimate_counts_text_values():
+    ids = pd.Series([f"HOLE_{i:06d}" for i in range(1000)], dtype=object)
+
+    assert estimate_bytes(pd.DataFrame({'HoleID': ids})) > 1000 * len("HOLE_000000")
+    assert estimate_bytes(ids) > 1000 * len("HOLE_000000")
+
+
+def test_cache_evicts_least_recently_used_over_the_cap():
+    frame = pd.DataFrame({'HoleID': [f"H{i:08d}" for i in range(100)]}, dtype=object)
+    cache = StageCache(max_bytes=int(estimate_bytes(frame) * 2.5))
+    for key in 'abc':
+        cache.put('stage', key, frame)
+        if key == 'b':
+            cache.get('stage', 'a')
+
+    assert cache.get('stage', 'b') is None
+    assert cache.get('stage', 'a') is not None
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_hits_are_shallow_copies():
+    cache = StageCache()
+    cache.put('stage', 'k', pd.DataFrame({'x': np.arange(3)}))
+
+    hit = cache.get('stage', 'k')
+    hit['y'] = 1
+
+    assert list(cache.get('stage', 'k').columns) == ['x']
+
+
+def test_keys_chain_and_none_stays_none():
+    assert advance_key(None, 'types') is None
+    assert advance_key('k', 'types', 1) == stage_key('k', 'types', 1)
+    assert stage_key('k', 'types', 1) != stage_key('k', 'types', 2)
@@ -0,0 +1,59 @@
+import numpy as np
+from anticollision import TraceSegments
+from surfaces import Surface, intersect_surface, segment_triangle_hits, read_obj
+
+STEP = 5.0
+
+
+def wavy_surface(z0=40.0, n=17, size=240.0):
+    """A gently undulating grid of triangles under the collars."""
+    xs = np.linspace(-20, size - 20, n)
+    gx, gy = np.meshgrid(xs, xs, indexing='ij')
+    gz = z0 + 8 * np.sin(gx / 30) * np.cos(gy / 40)
+    vertices = np.column_stack([gx.ravel(), gy.ravel(), gz.ravel()])
+    cells = np.arange(n * n).reshape(n, n)[:-1, :-1].ravel()
+    triangles = np.concatenate([
+        np.column_stack([cells, cells + n, cells + 1]),
+        np.column_stack([cells + 1, cells + n, cells + n + 1]),
+    ])
+    return Surface('wavy', vertices, triangles)
+
+
+def brute_force_pierces(segments, surface):
+    """Every segment tested against every triangle."""
+    corners = surface.vertices[surface.triangles]
+    segment = np.repeat(np.arange(len(segments)), len(corners))
+    triangle = np.tile(np.arange(len(corners)), len(segments))
+    hit, t = segment_triangle_hits(segments.start[segment], segments.end[segment], corners[triangle])
+    depth = segments.depth_from[segment[hit]] + t[hit] * (segments.depth_to[segment[hit]] - segments.depth_from[segment[hit]])
+    holes = segments.holes['HoleID'].to_numpy()[segments.hole[segment[hit]]]
+    # A pierce through a shared edge hits both triangles; keep one per hole and depth
+    return sorted({(hole, round(float(d), 6)) for hole, d in zip(holes, depth)})
+
+
+def test_pierces_match_testing_every_triangle(traces):
+    surface = wavy_surface()
+    segments = TraceSegments(traces, STEP)
+
+    result = intersect_surface(traces, surface, step=STEP, batch_segments=50)
+
+    expected = brute_force_pierces(segments, surface)
+    assert len(expected) >= len(segments.holes)
+    assert sorted(zip(result['HoleID'], result['Depth'].round(6))) == expected
+
+
+def test_pierce_points_lie_on_a_flat_surface(traces):
+    surface = Surface('flat', [[-50, -50, 30], [300, -50, 30], [300, 300, 30], [-50, 300, 30]], [[0, 1, 2], [0, 2, 3]])
+
+    result = intersect_surface(traces, surface, step=STEP)
+
+    # Every hole starts above the plane and ends below it, so it pierces it exactly once
+    assert sorted(result['HoleID']) == sorted(traces['HoleID'].astype(str).unique())
+    np.testing.assert_allclose(result['DH_Z'], 30.0)
+
+
+def test_obj_polygons_are_split_into_triangles():
+    vertices, triangles = read_obj(b"v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nf 1 2 3 4\nf -4/1/1 -2/2/2 -1/3/3\n")
+
+    assert vertices.shape == (4, 3)
+    assert triangles.tolist() == [[0, 1, 2], [0, 2, 3], [0, 2, 3]]
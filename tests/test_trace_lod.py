@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from trace_lod import choose_tolerance, decimate_traces
+
+
+def zigzag_traces(holes, stations):
+    rng = np.random.default_rng(0)
+    n = holes * stations
+    return pd.DataFrame({
+        'Dataset': 'Dataset_1',
+        'HoleID': np.repeat([f"H{i}" for i in range(holes)], stations),
+        'DH_X': rng.random(n),
+        'DH_Y': rng.random(n),
+        'DH_Z': -np.tile(np.arange(stations, dtype=float), holes),
+    })
+
+
+def test_tolerance_stays_finite_when_end_stations_fill_the_budget():
+    importance = np.array([np.inf, 5.0, 3.0, np.inf, np.inf, 4.0, np.inf])
+
+    tolerance = choose_tolerance(importance, 0.0, point_budget=3)
+
+    assert np.isfinite(tolerance)
+    # Every end station plus the station of largest deviation
+    assert np.flatnonzero(importance > tolerance).tolist() == [0, 1, 3, 4, 6]
+
+
+def test_decimation_keeps_end_stations_and_fills_the_rest_of_the_budget():
+    df = zigzag_traces(holes=100, stations=5)
+
+    result = decimate_traces(df, point_budget=250)
+
+    assert len(result) == 250
+    ends = df.groupby('HoleID').nth([0, -1]).index
+    assert set(ends) <= set(result.index)
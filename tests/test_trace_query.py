@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from desurvey import desurvey_traces, merge_collar_survey
+from hole_dictionary import HoleDictionary, encode_hole_ids
+from trace_query import TraceIndex, locate_points, locate_intervals, resample_traces
+
+
+def traces(dictionary=None):
+    df_collar = pd.DataFrame({'HoleID': ['A', 'B'], 'DH_X': [100.0, 500.0], 'DH_Y': [200.0, 600.0], 'DH_Z': [50.0, 40.0]})
+    df_survey = pd.DataFrame({
+        'HoleID': ['A', 'A', 'A', 'B', 'B'],
+        'Depth': [0.0, 50.0, 100.0, 0.0, 80.0],
+        'Azimuth': [0.0, 10.0, 20.0, 90.0, 90.0],
+        'Dip': [-60.0, -62.0, -65.0, -90.0, -90.0],
+    })
+    if dictionary is not None:
+        encode_hole_ids(df_collar, dictionary)
+        encode_hole_ids(df_survey, dictionary)
+    return desurvey_traces(merge_collar_survey(df_collar, df_survey))
+
+
+def test_locate_at_stations_returns_station_coordinates():
+    df_traces = traces()
+    x, y, z = TraceIndex(df_traces).locate(df_traces['HoleID'].to_numpy(), df_traces['Depth'].to_numpy())
+
+    assert np.allclose(x, df_traces['DH_X'])
+    assert np.allclose(y, df_traces['DH_Y'])
+    assert np.allclose(z, df_traces['DH_Z'])
+
+
+def test_vertical_hole_locates_straight_down_from_collar():
+    x, y, z = TraceIndex(traces()).locate(np.array(['B', 'B', 'B']), np.array([0.0, 30.0, 120.0]))
+
+    assert np.allclose(x, 500.0)
+    assert np.allclose(y, 600.0)
+    assert np.allclose(z, [40.0, 10.0, -80.0])
+
+
+def test_unknown_holes_and_missing_depths_are_nan():
+    x, y, z = TraceIndex(traces()).locate(np.array(['A', 'C']), np.array([np.nan, 10.0]))
+
+    assert np.isnan(x).all() and np.isnan(y).all() and np.isnan(z).all()
+
+
+def test_dictionary_codes_locate_like_strings():
+    dictionary = HoleDictionary(['Z'])
+    df_traces = traces(dictionary)
+    df_points = pd.DataFrame({'HoleID': ['B', 'A', 'C', 'A'], 'Depth': [30.0, 75.0, 5.0, 100.0]})
+    expected = locate_points(df_points, TraceIndex(traces()))
+
+    # A hole added to the dictionary after the traces were built is still matched on codes
+    encode_hole_ids(df_points, dictionary)
+    index = TraceIndex(df_traces)
+    assert index.categories is not None
+    result = locate_points(df_points, index)
+
+    pd.testing.assert_frame_equal(result[['DH_X', 'DH_Y', 'DH_Z']], expected[['DH_X', 'DH_Y', 'DH_Z']])
+    assert result['DH_X'].isna().tolist() == [False, False, True, False]
+
+
+def test_intervals_get_from_to_and_mid_coordinates():
+    df_intervals = pd.DataFrame({'HoleID': ['B'], 'From': [10.0], 'To': [30.0]})
+
+    result = locate_intervals(df_intervals, TraceIndex(traces()))
+
+    assert result[['DH_Z_From', 'DH_Z_To', 'DH_Z_Mid']].iloc[0].tolist() == pytest.approx([30.0, 10.0, 20.0])
+
+
+def test_resample_places_stations_every_step_to_end_of_hole():
+    df_traces = traces()
+
+    result = resample_traces(df_traces, step=30.0)
+
+    hole_b = result[result['HoleID'] == 'B']
+    assert hole_b['Depth'].tolist() == [0.0, 30.0, 60.0, 80.0]
+    assert np.allclose(hole_b['DH_Z'], [40.0, 10.0, -20.0, -40.0])
+    hole_a = result[result['HoleID'] == 'A']
+    assert hole_a['Depth'].tolist() == [0.0, 30.0, 60.0, 90.0, 100.0]
+    station = df_traces[(df_traces['HoleID'] == 'A') & (df_traces['Depth'] == 100.0)]
+    assert np.allclose(hole_a[['DH_X', 'DH_Y', 'DH_Z']].iloc[-1], station[['DH_X', 'DH_Y', 'DH_Z']].iloc[0])
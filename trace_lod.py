@@ -0,0 +1,106 @@
+# trace_lod.py
+
+import logging
+import numpy as np
+from desurvey import hole_offsets
+from config import LOD_POINT_BUDGET, LOD_TOLERANCE_FRACTION
+
+logger = logging.getLogger(__name__)
+
+
+def point_segment_distance(p, a, b):
+    """Distance from points p to segments a-b, row by row."""
+    ab = b - a
+    ab_len2 = np.einsum('ij,ij->i', ab, ab)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(ab_len2 > 0, np.einsum('ij,ij->i', p - a, ab) / ab_len2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest = a + t[:, None] * ab
+    return np.linalg.norm(p - closest, axis=1)
+
+
+def douglas_peucker_importance(points, starts):
+    """Douglas-Peucker split distance of every station, for all holes at once.
+
+    Every pass splits all open ranges of all holes together. A station's importance is
+    the deviation at which it gets split off, capped by its parent's so that keeping
+    importance > tolerance reproduces Douglas-Peucker at that tolerance. End stations
+    of a hole are always kept (importance inf).
+    """
+    n = len(points)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    ends = np.r_[starts[1:], n] - 1
+    importance[starts] = np.inf
+    importance[ends] = np.inf
+
+    lo, hi, cap = starts, ends, np.full(len(starts), np.inf)
+    while True:
+        interior = hi - lo - 1
+        open_ranges = interior > 0
+        lo, hi, cap, interior = lo[open_ranges], hi[open_ranges], cap[open_ranges], interior[open_ranges]
+        if len(lo) == 0:
+            break
+
+        # Flatten the interior stations of every open range
+        range_id = np.repeat(np.arange(len(lo)), interior)
+        range_start = np.r_[0, np.cumsum(interior)[:-1]]
+        idx = lo[range_id] + 1 + (np.arange(len(range_id)) - range_start[range_id])
+        dist = point_segment_distance(points[idx], points[lo[range_id]], points[hi[range_id]])
+        dist = np.nan_to_num(dist, nan=0.0)
+
+        # Split each range at its first farthest station
+        max_dist = np.maximum.reduceat(dist, range_start)
+        candidates = np.flatnonzero(dist == max_dist[range_id])
+        _, first = np.unique(range_id[candidates], return_index=True)
+        split = idx[candidates[first]]
+        split_importance = np.minimum(max_dist, cap)
+        importance[split] = split_importance
+
+        lo, hi, cap = np.r_[lo, split], np.r_[split, hi], np.r_[split_importance, split_importance]
+
+    return importance
+
+
+def choose_tolerance(importance, extent_size, point_budget=LOD_POINT_BUDGET, tolerance_fraction=LOD_TOLERANCE_FRACTION):
+    """Tolerance that hides sub-pixel detail for the view extent and keeps the point count within budget.
+
+    End stations are always kept, so the budget left after them goes to the stations
+    of largest deviation; when the ends alone fill it, the single largest still is.
+    The tolerance is always finite.
+    """
+    tolerance = extent_size * tolerance_fraction
+    interior = importance[np.isfinite(importance)]
+    if point_budget and np.count_nonzero(importance > tolerance) > point_budget:
+        remaining = max(point_budget - (len(importance) - len(interior)), 1)
+        if remaining < len(interior):
+            # Keeping importance > the (remaining + 1)-th largest keeps at most remaining stations
+            tolerance = max(tolerance, np.partition(interior, -(remaining + 1))[-(remaining + 1)])
+    return tolerance
+
+
+def decimate_traces(df_dh_traces, point_budget=LOD_POINT_BUDGET, extent=None):
+    """Simplify every hole of a trace frame for display, keeping collars and ends of hole.
+
+    extent is the ((min_x, min_y, min_z), (max_x, max_y, max_z)) box in view; by default
+    the traces' own bounding box.
+    """
+    if df_dh_traces.empty:
+        return df_dh_traces
+
+    hole_codes = df_dh_traces.groupby(['Dataset', 'HoleID'], sort=False, observed=True).ngroup().to_numpy()
+    order = np.argsort(hole_codes, kind='stable')
+    starts = hole_offsets(hole_codes[order])
+    points = df_dh_traces[['DH_X', 'DH_Y', 'DH_Z']].to_numpy(dtype=float)[order]
+
+    importance = douglas_peucker_importance(points, starts)
+
+    if extent is None:
+        extent = (np.nanmin(points, axis=0), np.nanmax(points, axis=0))
+    extent_size = float(np.linalg.norm(np.asarray(extent[1], dtype=float) - np.asarray(extent[0], dtype=float)))
+    tolerance = choose_tolerance(importance, extent_size, point_budget)
+
+    keep = np.sort(order[importance > tolerance])
+    logger.info(f"LOD kept {len(keep)} of {len(df_dh_traces)} stations at tolerance {tolerance:.3f}")
+    return df_dh_traces.iloc[keep]
@@ -0,0 +1,243 @@
+# trace_query.py
+
+import logging
+import numpy as np
+import pandas as pd
+from desurvey import calculate_xyz, hole_offsets
+from config import RESAMPLE_STEP
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_TRACE_COLS = ['HoleID', 'Depth', 'Dip', 'Azimuth', 'DH_X', 'DH_Y', 'DH_Z', 'DH_dX', 'DH_dY', 'DH_dZ']
+
+
+def direction_vectors(dip, azimuth):
+    """Unit (north, east, down) vectors of survey orientations, using desurvey's dip convention."""
+    inc = np.radians(90 + np.asarray(dip, dtype=float))
+    azi = np.radians(np.asarray(azimuth, dtype=float))
+    return np.stack([np.sin(inc) * np.cos(azi), np.sin(inc) * np.sin(azi), np.cos(inc)], axis=-1)
+
+
+def direction_angles(vectors):
+    """Inverse of direction_vectors: (dip, azimuth) in degrees."""
+    inc = np.arccos(np.clip(vectors[..., 2], -1.0, 1.0))
+    azimuth = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0])) % 360
+    return np.degrees(inc) - 90, azimuth
+
+
+def slerp_directions(t1, t2, fraction):
+    """Directions a fraction of the way around the minimum-curvature arc from t1 to t2."""
+    cos_B = np.clip(np.einsum('ij,ij->i', t1, t2), -1.0, 1.0)
+    B = np.arccos(cos_B)
+    sin_B = np.sin(B)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w1 = np.where(sin_B > 1e-12, np.sin((1 - fraction) * B) / sin_B, 1 - fraction)
+        w2 = np.where(sin_B > 1e-12, np.sin(fraction * B) / sin_B, fraction)
+    t = w1[:, None] * t1 + w2[:, None] * t2
+    norm = np.linalg.norm(t, axis=1)
+    return t / np.where(norm > 0, norm, 1.0)[:, None]
+
+
+class TraceIndex:
+    """Desurveyed stations of every hole, arranged for batched depth -> XYZ lookups.
+
+    Build it once from a trace frame of one dataset and query millions of depths in a
+    single call. Positions between stations follow the same minimum-curvature arc the
+    desurvey used; above the first station the hole runs straight up to its collar, and
+    below the last station it continues straight along the last survey direction.
+    """
+
+    def __init__(self, df_dh_traces):
+        for col in REQUIRED_TRACE_COLS:
+            if col not in df_dh_traces.columns:
+                raise ValueError(f"Required column '{col}' not found in drill traces")
+
+        # Stations without a depth cannot be located along the hole
+        df_dh_traces = df_dh_traces[df_dh_traces['Depth'].notna()]
+        hole_column = df_dh_traces['HoleID']
+        if isinstance(hole_column.dtype, pd.CategoricalDtype):
+            # HoleIDs encoded with a dataset's dictionary: number holes from the codes, no string hashing
+            df_dh_traces = df_dh_traces[hole_column.notna()]
+            used_codes, hole_codes = np.unique(df_dh_traces['HoleID'].cat.codes.to_numpy(), return_inverse=True)
+            self.categories = hole_column.cat.categories
+            self.code_holes = np.full(len(self.categories), -1, dtype=np.int64)
+            self.code_holes[used_codes] = np.arange(len(used_codes))
+            hole_ids = self.categories[used_codes].astype(str)
+        else:
+            self.categories = None
+            hole_codes, hole_ids = pd.factorize(hole_column.astype(str))
+        depth = df_dh_traces['Depth'].to_numpy(dtype=float)
+        order = np.lexsort((depth, hole_codes))
+        self.hole_ids = pd.Index(hole_ids)
+        self.starts = hole_offsets(hole_codes[order])
+        self.ends = np.r_[self.starts[1:], len(order)]
+        self.depth = depth[order]
+        self.dip = df_dh_traces['Dip'].to_numpy(dtype=float)[order]
+        self.azimuth = df_dh_traces['Azimuth'].to_numpy(dtype=float)[order]
+        self.xyz = df_dh_traces[['DH_X', 'DH_Y', 'DH_Z']].to_numpy(dtype=float)[order]
+        self.directions = direction_vectors(self.dip, self.azimuth)
+
+        # Shift each hole's depths into its own disjoint range so one searchsorted serves every hole
+        lengths = self.ends - self.starts
+        hole_min = np.minimum(self.depth[self.starts], 0.0)
+        hole_max = self.depth[self.ends - 1]
+        self.hole_base = np.r_[0.0, np.cumsum(hole_max - hole_min + 1.0)[:-1]] - hole_min
+        self.hole_limit = self.hole_base + hole_max
+        self.keys = self.depth + np.repeat(self.hole_base, lengths)
+
+        # Collars: the first station's position less its increment from the collar
+        first = self.starts
+        d_xyz = df_dh_traces[['DH_dX', 'DH_dY', 'DH_dZ']].to_numpy(dtype=float)[order][first]
+        self.collars = self.xyz[first] - d_xyz * np.array([1.0, 1.0, -1.0])
+
+    def __len__(self):
+        return len(self.hole_ids)
+
+    @property
+    def hole_depths(self):
+        """Depth of the last station of every hole."""
+        return self.depth[self.ends - 1]
+
+    def hole_index(self, hole_ids):
+        """Index of each hole in this trace index; -1 for holes without a trace."""
+        codes = self._shared_codes(hole_ids)
+        if codes is not None:
+            known = (codes >= 0) & (codes < len(self.code_holes))
+            return np.where(known, self.code_holes[np.where(known, codes, 0)], -1)
+        # Look up each distinct hole once; queries repeat the same holes many times over
+        codes, uniques = pd.factorize(np.asarray(hole_ids, dtype=object))
+        positions = self.hole_ids.get_indexer(np.asarray(uniques, dtype=object).astype(str))
+        return np.where(codes >= 0, positions[np.maximum(codes, 0)], -1)
+
+    def _shared_codes(self, hole_ids):
+        """Codes of hole_ids when they share this index's dictionary, or None to look them up as strings.
+
+        A dictionary only appends, so two encodings of one dataset share codes whenever
+        one's categories are a prefix of the other's.
+        """
+        if self.categories is None or not isinstance(getattr(hole_ids, 'dtype', None), pd.CategoricalDtype):
+            return None
+        categories = hole_ids.cat.categories
+        common = min(len(categories), len(self.categories))
+        if not categories[:common].equals(self.categories[:common]):
+            return None
+        return hole_ids.cat.codes.to_numpy()
+
+    def locate(self, hole_ids, depths):
+        """Return x, y, z arrays for arrays of (hole, depth); NaN for unknown holes or depths."""
+        return self.locate_indexed(self.hole_index(hole_ids), depths)
+
+    def locate_indexed(self, hole, depths):
+        """locate() for holes already converted with hole_index()."""
+        depths = np.asarray(depths, dtype=float)
+        x, y, z = (np.full(len(depths), np.nan) for _ in range(3))
+        found = (hole >= 0) & ~np.isnan(depths)
+        if not found.any():
+            return x, y, z
+
+        hole = hole[found]
+        query = np.maximum(depths[found], 0.0)
+        lo, hi = self.starts[hole], self.ends[hole]
+
+        # Anchor on the last station at or above the query depth, or the collar above the first station
+        # Depths past the end of hole are clipped to the last station so they stay in their hole's range
+        keys = np.minimum(query + self.hole_base[hole], self.hole_limit[hole])
+        after = np.clip(np.searchsorted(self.keys, keys, side='right'), lo, hi)
+        anchor = after - 1
+        above_first = anchor < lo
+        below_last = after >= hi
+        anchor = np.maximum(anchor, lo)
+        following = np.minimum(after, hi - 1)
+
+        anchor_depth = np.where(above_first, 0.0, self.depth[anchor])
+        anchor_xyz = np.where(above_first[:, None], self.collars[hole], self.xyz[anchor])
+        t1 = self.directions[anchor]
+        t2 = self.directions[following]
+
+        # Straight runs above the first and below the last station keep one direction
+        straight = above_first | below_last
+        t2 = np.where(straight[:, None], t1, t2)
+        span = np.where(straight, 1.0, self.depth[following] - anchor_depth)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(span > 0, (query - anchor_depth) / span, 0.0)
+
+        dip_1, azi_1 = direction_angles(t1)
+        dip_q, azi_q = direction_angles(slerp_directions(t1, t2, np.where(straight, 1.0, fraction)))
+        _, _, dN, dE, dV = calculate_xyz(anchor_depth, dip_1, azi_1, query, dip_q, azi_q)
+
+        x[found] = anchor_xyz[:, 0] + dE
+        y[found] = anchor_xyz[:, 1] + dN
+        z[found] = anchor_xyz[:, 2] - dV  # Subtract dV because depth increases downwards
+        return x, y, z
+
+
+def locate_points(df_points, trace_index):
+    """Add DH_X, DH_Y, DH_Z at every HoleID/Depth of a Point frame."""
+    x, y, z = trace_index.locate(df_points['HoleID'], df_points['Depth'].to_numpy(dtype=float))
+    return df_points.assign(DH_X=x, DH_Y=y, DH_Z=z)
+
+
+def locate_intervals(df_intervals, trace_index):
+    """Add XYZ at the From, To and midpoint depths of every interval of an Interval frame."""
+    hole = trace_index.hole_index(df_intervals['HoleID'])
+    depth_from = df_intervals['From'].to_numpy(dtype=float)
+    depth_to = df_intervals['To'].to_numpy(dtype=float)
+    depth_mid = (depth_from + depth_to) / 2
+    n = len(df_intervals)
+
+    # All three depths of every interval go through one query
+    x, y, z = trace_index.locate_indexed(np.tile(hole, 3), np.concatenate([depth_from, depth_to, depth_mid]))
+    columns = {}
+    for idx, suffix in enumerate(['From', 'To', 'Mid']):
+        rows = slice(idx * n, (idx + 1) * n)
+        columns[f'DH_X_{suffix}'] = x[rows]
+        columns[f'DH_Y_{suffix}'] = y[rows]
+        columns[f'DH_Z_{suffix}'] = z[rows]
+    return df_intervals.assign(**columns)
+
+
+def resample_depths(hole_end, step):
+    """Depths every step metres from the collar to each hole's end, plus the end itself.
+
+    Returns the hole index and depth of every new station, grouped by hole.
+    """
+    hole_end = np.maximum(np.nan_to_num(hole_end, nan=0.0), 0.0)
+    n_steps = np.floor(hole_end / step + 1e-9).astype(np.int64) + 1
+    has_end = hole_end - (n_steps - 1) * step > 1e-9
+    counts = n_steps + has_end
+
+    hole = np.repeat(np.arange(len(hole_end)), counts)
+    step_idx = np.arange(len(hole)) - np.repeat(np.cumsum(counts) - counts, counts)
+    depth = step_idx * step
+    # Holes that do not end on a step get a closing station at the end of hole
+    last = np.cumsum(counts) - 1
+    depth[last[has_end]] = hole_end[has_end]
+    return hole, depth
+
+
+def resample_traces(df_dh_traces, step=RESAMPLE_STEP):
+    """Stations every step metres down every hole of a trace frame, following the minimum-curvature path."""
+    if step is None or step <= 0:
+        raise ValueError("Resampling step must be a positive number of metres")
+
+    groups = df_dh_traces.groupby('Dataset', sort=False, observed=True) if 'Dataset' in df_dh_traces.columns else [(None, df_dh_traces)]
+    resampled = []
+    for dataset, dataset_traces in groups:
+        trace_index = TraceIndex(dataset_traces)
+        hole, depth = resample_depths(trace_index.hole_depths, step)
+        x, y, z = trace_index.locate_indexed(hole, depth)
+        df_resampled = pd.DataFrame({
+            'HoleID': pd.Categorical.from_codes(hole, categories=trace_index.hole_ids),
+            'Depth': depth,
+            'DH_X': x,
+            'DH_Y': y,
+            'DH_Z': z,
+        })
+        if dataset is not None:
+            df_resampled['Dataset'] = dataset
+        resampled.append(df_resampled)
+
+    if not resampled:
+        return pd.DataFrame(columns=['HoleID', 'Depth', 'DH_X', 'DH_Y', 'DH_Z'])
+    logger.info(f"Resampled {len(df_dh_traces)} survey stations to {sum(len(df) for df in resampled)} stations every {step} m")
+    return pd.concat(resampled, ignore_index=True)
@@ -3,7 +3,7 @@
 import pandas as pd
 
 class File:
-    def __init__(self, name, df, category=None, columns=None, columns_dtypes=None, required_cols=None, simplified_dtypes=None, user_defined_dtypes=None, df_reassigned_dtypes=None, dataset=None, group_name=None):
+    def __init__(self, name, df, category=None, columns=None, columns_dtypes=None, required_cols=None, simplified_dtypes=None, user_defined_dtypes=None, df_reassigned_dtypes=None, dataset=None, group_name=None, column_fingerprints=None, shared_frame=None, content_key=None):
         self.name = name
         self.df = df
         self.category = category
@@ -15,6 +15,11 @@ class File:
         self.df_reassigned_dtypes = df_reassigned_dtypes or {}
         self.dataset = dataset
         self.group_name = group_name
+        self.column_fingerprints = column_fingerprints or {}
+        # Keeps the shared store entry behind df alive for as long as the file is
+        self.shared_frame = shared_frame
+        # Key of df's content for the stage cache: the upload's hash, advanced by every stage applied to it
+        self.content_key = content_key
 
 def required_cols(file):
     required_cols_dict = {